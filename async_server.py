@@ -0,0 +1,103 @@
+from utils import OPCODES, FRAME_HEADER, MAX_FRAME_SIZE
+from server import Server, LISTEN_BACKLOG, log
+import asyncio
+
+
+class AsyncServer(Server):
+    """Server that runs the same message handlers on asyncio streams."""
+
+    def __init__(self, ip, port, password, **queue_limits):
+        super().__init__(ip, port, password, **queue_limits)
+        self.loop = None
+        self.stop_event = None
+
+    def start_listening(self):
+        asyncio.run(self.serve())
+        log.info("[SHUTDOWN] Server has shut down")
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        server = await asyncio.start_server(
+            self.handle_connection, self.ip, self.port, backlog=LISTEN_BACKLOG)
+        self.server_socket = server.sockets[0]
+        # shutdown() may have been called before the loop was running.
+        if not self.is_running:
+            self.stop_event.set()
+        async with server:
+            try:
+                await self.stop_event.wait()
+            finally:
+                self.auth_pool.shutdown(cancel_futures=True)
+                self.history_pool.shutdown()
+                self.close_all_connections()
+                self.close_rooms()
+
+    def shutdown(self):
+        self.is_running = False
+        log.info("[SHUTDOWN] Shutting down server")
+        if self.loop and self.stop_event:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def handle_connection(self, reader, writer):
+        address = writer.get_extra_info("peername")
+        fd = writer.get_extra_info("socket").fileno()
+        client = self.create_user(writer, address, fd, reader=reader)
+        self.welcome_client(client)
+        try:
+            while client in self.users:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                code, length = FRAME_HEADER.unpack(header)
+                # Refused before reading, so a header cannot make us buffer
+                # gigabytes for it.
+                if length > MAX_FRAME_SIZE:
+                    log.warning("[BADFRAME] Oversized frame from %s", client.address[0])
+                    break
+                payload = await reader.readexactly(length)
+                self.handle_frame(client, code.rstrip(b"\x00"), payload)
+                # Wait for our own writes to flush before reading more, so a
+                # client that never reads cannot make its buffer grow forever.
+                if client in self.users:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, OSError):
+            # Any socket error, such as a reset or a timed out connection,
+            # only ends this client's connection.
+            pass
+        finally:
+            self.disconnect_client(client)
+
+    def call_in_loop(self, function, *args):
+        try:
+            self.loop.call_soon_threadsafe(function, *args)
+        except RuntimeError:  # The server has shut down and closed its loop.
+            pass
+
+    def queue_frame(self, client, frame, droppable=False):
+        writer = client.connection
+        # Writing to a closing transport only logs a warning, so skip it.
+        if client.is_slow or writer.is_closing():
+            return
+        writer.writelines(frame)
+        # asyncio owns the buffered bytes, so frames cannot be dropped from
+        # them. A client this far behind is disconnected whatever the policy.
+        if writer.transport.get_write_buffer_size() > self.max_queue_bytes:
+            client.is_slow = True
+            log.warning("[SLOWCLIENT] %s could not keep up", client.address)
+            self.loop.call_soon(self.disconnect_client, client)
+
+    def queue_depth(self, client):
+        # The transport only tracks bytes, not frames.
+        return None, client.connection.transport.get_write_buffer_size()
+
+    def disconnect_client(self, client):
+        if client not in self.users:
+            return
+        client.connection.close()
+        self.remove_client(client)
+
+    def close_all_connections(self):
+        # Tell every client the server is going down, then close.
+        for client in self.users:
+            self.send(client, OPCODES["server_shutdown"])
+            client.connection.close()
+        self.users.clear()
@@ -0,0 +1,82 @@
+"""
+Cost of building and queueing one broadcast for a room of N users.
+
+No sockets are involved, so this measures only the work publish_message
+and publish_drawing do before the kernel takes over. The per-recipient
+column re-encodes the frame for every user, as the server used to.
+
+Run from the repository root:
+
+    python -m benchmarks.fanout --users 100 1000 5000
+"""
+from utils import OPCODES, OutboundQueue, User, pack_frame, pack_sender, pack_drawing_info, RAW_RGB
+from server import Server
+import argparse
+import timeit
+
+
+class QueueOnlyServer(Server):
+    """Server whose frames are queued but never written to a socket."""
+
+    def queue_frame(self, client, frame, droppable=False):
+        client.outbound.push(frame, droppable)
+
+
+def make_server(num_users):
+    server = QueueOnlyServer("127.0.0.1", 0, "")
+    for num in range(num_users):
+        # Fake fds, since no sockets are involved.
+        client = User(None, None, num, f"Guest {num + 1}", "#000000",
+                      outbound=OutboundQueue(2 ** 62, 2 ** 62))
+        client.protocol_version = 2
+        server.users.add(client)
+        server.users.log_in(client)
+        server.lobby.add(client)
+    return server
+
+
+def publish_per_recipient(server, img_data, img_info, sender):
+    # Frames are built but not queued, otherwise 5000 copies of a
+    # drawing would have to fit in memory at once.
+    for client in server.users:
+        version = client.protocol_version
+        pack_frame(OPCODES["drawing"], pack_sender(
+            sender.username, sender.colour, version) + pack_drawing_info(
+            *img_info, version) + img_data)
+
+
+def time_per_call(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = "hello " * 20
+    img_data = bytes(700 * 400 * 3)
+    print(f"{'users':>6} {'message':>12} {'drawing':>12} {'per-recipient drawing':>22}")
+    for num_users in args.users:
+        server = make_server(num_users)
+        sender = server.users.get(0)
+
+        def reset():
+            for client in server.users:
+                client.outbound.consume(client.outbound.pending_bytes)
+
+        message = time_per_call(
+            lambda: (server.publish_message(text, sender), reset()), args.repeat)
+        drawing = time_per_call(
+            lambda: (server.publish_drawing(img_data, (RAW_RGB, 700, 400), sender), reset()),
+            args.repeat)
+        per_recipient = time_per_call(
+            lambda: (publish_per_recipient(server, img_data, (RAW_RGB, 700, 400), sender), reset()),
+            args.repeat)
+        print(f"{num_users:>6} {message * 1000:>10.2f}ms {drawing * 1000:>10.2f}ms "
+              f"{per_recipient * 1000:>20.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
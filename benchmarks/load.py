@@ -0,0 +1,332 @@
+"""
+Load generator and fan-out latency benchmark for the server.
+
+N simulated clients log in to a server started in its own process and send
+a weighted mix of messages, drawings, username changes and colour changes
+for a fixed time. Every message carries the time it was sent, so the time
+until each recipient gets it gives the end-to-end fan-out latency. With
+--password the clients log in with it, all at once, and the time each
+login takes is reported too.
+
+Results are written as JSON so runs can be compared over time. Run from
+the repository root:
+
+    python -m benchmarks.load --clients 100 --duration 10 --rate 5 \\
+        --mix message=80 drawing=5 set_username=10 set_colour=5 \\
+        --output results.json
+"""
+from utils import (
+    OPCODES, COLOURS, PROTOCOL_VERSION, VERSION, FrameDecoder, recv_frame,
+    send_frame, unpack_sender, pack_drawing_info, RAW_RGB, STROKES, LINE,
+    Stroke, pack_strokes, rasterize_strokes, encode_image, CANVAS_SIZE)
+from benchmarks.throughput import start_server
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import selectors
+import threading
+import platform
+import argparse
+import random
+import socket
+import json
+import time
+import sys
+import os
+
+MARKER = b"|bench|"
+OPERATIONS = ("message", "drawing", "set_username", "set_colour")
+# Clients logging in at once. The server turns away logins past its own
+# limit on password checks in flight, so this stays under it.
+LOGIN_THREADS = 32
+
+
+def parse_mix(pairs):
+    """Turn ["message=80", "drawing=5"] into {"message": 80, "drawing": 5}."""
+    mix = {}
+    for pair in pairs:
+        name, _, weight = pair.partition("=")
+        if name not in OPERATIONS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"invalid mix entry: {pair}")
+        mix[name] = int(weight)
+    return mix
+
+
+def make_drawing(version):
+    """Return a DRAWING payload of a scribble, in the best format for version."""
+    rng = random.Random(0)
+    x, y = CANVAS_SIZE[0] // 2, CANVAS_SIZE[1] // 2
+    points = [(x, y)]
+    for _ in range(200):
+        x += rng.randint(-6, 6)
+        y += rng.randint(-6, 6)
+        points.append((x, y))
+    strokes = [Stroke(LINE, b"\x00\x00\x00", 3, points)]
+    if version >= 4:
+        img_format, img_data = STROKES, pack_strokes(strokes)
+    elif version >= 3:
+        img_format, img_data = encode_image(rasterize_strokes(strokes, *CANVAS_SIZE))
+    else:
+        img_format, img_data = RAW_RGB, rasterize_strokes(strokes, *CANVAS_SIZE).tobytes()
+    return pack_drawing_info(img_format, *CANVAS_SIZE, version) + img_data
+
+
+def connect(port, version, password=""):
+    """
+    Connect a client and wait until it is logged in and has agreed a version.
+    Return the socket, the version and how long logging in took.
+    """
+    start = time.perf_counter_ns()
+    client = socket.create_connection(("127.0.0.1", port))
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    send_frame(client, OPCODES["hello"], VERSION.pack(version))
+    agreed = None
+    is_logged_in = False
+    # Without a password the server logs the client in as soon as it
+    # connects; with one, the reply to HELLO may come first.
+    while agreed is None or not is_logged_in:
+        code, payload = recv_frame(client)
+        if code == OPCODES["hello"]:
+            agreed, = VERSION.unpack_from(payload)
+        elif code == OPCODES["send_password"]:
+            send_frame(client, OPCODES["password"], password.encode())
+        elif code == OPCODES["auth_failure"]:
+            client.close()
+            raise RuntimeError(f"login refused: {bytes(payload).decode()}")
+        elif code == OPCODES["auth_success"]:
+            is_logged_in = True
+    return client, agreed, time.perf_counter_ns() - start
+
+
+class LoadClient:
+    """One simulated client, sending a random mix of operations at a fixed rate."""
+
+    def __init__(self, num, sock, version, mix, rate, message_size, drawing, seed):
+        self.num = num
+        self.sock = sock
+        self.version = version
+        self.rate = rate
+        self.message_size = message_size
+        self.drawing = drawing
+        self.rng = random.Random(seed)
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.sent = dict.fromkeys(OPERATIONS, 0)
+        self.sent_bytes = 0
+        self.decoder = FrameDecoder()
+
+    def run(self, deadline):
+        interval = 1 / self.rate if self.rate else 0
+        next_send = time.perf_counter()
+        try:
+            while time.perf_counter() < deadline:
+                operation = self.rng.choices(self.operations, self.weights)[0]
+                self.send(operation)
+                if interval:
+                    next_send += interval
+                    time.sleep(max(0, next_send - time.perf_counter()))
+        except OSError:
+            pass  # Server went away; the report will show it.
+
+    def send(self, operation):
+        if operation == "message":
+            stamp = MARKER + str(time.perf_counter_ns()).encode() + b"|"
+            code, payload = OPCODES["message"], stamp.ljust(self.message_size, b".")
+        elif operation == "drawing":
+            code, payload = OPCODES["drawing"], self.drawing
+        elif operation == "set_username":
+            name = f"Bench {self.num}-{self.sent['set_username']}"
+            code, payload = OPCODES["set_username"], name.encode()
+        else:
+            code, payload = OPCODES["set_colour"], self.rng.choice(COLOURS).encode()
+        send_frame(self.sock, code, payload)
+        self.sent[operation] += 1
+        self.sent_bytes += len(payload)
+
+
+class Receiver:
+    """Read every client's socket on one thread and record what arrives."""
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.selector = selectors.DefaultSelector()
+        # Sockets stay blocking for the senders; select() says when a read
+        # will not block.
+        for client in clients:
+            self.selector.register(client.sock, selectors.EVENT_READ, data=client)
+        self.received = {}
+        self.received_bytes = 0
+        self.latencies = []  # Nanoseconds from send to receipt, per recipient
+        self.last_receipt = time.perf_counter()
+        self.is_closed = False
+
+    def run(self, stop_event, quiet_time):
+        # Keep reading until the senders are done and nothing has arrived
+        # for quiet_time seconds.
+        while not (stop_event.is_set() and
+                   time.perf_counter() - self.last_receipt > quiet_time):
+            for key, mask in self.selector.select(timeout=0.1):
+                self.read(key.data)
+
+    def read(self, client):
+        try:
+            num_bytes = client.decoder.recv_into(client.sock)
+        except OSError:
+            num_bytes = 0
+        if not num_bytes:
+            self.selector.unregister(client.sock)
+            self.is_closed = True
+            return
+        now = time.perf_counter_ns()
+        self.last_receipt = time.perf_counter()
+        self.received_bytes += num_bytes
+        for code, payload in client.decoder.frames():
+            name = code.decode()
+            self.received[name] = self.received.get(name, 0) + 1
+            if code == OPCODES["message"]:
+                sender, colour, text = unpack_sender(payload, client.version)
+                text = bytes(text)
+                if text.startswith(MARKER):
+                    stamp = int(text[len(MARKER):text.index(b"|", len(MARKER))])
+                    self.latencies.append(now - stamp)
+
+
+def percentiles(samples_ns):
+    if len(samples_ns) < 2:
+        return {}
+    cuts = statistics.quantiles(samples_ns, n=100, method="inclusive")
+    return {
+        "p50_ms": cuts[49] / 1e6,
+        "p95_ms": cuts[94] / 1e6,
+        "p99_ms": cuts[98] / 1e6,
+        "max_ms": max(samples_ns) / 1e6,
+        "mean_ms": statistics.fmean(samples_ns) / 1e6,
+    }
+
+
+def run_load(port, args):
+    clients = []
+    drawings = {}  # Drawing payload for each agreed protocol version
+    with ThreadPoolExecutor(LOGIN_THREADS) as pool:
+        connections = list(pool.map(
+            lambda num: connect(port, args.version, args.password), range(args.clients)))
+    login_times = [login_time for sock, version, login_time in connections]
+    for num, (sock, version, login_time) in enumerate(connections):
+        if version not in drawings:
+            drawings[version] = make_drawing(version)
+        clients.append(LoadClient(
+            num, sock, version, args.mix, args.rate, args.message_size,
+            drawings[version], args.seed + num))
+    receiver = Receiver(clients)
+    stop_event = threading.Event()
+    receive_thread = threading.Thread(
+        target=receiver.run, args=(stop_event, args.quiet_time), daemon=True)
+    receive_thread.start()
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    senders = [threading.Thread(target=c.run, args=(deadline,), daemon=True)
+               for c in clients]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    stop_event.set()
+    receive_thread.join()
+    elapsed = receiver.last_receipt - start
+
+    for client in clients:
+        client.sock.close()
+
+    sent = dict.fromkeys(OPERATIONS, 0)
+    for client in clients:
+        for operation, count in client.sent.items():
+            sent[operation] += count
+    deliveries = receiver.received.get(OPCODES["message"].decode(), 0)
+    return {
+        "elapsed_s": elapsed,
+        "protocol_version": clients[0].version if clients else None,
+        "sent": sent,
+        "sent_bytes": sum(c.sent_bytes for c in clients),
+        "received": receiver.received,
+        "received_bytes": receiver.received_bytes,
+        "msgs_per_sec": deliveries / elapsed,
+        "send_bytes_per_sec": sum(c.sent_bytes for c in clients) / elapsed,
+        "recv_bytes_per_sec": receiver.received_bytes / elapsed,
+        "latency_samples": len(receiver.latencies),
+        "latency": percentiles(receiver.latencies),
+        "login": percentiles(login_times),
+        "connection_lost": receiver.is_closed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5,
+                        help="seconds to send for")
+    parser.add_argument("--rate", type=float, default=10,
+                        help="operations per second per client, 0 for flat out")
+    parser.add_argument("--mix", nargs="+", default=["message=80", "drawing=5",
+                        "set_username=10", "set_colour=5"])
+    parser.add_argument("--message-size", type=int, default=64)
+    parser.add_argument("--version", type=int, default=PROTOCOL_VERSION,
+                        help="protocol version the clients ask for")
+    parser.add_argument("--backend", default="selector")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server worker processes")
+    parser.add_argument("--port", type=int, default=56100)
+    parser.add_argument("--password", default="",
+                        help="server password, so logins go through bcrypt")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quiet-time", type=float, default=1,
+                        help="seconds without traffic that end the run")
+    parser.add_argument("--output", default="-",
+                        help="file to write JSON results to, - for stdout")
+    args = parser.parse_args()
+    try:
+        args.mix = parse_mix(args.mix)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    process = start_server(args.backend, args.port, args.workers, args.password)
+    try:
+        results = run_load(args.port, args)
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {
+        "benchmark": "load",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "backend": args.backend, "workers": args.workers, "clients": args.clients,
+            "duration_s": args.duration, "rate": args.rate, "mix": args.mix,
+            "message_size": args.message_size, "version": args.version,
+            "seed": args.seed, "password": bool(args.password),
+        },
+        "results": results,
+    }
+    latency = results["latency"]
+    print(f"{args.backend}: {results['msgs_per_sec']:,.0f} msgs/sec, "
+          f"{results['recv_bytes_per_sec'] / 1e6:,.1f} MB/sec received, "
+          f"p50 {latency.get('p50_ms', 0):.2f}ms p95 {latency.get('p95_ms', 0):.2f}ms "
+          f"p99 {latency.get('p99_ms', 0):.2f}ms", file=sys.stderr)
+    if args.password:
+        login = results["login"]
+        print(f"logins: p50 {login.get('p50_ms', 0):.0f}ms "
+              f"p99 {login.get('p99_ms', 0):.0f}ms", file=sys.stderr)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as results_file:
+            json.dump(report, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
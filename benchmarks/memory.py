@@ -0,0 +1,69 @@
+"""
+Memory the server holds for each idle connection.
+
+Builds N user records the way the selector backend does and measures the
+Python heap with tracemalloc, for the bare User record and for the full
+record with its frame decoder and outbound queue. Kernel socket buffers
+are not included; on Linux they only grow once data is in flight.
+
+Run from the repository root:
+
+    python -m benchmarks.memory --connections 10000
+"""
+from utils import User, UserRegistry, FrameDecoder, OutboundQueue
+from server import MAX_QUEUE_BYTES, MAX_QUEUE_FRAMES
+from types import SimpleNamespace
+import tracemalloc
+import argparse
+
+
+def namespace_user(num):
+    # The record the server used before User, for comparison.
+    return SimpleNamespace(
+        connection=None, address=("127.0.0.1", num), fd=num,
+        username=f"Guest {num + 1}", colour="#000000", is_logged_in=True,
+        is_slow=False, protocol_version=1)
+
+
+def slots_user(num):
+    return User(None, ("127.0.0.1", num), num, f"Guest {num + 1}", "#000000")
+
+
+def full_user(num):
+    return User(None, ("127.0.0.1", num), num, f"Guest {num + 1}", "#000000",
+                decoder=FrameDecoder(),
+                outbound=OutboundQueue(MAX_QUEUE_BYTES, MAX_QUEUE_FRAMES))
+
+
+def bytes_per_connection(make_user, num_connections):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    registry = UserRegistry()
+    for num in range(num_connections):
+        user = make_user(num)
+        registry.add(user)
+        registry.log_in(user)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / num_connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--budget-mb", type=int, default=1024,
+                        help="memory to work out the connection ceiling for")
+    args = parser.parse_args()
+
+    print(f"{args.connections} connections, including registry and strings")
+    for name, make_user in (("SimpleNamespace record", namespace_user),
+                            ("User record", slots_user),
+                            ("User + decoder + queue", full_user)):
+        per_connection = bytes_per_connection(make_user, args.connections)
+        ceiling = args.budget_mb * 1024 * 1024 / per_connection
+        print(f"{name:>24}: {per_connection:>8,.0f} bytes/connection "
+              f"({ceiling:,.0f} per {args.budget_mb} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Side-by-side chat storm throughput of the server backends.
+
+Each backend is started in its own process, N clients connect and every
+client sends M messages at once. The run ends when every client has
+received every message, so the result is end-to-end fan-out throughput.
+
+Run from the repository root:
+
+    python -m benchmarks.throughput --clients 50 --messages 100
+"""
+from utils import OPCODES, FRAME_HEADER, recv_frame
+import subprocess
+import selectors
+import threading
+import argparse
+import socket
+import time
+import sys
+
+MARKER = b"|bench|"
+
+
+def start_server(backend, port, workers=1, password=""):
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--backend", backend,
+         "--port", str(port), "--password", password, "--workers", str(workers)],
+        stdout=subprocess.DEVNULL
+    )
+    # Wait until the server accepts connections.
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{backend} server did not start")
+
+
+def connect_and_log_in(port):
+    """Connect a client and wait until the server has logged it in."""
+    client = socket.create_connection(("127.0.0.1", port))
+    code = b""
+    # The server sends the username last when logging a client in.
+    while code != OPCODES["username_success"]:
+        code, payload = recv_frame(client)
+    return client
+
+
+def count_marked_frames(buffer):
+    """Count complete frames carrying MARKER, removing them from buffer."""
+    count = 0
+    while len(buffer) >= FRAME_HEADER.size:
+        code, length = FRAME_HEADER.unpack_from(buffer)
+        frame_end = FRAME_HEADER.size + length
+        if len(buffer) < frame_end:
+            break
+        if MARKER in buffer[FRAME_HEADER.size:frame_end]:
+            count += 1
+        del buffer[:frame_end]
+    return count
+
+
+def run_storm(port, num_clients, num_messages):
+    clients = [connect_and_log_in(port) for _ in range(num_clients)]
+    selector = selectors.DefaultSelector()
+    for client in clients:
+        selector.register(client, selectors.EVENT_READ, data=bytearray())
+
+    frame = FRAME_HEADER.pack(OPCODES["message"], len(MARKER)) + MARKER
+
+    def send_all(client):
+        client.sendall(frame * num_messages)
+
+    expected = num_clients * num_clients * num_messages
+    received = 0
+    start = time.perf_counter()
+    senders = [threading.Thread(target=send_all, args=(c,), daemon=True)
+               for c in clients]
+    for sender in senders:
+        sender.start()
+    while received < expected:
+        for key, mask in selector.select(timeout=10):
+            data = key.fileobj.recv(65536)
+            if not data:
+                raise RuntimeError("server closed a connection")
+            key.data.extend(data)
+            received += count_marked_frames(key.data)
+    elapsed = time.perf_counter() - start
+
+    selector.close()
+    for client in clients:
+        client.close()
+    return elapsed, expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--port", type=int, default=56000)
+    parser.add_argument("--backends", nargs="+", default=["selector", "asyncio"])
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients x {args.messages} messages")
+    for offset, backend in enumerate(args.backends):
+        port = args.port + offset
+        process = start_server(backend, port)
+        try:
+            elapsed, delivered = run_storm(port, args.clients, args.messages)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{backend:>10}: {delivered} deliveries in {elapsed:.2f}s "
+              f"({delivered / elapsed:,.0f} msgs/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Time taken to count the wrapped lines of messages of growing length.
+
+The quadratic column is the old find_num_lines, which called find_nth at
+every space, and find_nth scans the whole string each time. Its time
+grows with the square of the length, while find_num_lines should grow in
+step with it.
+
+Run from the repository root:
+
+    python -m benchmarks.wrap --sizes 1000 10000 100000
+"""
+from utils import find_nth, find_num_lines
+import argparse
+import random
+import timeit
+
+
+def find_num_lines_quadratic(string, wrap_length, add_extra=False):
+    sp_num = 1
+    num_lines = 1
+    char_pos = 0
+    for x in range(len(string)):
+        char = string[x]
+        if char == " ":
+            sp_num += 1
+            next_sp = find_nth(" ", string, sp_num)
+            if next_sp == -1:
+                next_word = string[x + 1:]
+            else:
+                next_word = string[x + 1:next_sp]
+            chars_left = (wrap_length - 1) - char_pos
+            if len(next_word) > wrap_length and add_extra or wrap_length >= len(next_word) > chars_left:
+                num_lines += 1
+                char_pos = -1
+        elif char_pos == (wrap_length - 1) and x != len(string) - 1:
+            num_lines += 1
+            char_pos = -1
+        char_pos += 1
+    return num_lines
+
+
+def make_text(size, seed=0):
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = "x" * rng.randint(1, 12)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def time_per_call(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--width", type=int, default=76)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quadratic-limit", type=int, default=10000,
+                        help="longest text to time the old version on")
+    args = parser.parse_args()
+
+    print(f"{'chars':>8} {'linear':>12} {'per 1k':>10} {'quadratic':>12}")
+    for size in args.sizes:
+        text = make_text(size)
+        linear = time_per_call(lambda: find_num_lines(text, args.width, True), args.repeat)
+        quadratic = "-"
+        if size <= args.quadratic_limit:
+            seconds = time_per_call(
+                lambda: find_num_lines_quadratic(text, args.width, True), 1)
+            quadratic = f"{seconds * 1000:.2f}ms"
+        print(f"{size:>8} {linear * 1000:>10.2f}ms "
+              f"{linear * 1e6 / size * 1000:>8.1f}us {quadratic:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,98 @@
 from tkinter.messagebox import showwarning
+from tkinter.font import Font
 from PIL import ImageTk, Image as Img
 from tkinter import ttk
 from tkinter import *
 from utils import *
+from concurrent.futures import ThreadPoolExecutor
 import threading
 import socket
+import queue
+import time
 
 SERVER = "127.0.0.1"
 PORT = 5000
-SCROLL_SPEED = 0.05
+SCROLL_UNITS = 3  # Steps of SCROLL_STEP pixels per turn of the mouse wheel
+SCROLL_STEP = 20
+# Only entries within this many pixels of the visible part of the
+# transcript have widgets.
+RENDER_MARGIN = 500
+ENTRY_PADX = 6
+ENTRY_SPACING = 6
+MESSAGE_WIDTH = 76  # characters
+MESSAGE_BORDER = 16  # Text widget's pady and highlight, above and below
+DRAWING_BORDER = 4  # Drawing frame's highlight, above and below
+DECODE_WORKERS = 2  # Threads decoding drawings off the Tk main loop
+# Reconnect attempts after losing the server, waiting twice as long after
+# each failed one.
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 0.5
+# The receive thread queues what it gets for the Tk main loop, which
+# handles it in batches about once a frame.
+UI_DRAIN_INTERVAL = 16  # ms
+MAX_UI_BATCH = 500  # Most queued events handled in one go
+
+log = get_logger("client")
+FRAME_LOG = SampledLog("client.frames")
+
+
+def decode_drawing(drawing, display_size):
+    """Return a drawing as a PIL image of display_size. Safe off the Tk main loop."""
+    img_format, width, height, img_data = drawing
+    # Anyone could have sent it, so check before decoding at that size.
+    check_drawing_size(width, height)
+    if img_format == STROKES:
+        # Strokes are drawn straight at the size shown, which is sharper
+        # than drawing them full size and shrinking the image.
+        return rasterize_strokes(
+            unpack_strokes(img_data), *display_size, scale=display_size[0] / width)
+    image = decode_image(img_format, width, height, img_data)
+    if image.size != display_size:
+        image = image.resize(display_size, Img.Resampling.LANCZOS)
+    return image
 
 
 class Client:
 
     def __init__(self, server_ip, port):
-        addr = (server_ip, port)
+        self.addr = (server_ip, port)
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.client.connect(addr)
+            self.client.connect(self.addr)
         except ConnectionRefusedError:
-            print("[CONNECTIONERROR] Could not connect to server")
+            log.error("[CONNECTIONERROR] Could not connect to server")
             exit()
-        self.posted_images = []
+        # Version 1 until the server agrees to something newer.
+        self.protocol_version = 1
+        self.decoder = FrameDecoder()
+        # Token from the server to log back in with after reconnecting.
+        # It is only ever kept in memory.
+        self.session_token = None
+        self.is_resuming = False
+        self.room = DEFAULT_ROOM
+        # ID of the oldest message shown, so older ones can be asked for
+        # when the user scrolls to the top.
+        self.oldest_message_id = None
+        self.has_older_history = False
+        self.is_loading_history = False
+        # Tk is not thread safe, so the receive thread never touches the
+        # UI itself. It puts (function, args) here for the main loop.
+        self.ui_events = queue.SimpleQueue()
+        # Set while a batch is being handled if entries were added, so the
+        # transcript is laid out once the batch is done.
+        self.is_transcript_changed = False
+        # Drawings are kept as they came, and only decoded into
+        # PhotoImages when they come near the view, on a thread pool.
+        # The decoded ones are cached, up to MAX_IMAGE_BYTES.
+        self.images = ImageCache()
+        self.decoding = {}  # TranscriptEntry -> Future
+        self.decode_pool = ThreadPoolExecutor(DECODE_WORKERS, "decode")
+        # Every entry is kept in the transcript, but only the ones near
+        # the visible part have widgets. Widgets of entries that scroll
+        # away are hidden and kept spare for the next entries to show.
+        self.transcript = Transcript(ENTRY_SPACING)
+        self.shown = {}  # TranscriptEntry -> (widget, canvas item)
+        self.spare = {MESSAGE_ENTRY: [], DRAWING_ENTRY: []}
         self.draw_settings = {"brush_size": 1, "brush_colour": "black"}
         self.root = Tk()
         self.root.title("Client")
@@ -47,8 +118,7 @@ class Client:
                               font=SMALL_FONT, command=self.set_username, state=DISABLED)
         # MESSAGES BOX
         message_frame = LabelFrame(self.root, bd=3, relief=SUNKEN, pady=3)
-        message_frame_inner, canvas, scrollbar = self.create_scrollable_frame(
-            message_frame, 500)
+        canvas, scrollbar = self.create_transcript_view(message_frame, 500)
         # LOWER FRAME
         compose_frame = LabelFrame(self.root, bd=0)
         text_input = Entry(compose_frame, bd=3, font=SMALL_FONT, width=67)
@@ -78,30 +148,50 @@ class Client:
         self.widgets["username_var"] = u_var
         self.widgets["username_btn"] = username_btn
         self.widgets["message_frame"] = message_frame
-        self.widgets["message_frame_inner"] = message_frame_inner
         self.widgets["canvas"] = canvas
         self.widgets["text_input"] = text_input
         self.widgets["draw_btn"] = draw_btn
         self.widgets["send_btn"] = send_btn
 
-    def create_scrollable_frame(self, frame_outer, height):
-        """Create Scrollable region inside a Frame or LabelFrame widget."""
-        canvas = Canvas(frame_outer, height=height, highlightthickness=0)
-        frame_inner = Frame(canvas)
+        # Entry heights are worked out without widgets, from the fonts and
+        # from a spare widget of each kind, made now.
+        self.font_metrics = {}
+        for font in (SMALL_FONT, MEDIUM_FONT):
+            tk_font = Font(font=font)
+            self.font_metrics[font] = FontMetrics(tk_font.measure, tk_font.metrics("linespace"))
+        # Tk sizes a Text widget's width in "0"s of its font.
+        self.message_text_width = MESSAGE_WIDTH * Font(font=SMALL_FONT).measure("0")
+        for kind in (MESSAGE_ENTRY, DRAWING_ENTRY):
+            self.spare[kind].append(self.create_entry_widget(kind))
+        message_widget, _ = self.spare[MESSAGE_ENTRY][0]
+        drawing_widget, _ = self.spare[DRAWING_ENTRY][0]
+        self.drawing_label_height = drawing_widget.sender_label.winfo_reqheight()
+        canvas.config(width=message_widget.winfo_reqwidth() + 2 * ENTRY_PADX)
+        # Entries are centred, as drawings are narrower than messages.
+        self.entry_x = int(canvas["width"]) // 2
+        # Wider drawings are scaled down to fit in the transcript.
+        self.max_drawing_width = message_widget.winfo_reqwidth() - DRAWING_BORDER
+
+    def create_transcript_view(self, frame_outer, height):
+        """Create the canvas the transcript's widgets are placed on."""
+        canvas = Canvas(frame_outer, height=height, highlightthickness=0,
+                        yscrollincrement=SCROLL_STEP)
         scrollbar = ttk.Scrollbar(
-            frame_outer, orient=VERTICAL, command=canvas.yview)
+            frame_outer, orient=VERTICAL, command=self.yview)
         canvas.configure(yscrollcommand=scrollbar.set)
-        frame_inner.bind("<Configure>", lambda event: canvas.configure(
-            scrollregion=canvas.bbox("all")))
-        frame_inner.bind("<MouseWheel>", self.scroll)
         scrollbar.bind("<MouseWheel>", self.scroll)
         canvas.bind("<MouseWheel>", self.scroll)
-        canvas.create_window((0, 0), window=frame_inner, anchor=N + W)
+        canvas.bind("<Configure>", lambda event: self.render_transcript())
 
         canvas.pack(side=LEFT, fill=BOTH, expand=True)
         scrollbar.pack(side=RIGHT, fill=Y)
 
-        return frame_inner, canvas, scrollbar
+        return canvas, scrollbar
+
+    def yview(self, *args):
+        # Called by the scrollbar.
+        self.widgets["canvas"].yview(*args)
+        self.after_scrolling()
 
     def scroll(self, event):
         canvas = self.widgets["canvas"]
@@ -109,13 +199,152 @@ class Client:
         # By finding the sign of event.delta, the
         # program can scroll the opposite direction.
         sign = event.delta // abs(event.delta)
-        position = canvas.yview()[0] + -sign * SCROLL_SPEED
-        canvas.yview("moveto", position)
-        self.widgets["message_frame_inner"].update()
+        canvas.yview_scroll(-sign * SCROLL_UNITS, "units")
+        self.after_scrolling()
+
+    def after_scrolling(self):
+        self.render_transcript()
+        if self.widgets["canvas"].yview()[0] <= 0:
+            self.request_older_history()
+
+    def request_older_history(self):
+        if self.has_older_history and not self.is_loading_history:
+            self.is_loading_history = True
+            self.send(OPCODES["history_request"],
+                      MESSAGE_ID.pack(self.oldest_message_id))
+
+    def clear_transcript(self):
+        self.transcript.clear()
+        self.images.clear()
+        self.oldest_message_id = None
+        self.has_older_history = False
+        self.is_loading_history = False
+        self.update_transcript()
+
+    def update_transcript(self, follow=False):
+        """Fit the scroll region to the transcript, then show what is in view."""
+        canvas = self.widgets["canvas"]
+        canvas.configure(scrollregion=(0, 0, canvas["width"], self.transcript.height))
+        if follow:
+            canvas.yview("moveto", 1)
+        self.render_transcript()
 
-    def scroll_to_bottom(self):
+    def render_transcript(self):
+        """Give widgets to the entries near the visible part of the transcript."""
+        canvas = self.widgets["canvas"]
+        top = canvas.canvasy(0)
+        bottom = top + canvas.winfo_height()
+        visible = self.transcript.visible(top - RENDER_MARGIN, bottom + RENDER_MARGIN)
+        entries = {self.transcript[index]: index for index in visible}
+        # Take back the widgets of entries that are no longer near.
+        for entry in list(self.shown):
+            if entry not in entries:
+                widget, item = self.shown.pop(entry)
+                canvas.itemconfigure(item, state=HIDDEN)
+                if entry.kind == DRAWING_ENTRY:
+                    # Let the image go, unless the cache still has it, and
+                    # skip decoding it if that has not started yet.
+                    self.show_image(widget, None)
+                    if entry in self.decoding:
+                        self.decoding[entry].cancel()
+                self.spare[entry.kind].append((widget, item))
+        for entry, index in entries.items():
+            if entry not in self.shown:
+                spare = self.spare[entry.kind]
+                widget, item = spare.pop() if spare else self.create_entry_widget(entry.kind)
+                self.fill_entry_widget(widget, entry)
+                self.shown[entry] = widget, item
+            widget, item = self.shown[entry]
+            # Entries move down when older history goes in above them.
+            canvas.coords(item, self.entry_x, self.transcript.top(index))
+            canvas.itemconfigure(item, height=entry.height, state=NORMAL)
+            if entry.kind == DRAWING_ENTRY:
+                # Sized before its image is ready.
+                img_format, width, height, img_data = entry.body
+                display_width, _ = self.display_size(width, height)
+                canvas.itemconfigure(item, width=display_width + DRAWING_BORDER)
+
+    def create_entry_widget(self, kind):
+        """Return a new, hidden widget for one entry, and its canvas item."""
         canvas = self.widgets["canvas"]
-        canvas.yview("moveto", 1)
+        if kind == MESSAGE_ENTRY:
+            widget = Text(canvas, width=MESSAGE_WIDTH, height=1, wrap=WORD, bd=0, bg="#ffffff",
+                          font=SMALL_FONT, padx=8, pady=6, highlightthickness=2)
+        else:
+            widget = Frame(canvas, bd=0, highlightthickness=2)
+            widget.sender_label = Label(widget, font=MEDIUM_FONT, anchor=W, padx=5, bg="white")
+            widget.drawing_label = Label(widget, bd=0)
+            widget.sender_label.bind("<MouseWheel>", self.scroll)
+            widget.drawing_label.bind("<MouseWheel>", self.scroll)
+            widget.sender_label.pack(fill=X, expand=True)
+            widget.drawing_label.pack()
+        widget.bind("<MouseWheel>", self.scroll)
+        item = canvas.create_window(0, 0, window=widget, anchor=N, state=HIDDEN)
+        return widget, item
+
+    def fill_entry_widget(self, widget, entry):
+        widget.config(highlightbackground=entry.colour, highlightcolor=entry.colour)
+        if entry.kind == DRAWING_ENTRY:
+            widget.sender_label.config(text=entry.sender, fg=entry.colour)
+            image = self.images.get(entry)
+            if image is None:
+                self.decode_drawing_later(entry)
+            self.show_image(widget, image)
+            return
+        widget.config(state=NORMAL)
+        widget.delete(1.0, END)
+        widget.tag_delete("sender")
+        widget.insert(1.0, entry.body)
+        if entry.sender != "Server":
+            # If message was sent from a client, insert sender's name with a
+            # different font and colour.
+            widget.insert(1.0, f"{entry.sender}: ")
+            widget.tag_add("sender", "1.0", f"1.{len(entry.sender) + 1}")
+            widget.tag_config("sender", foreground=entry.colour, font=MEDIUM_FONT)
+        # Disable text widget so that no more text can be entered.
+        widget.config(state=DISABLED)
+
+    @staticmethod
+    def show_image(widget, image):
+        widget.drawing_label.config(image="" if image is None else image)
+        # Tk drops an image once Python has no reference to it, so the
+        # widget holds one for as long as it shows the image, even after
+        # the cache has let it go.
+        widget.drawing_label.image = image
+
+    def display_size(self, width, height):
+        scale = min(1, self.max_drawing_width / width) if width else 1
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def decode_drawing_later(self, entry):
+        if entry in self.decoding and not self.decoding[entry].cancelled():
+            return
+        img_format, width, height, img_data = entry.body
+        decoding = self.decode_pool.submit(
+            decode_drawing, entry.body, self.display_size(width, height))
+        self.decoding[entry] = decoding
+        decoding.add_done_callback(
+            lambda decoding: self.post(self.finish_decoding, entry, decoding))
+
+    def finish_decoding(self, entry, decoding):
+        # A cancelled decode may have been started again since.
+        if self.decoding.get(entry) is decoding:
+            del self.decoding[entry]
+        if decoding.cancelled():
+            return
+        try:
+            image = decoding.result()
+        except ValueError as e:
+            log.warning("[DRAWING] Could not show a drawing from %s: %s", entry.sender, e)
+            return
+        # Only keep it if it is still near the view.
+        if entry not in self.shown:
+            return
+        # Construct an ImageTk object from the image.
+        image_object = ImageTk.PhotoImage(image)
+        self.images.put(entry, image_object, image.width * image.height * 4)
+        widget, item = self.shown[entry]
+        self.show_image(widget, image_object)
 
     def enable_buttons(self):
         self.widgets["colour_btn"].config(state=NORMAL)
@@ -123,6 +352,12 @@ class Client:
         self.widgets["send_btn"].config(state=NORMAL)
         self.widgets["draw_btn"].config(state=NORMAL)
 
+    def disable_buttons(self):
+        self.widgets["colour_btn"].config(state=DISABLED)
+        self.widgets["username_btn"].config(state=DISABLED)
+        self.widgets["send_btn"].config(state=DISABLED)
+        self.widgets["draw_btn"].config(state=DISABLED)
+
     @staticmethod
     def limit_username(username_text_var):
         username_text_var.set(username_text_var.get()[:15])
@@ -135,11 +370,10 @@ class Client:
             can_send = False
         username = self.widgets["username_input"].get()
         if username and can_send:
-            self.send(CODES["set_username"])
-            self.send(username)
+            self.send(OPCODES["set_username"], username)
 
     def set_colour(self):
-        self.send(CODES["send_taken_colours"])
+        self.send(OPCODES["send_taken_colours"])
 
     def send_message(self, event=None):
         can_send = True
@@ -149,9 +383,17 @@ class Client:
             can_send = False
         message = self.widgets["text_input"].get()
         self.widgets["text_input"].delete(0, END)
-        if message and can_send:
-            self.send(CODES["message"])
-            self.send(message)
+        if not message or not can_send:
+            return
+        # "/join name" moves to another room and "/leave" goes back to
+        # the lobby.
+        command, _, room = message.partition(" ")
+        if command == "/join" and room:
+            self.send(OPCODES["join_room"], room.strip())
+        elif command == "/leave":
+            self.send(OPCODES["leave_room"])
+        else:
+            self.send(OPCODES["message"], message)
 
     def send_drawing(self, event=None):
         if event:
@@ -159,192 +401,292 @@ class Client:
         result = get_drawing(self.root, self.draw_settings,
                              COLOURS + ["#000000"])
         if result:
-            drawing, last_settings = result
+            strokes, last_settings = result
             # Save last used settings.
             self.draw_settings = last_settings
-            # Convert image to raw data.
-            img_data = drawing.tobytes()
-            img_size = "{}x{}".format(*drawing.size)
-            self.send(CODES["drawing"])
-            self.send(img_size)
-            self.send(img_data)
-
-    def send(self, message):
+            # Send the strokes themselves if the server can relay them,
+            # otherwise draw them and send the image.
+            if self.protocol_version >= 4:
+                img_format, img_data = STROKES, pack_strokes(strokes)
+            elif self.protocol_version >= 3:
+                img_format, img_data = encode_image(
+                    rasterize_strokes(strokes, *CANVAS_SIZE))
+            else:
+                img_format = RAW_RGB
+                img_data = rasterize_strokes(strokes, *CANVAS_SIZE).tobytes()
+            self.send(OPCODES["drawing"], pack_drawing_info(
+                img_format, *CANVAS_SIZE, self.protocol_version) + img_data)
+
+    def send(self, code, message=b""):
         # If message is not encoded, encode it.
         if not isinstance(message, bytes):
             message = bytes(message, FORMAT)
-        # Create a header containing num of bytes in
-        # message and pad header to a set length.
-        header = bytes(f"{len(message):<{HEADER_LENGTH}}", FORMAT)
-        self.client.send(header)
-        self.client.send(message)
-        # If message is longer than 1000 bytes, print the length
-        # rather than the entire message.
-        if len(message) > 1000:
-            print(F"[SENT] Header: {int(header)}, Message: {len(message)}")
-        else:
-            print(f"[SENT] Header: {int(header)}, Message: {message}")
+        # Header and message go out together as a single frame.
+        send_frame(self.client, code, message)
+        if FRAME_LOG.enabled:
+            FRAME_LOG.log("SENT", code, message)
 
     def recv(self):
-        # Receive header
-        header = b""
-        while len(header) < HEADER_LENGTH:
-            header += self.client.recv(HEADER_LENGTH - len(header))
-        bytes_to_recv = int(header)
-        # Receive message
-        received = b""
-        while len(received) < bytes_to_recv:
-            received += self.client.recv(bytes_to_recv - len(received))
-        if len(received) > 1000:
-            print(
-                f"[RECEIVED] Header: {bytes_to_recv}, Message: {len(received)}")
-        else:
-            print(f"[RECEIVED] Header: {bytes_to_recv}, Message: {received}")
-        return received
+        # Keep reading until the decoder has a whole frame.
+        frame = self.decoder.next_frame()
+        while not frame:
+            if not self.decoder.recv_into(self.client):
+                raise ConnectionResetError("server closed the connection")
+            frame = self.decoder.next_frame()
+        code, received = frame
+        if FRAME_LOG.enabled:
+            FRAME_LOG.log("RECEIVED", code, received)
+        return code, received
 
     def receive_from_server(self):
         while True:
-            code = self.recv().decode(FORMAT)
-            # PASSWORD
-            if code == CODES["send_password"]:
-                # Get password from password dialog.
-                password = get_password(self.root)
-                if password is None:
-                    self.root.quit()
-                else:
-                    self.send(CODES["password"])
-                    self.send(password)
-            # AUTHENTICATION SUCCESS
-            elif code == CODES["auth_success"]:
-                self.enable_buttons()
-            # USERNAME SUCCESS
-            elif code == CODES["username_success"]:
-                new_username = self.recv().decode(FORMAT)
-                self.widgets["username_var"].set(new_username)
-            # USERNAME FAILURE
-            elif code == CODES["username_failure"]:
-                old_username = self.recv().decode(FORMAT)
-                self.widgets["username_var"].set(old_username)
-                showwarning("Username Taken",
-                            "Sorry, that username has already been taken.")
-            # MESSAGE
-            elif code == CODES["message"]:
-                # Break message into parts. Message should be of the format:
-                # [sender username]#[sender colour][message text]
-                message = self.recv().decode(FORMAT)
-                colour_start = message.find("#")
-                sender = message[:colour_start]
-                colour = message[colour_start:colour_start + 7]
-                text = message[colour_start + 7:].strip("\n")
-                self.display_message(text, sender, colour)
-            # DRAWING
-            elif code == CODES["drawing"]:
-                extra_data = self.recv().decode(FORMAT)
-                # Extract information from extra data. Extra data should be of the format:
-                # [sender username]#[sender colour][width]x[height]
-                colour_start = extra_data.find("#")
-                sender = extra_data[:colour_start]
-                # Colour is always 7 chars long, e.g. #000000
-                colour = extra_data[colour_start:colour_start + 7]
-                img_size = extra_data[colour_start + 7:].split("x")
-                width, height = int(img_size[0]), int(img_size[1])
-                # Receive raw image data and construct an ImageTk object from it.
-                img_data = self.recv()
-                image_object = ImageTk.PhotoImage(
-                    Img.frombytes("RGB", (width, height), img_data))
-                self.posted_images.append(image_object)
-                self.display_drawing(image_object, sender, colour)
-            # TAKEN COLOURS
-            elif code == CODES["taken_colours"]:
-                taken_string = self.recv().decode(FORMAT)
-                taken_colours = taken_string.split(",")
-                # Splitting an empty string returns [""] instead of [].
-                if taken_colours[0] == "" and len(taken_colours) == 1:
-                    taken_colours.pop(0)
-                # Get new colour from colours dialog.
-                new_colour = get_colour(self.root, COLOURS, taken_colours)
-                if new_colour:
-                    # Send change colour request to server.
-                    self.send(CODES["set_colour"])
-                    self.send(new_colour)
-            # COLOUR FAILURE
-            elif code == CODES["colour_success"]:
-                # Receive client's new colour from server.
-                new_colour = self.recv()
-                # Colour management is handled on the server side,
-                # only colour_btn background needs to be changed.
-                self.widgets["colour_btn"].config(bg=new_colour)
-            # COLOUR SUCCESS
-            elif code == CODES["colour_failure"]:
-                # Receive client's old colour from server.
-                old_colour = self.recv()
-                self.widgets["colour_btn"].config(bg=old_colour)
-                # Show warning so user knows colour was taken. Since the
-                # colour dialog disables taken colours, This only occurs
-                # when a colour is taken while The user is choosing a colour.
-                showwarning(
-                    "Colour Taken", "Sorry, someone took that colour\nwhile you were choosing.")
-            # SERVER SHUTDOWN
-            elif code == CODES["server_shutdown"]:
+            try:
+                self.talk_to_server()
+                return
+            except OSError:
+                # A session token lets the client log back in by itself,
+                # so only try to reconnect if it has one.
+                self.post(self.disable_buttons)
+                if self.session_token is None or not self.reconnect():
+                    log.error("[CONNECTIONERROR] Lost connection to server")
+                    self.post(self.root.quit)
+                    return
+
+    def reconnect(self):
+        self.client.close()
+        delay = RECONNECT_DELAY
+        for attempt in range(RECONNECT_ATTEMPTS):
+            time.sleep(delay)
+            delay *= 2
+            try:
+                self.client = socket.create_connection(self.addr)
+            except OSError:
+                continue
+            self.decoder = FrameDecoder()
+            # The server sends recent history again, including whatever
+            # was missed while disconnected, so start the transcript over.
+            if self.protocol_version >= 5:
+                self.post(self.clear_transcript)
+            log.info("[RECONNECTED] Reconnected to server")
+            return True
+        return False
+
+    def talk_to_server(self):
+        # Tell the server which protocol version this client speaks.
+        self.send(OPCODES["hello"], VERSION.pack(PROTOCOL_VERSION))
+        if self.session_token is not None:
+            # Log back in without asking for the password again.
+            self.is_resuming = True
+            self.send(OPCODES["resume"], self.session_token)
+        while True:
+            code, payload = self.recv()
+            # The payload is a view of the decoder's buffer, which the
+            # next recv may reuse, so the main loop gets its own copy.
+            self.post(self.handle_frame, code, bytes(payload))
+            if code == OPCODES["server_shutdown"]:
+                return
+
+    def post(self, function, *args):
+        """Have the Tk main loop call function. Safe from any thread."""
+        self.ui_events.put((function, args))
+
+    def drain_ui_events(self):
+        """Handle queued events in one batch, then lay out and scroll once."""
+        canvas = self.widgets["canvas"]
+        # Only follow new messages if the user was already near the bottom,
+        # measured in pixels since a fraction of a long transcript is a lot.
+        bottom = canvas.canvasy(0) + canvas.winfo_height()
+        was_at_bottom = self.transcript.height - bottom < SCROLL_STEP * SCROLL_UNITS
+        try:
+            for _ in range(MAX_UI_BATCH):
+                try:
+                    function, args = self.ui_events.get_nowait()
+                except queue.Empty:
+                    break
+                function(*args)
+            if self.is_transcript_changed:
+                self.update_transcript(follow=was_at_bottom)
+        finally:
+            self.is_transcript_changed = False
+            # Scheduled afterwards, so a dialog opened by a handler cannot
+            # start another batch from inside this one.
+            self.root.after(UI_DRAIN_INTERVAL, self.drain_ui_events)
+
+    def handle_frame(self, code, payload):
+        # Called on the Tk main loop for each frame from the server.
+        # VERSION AGREED
+        if code == OPCODES["hello"]:
+            self.protocol_version, = VERSION.unpack_from(payload)
+        # PASSWORD
+        elif code == OPCODES["send_password"]:
+            # The server asks every new connection for the password,
+            # but a resuming client waits to hear if its token worked.
+            if self.is_resuming:
+                return
+            # Get password from password dialog.
+            password = get_password(self.root)
+            if password is None:
                 self.root.quit()
-
-    def display_message(self, text, sender, colour):
-        inner_frame = self.widgets["message_frame_inner"]
-        # Call find_num_lines to calculate height of text widget with wrapping.
-        num_lines = find_num_lines(sender + text, 76, True)
-        msg_widget = Text(inner_frame, width=76, height=num_lines, wrap=WORD, bd=0, bg="#ffffff", font=SMALL_FONT,
-                          padx=8, pady=6, highlightbackground=colour, highlightcolor=colour, highlightthickness=2)
-        msg_widget.insert(1.0, text)
+            else:
+                self.send(OPCODES["password"], password)
+        # AUTHENTICATION FAILURE
+        elif code == OPCODES["auth_failure"]:
+            # The server asks for the password again straight after.
+            if self.is_resuming:
+                # The token was refused, so fall back to the password.
+                self.is_resuming = False
+                self.session_token = None
+                return
+            showwarning("Not Logged In", str(payload, FORMAT))
+        # AUTHENTICATION SUCCESS
+        elif code == OPCODES["auth_success"]:
+            # The server puts everyone in the lobby, so go back to
+            # the room this client was in before it reconnected.
+            if self.is_resuming and self.room != DEFAULT_ROOM:
+                self.send(OPCODES["join_room"], self.room)
+            self.is_resuming = False
+            self.enable_buttons()
+        # ROOM JOINED
+        elif code == OPCODES["room_joined"]:
+            self.room = str(payload, FORMAT)
+            self.root.title(f"Client - {self.room}")
+            # The new room's history follows.
+            self.clear_transcript()
+        # ROOM FAILURE
+        elif code == OPCODES["room_failure"]:
+            showwarning("Room Not Joined", str(payload, FORMAT))
+        # DRAWING FAILURE
+        elif code == OPCODES["drawing_failure"]:
+            showwarning("Drawing Not Sent", str(payload, FORMAT))
+        # SESSION TOKEN
+        elif code == OPCODES["session_token"]:
+            self.session_token = bytes(payload)
+        # USERNAME SUCCESS
+        elif code == OPCODES["username_success"]:
+            new_username = str(payload, FORMAT)
+            self.widgets["username_var"].set(new_username)
+        # USERNAME FAILURE
+        elif code == OPCODES["username_failure"]:
+            old_username = str(payload, FORMAT)
+            self.widgets["username_var"].set(old_username)
+            showwarning("Username Taken",
+                        "Sorry, that username has already been taken.")
+        # MESSAGE
+        elif code == OPCODES["message"]:
+            self.show_entry(self.read_message(payload))
+        # DRAWING
+        elif code == OPCODES["drawing"]:
+            self.show_entry(self.read_drawing(payload))
+        # HISTORY
+        elif code == OPCODES["history"]:
+            entries, has_more = unpack_history(payload)
+            shown = []
+            for message_id, entry_code, entry in entries:
+                if entry_code == OPCODES["message"]:
+                    shown.append(self.read_message(entry))
+                elif entry_code == OPCODES["drawing"]:
+                    shown.append(self.read_drawing(entry))
+            # Older pages go above everything shown so far, and the
+            # history sent on login goes below it.
+            if self.is_loading_history:
+                self.show_older_entries(shown)
+            else:
+                for entry in shown:
+                    self.show_entry(entry)
+            if entries:
+                self.oldest_message_id = entries[0][0]
+            self.has_older_history = has_more
+            self.is_loading_history = False
+        # TAKEN COLOURS
+        elif code == OPCODES["taken_colours"]:
+            taken_string = str(payload, FORMAT)
+            taken_colours = taken_string.split(",")
+            # Splitting an empty string returns [""] instead of [].
+            if taken_colours[0] == "" and len(taken_colours) == 1:
+                taken_colours.pop(0)
+            # Get new colour from colours dialog.
+            new_colour = get_colour(self.root, COLOURS, taken_colours)
+            if new_colour:
+                # Send change colour request to server.
+                self.send(OPCODES["set_colour"], new_colour)
+        # COLOUR SUCCESS
+        elif code == OPCODES["colour_success"]:
+            # Receive client's new colour from server.
+            new_colour = str(payload, FORMAT)
+            # Colour management is handled on the server side,
+            # only colour_btn background needs to be changed.
+            self.widgets["colour_btn"].config(bg=new_colour)
+        # COLOUR FAILURE
+        elif code == OPCODES["colour_failure"]:
+            # Receive client's old colour from server.
+            old_colour = str(payload, FORMAT)
+            self.widgets["colour_btn"].config(bg=old_colour)
+            # Show warning so user knows colour was taken. Since the
+            # colour dialog disables taken colours, This only occurs
+            # when a colour is taken while The user is choosing a colour.
+            showwarning(
+                "Colour Taken", "Sorry, someone took that colour\nwhile you were choosing.")
+        # SERVER SHUTDOWN
+        elif code == OPCODES["server_shutdown"]:
+            self.root.quit()
+
+    def read_message(self, payload):
+        # Message is the sender's username and colour followed by the text.
+        sender, colour, text = unpack_sender(payload, self.protocol_version)
+        text = str(text, FORMAT).strip("\n")
+        # Wrap the text as the Text widget will, to find its height.
+        runs = [(text, self.font_metrics[SMALL_FONT])]
         if sender != "Server":
-            # If message was sent from a client, insert sender's name with a
-            # different font and colour.
-            msg_widget.insert(1.0, f"{sender}: ")
-            msg_widget.tag_add(sender, "1.0", f"1.{len(sender) + 1}")
-            msg_widget.tag_config(sender, foreground=colour, font=MEDIUM_FONT)
-        # Disable text widget so that no more text can be entered.
-        msg_widget.config(state=DISABLED)
-        msg_widget.bind("<MouseWheel>", self.scroll)
-        msg_widget.pack(padx=6, pady=3)
-        # If the scrollbar is >= 90% of they way down the screen,
-        # scroll to the bottom.
-        canvas = self.widgets["canvas"]
-        if canvas.yview()[1] >= 0.9:
-            wait = 10  # Wait 10ms for widget to be loaded before scrolling
-            canvas.after(wait, self.scroll_to_bottom)
-
-    def display_drawing(self, image, sender, colour):
-        inner_frame = self.widgets["message_frame_inner"]
-        drawing_frame = Frame(inner_frame, bd=0, highlightbackground=colour,
-                              highlightthickness=2, highlightcolor=colour)
-        sender_label = Label(drawing_frame, text=sender, fg=colour,
-                             font=MEDIUM_FONT, anchor=W, padx=5, bg="white")
-        drawing_widget = Label(drawing_frame, image=image, bd=0)
-
-        sender_label.bind("<MouseWheel>", self.scroll)
-        drawing_frame.bind("<MouseWheel>", self.scroll)
-        drawing_widget.bind("<MouseWheel>", self.scroll)
-
-        drawing_frame.pack(padx=6, pady=3)
-        sender_label.pack(fill=X, expand=True)
-        drawing_widget.pack()
-
+            runs.insert(0, (f"{sender}: ", self.font_metrics[MEDIUM_FONT]))
+        _, height = measure_text(runs, self.message_text_width)
+        height += MESSAGE_BORDER
+        return TranscriptEntry(MESSAGE_ENTRY, sender, colour, text, height)
+
+    def read_drawing(self, payload):
+        # Drawing is the sender's username and colour, the image
+        # format and size, then the image data.
+        sender, colour, drawing = unpack_sender(payload, self.protocol_version)
+        img_format, width, height, img_data = unpack_drawing_info(
+            drawing, self.protocol_version)
+        # Decoded later, when it comes near the view.
+        body = img_format, width, height, bytes(img_data)
+        _, display_height = self.display_size(width, height)
+        height = display_height + self.drawing_label_height + DRAWING_BORDER
+        return TranscriptEntry(DRAWING_ENTRY, sender, colour, body, height)
+
+    def show_entry(self, entry):
+        # Laid out once the whole batch has been handled.
+        self.transcript.append(entry)
+        self.is_transcript_changed = True
+
+    def show_older_entries(self, entries):
         canvas = self.widgets["canvas"]
-        if canvas.yview()[1] >= 0.9:
-            wait = 10
-            canvas.after(wait, self.scroll_to_bottom)
+        top = canvas.canvasy(0)
+        added = self.transcript.prepend(entries)
+        # Keep the entries that were in view where they are on screen.
+        self.update_transcript()
+        if self.transcript.height:
+            canvas.yview("moveto", (top + added) / self.transcript.height)
+        self.render_transcript()
 
     def start(self):
-        print("[STARTING] Client is starting up")
+        log.info("[STARTING] Client is starting up")
         receive_thread = threading.Thread(target=self.receive_from_server)
         receive_thread.daemon = True  # Closes on program exit
         receive_thread.start()
 
+        self.root.after(UI_DRAIN_INTERVAL, self.drain_ui_events)
         self.root.mainloop()
+        self.decode_pool.shutdown(wait=False, cancel_futures=True)
         try:
-            self.send("!DISCONNECT")
-        except ConnectionResetError:
-            print("[SERVER SHUTDOWN] Server has closed")
+            self.send(OPCODES["disconnect"])
+        except OSError:
+            log.info("[SERVER SHUTDOWN] Server has closed")
 
 
 if __name__ == '__main__':
-    Client(SERVER, PORT).start()
+    setup_logging("INFO")
+    try:
+        Client(SERVER, PORT).start()
+    finally:
+        stop_logging()
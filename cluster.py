@@ -0,0 +1,57 @@
+"""
+Run the server as several worker processes sharing one port.
+
+Each worker is a whole selector Server listening with SO_REUSEPORT, so the
+kernel shares new connections out between them and each one runs on its
+own core. This process runs the relay broker that keeps the workers in
+step. Linux only.
+"""
+from utils import RelayBroker, RelayClient, setup_logging, stop_logging
+from server import Server, FRAME_LOG, log, server_options
+import multiprocessing
+import tempfile
+import signal
+import os
+
+
+def run_worker(worker_index, num_workers, relay_path, session_secret, args, password):
+    # Ctrl+C reaches every process; the parent stops the workers itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The logging thread does not survive the fork.
+    setup_logging(args.log_level, {FRAME_LOG.category: args.frame_log_sample})
+    relay = RelayClient(relay_path, worker_index, num_workers)
+    server = Server(
+        args.ip, args.port, password, relay=relay, reuse_port=True,
+        session_secret=session_secret, **server_options(args))
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+    log.info("[WORKER] Worker %d started as process %d", worker_index, os.getpid())
+    try:
+        server.start_listening()
+    finally:
+        stop_logging()
+
+
+def run_workers(args, password):
+    # Workers must agree on the secret so that a session token from one
+    # is accepted by any of them.
+    session_secret = os.urandom(32)
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as directory:
+        relay_path = os.path.join(directory, "relay.sock")
+        broker = RelayBroker(relay_path)
+        workers = [
+            context.Process(
+                target=run_worker, name=f"worker-{index}",
+                args=(index, args.workers, relay_path, session_secret, args, password))
+            for index in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            broker.serve_forever()
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+            broker.close()
@@ -1,3 +1,4 @@
+import selectors
 import socket
 
 class NewServer:
@@ -6,25 +7,45 @@ class NewServer:
         self.ip = ip
         self.port = port
         self.socket = None
+        self.wake_writer = None
 
     def accept_connection(self):
         try:
             connection, address = self.socket.accept()
             print("Accepted connection from", address)
             return connection, address
-        except BlockingIOError:
+        except (BlockingIOError, ConnectionAbortedError):
             return None, None
-    
+
     def start_listening(self):
         self.is_running = True
-        self.socket = socket.create_server((self.ip, self.port))
-        self.socket.setblocking(False)
+        selector = selectors.DefaultSelector()
+        # shutdown() writes to this socket pair to wake the blocked select().
+        wake_reader, self.wake_writer = socket.socketpair()
+        selector.register(wake_reader, selectors.EVENT_READ)
+        server_socket = socket.create_server((self.ip, self.port))
+        server_socket.setblocking(False)
+        selector.register(server_socket, selectors.EVENT_READ)
+        self.socket = server_socket
         while self.is_running:
-            connection, address = self.accept_connection()
-            if not connection:
-                continue
-            connection.close()
+            for key, mask in selector.select():
+                if key.fileobj is wake_reader:
+                    wake_reader.recv(1024)
+                    continue
+                # Drain the whole backlog on each wakeup.
+                connection, address = self.accept_connection()
+                while connection:
+                    connection.close()
+                    connection, address = self.accept_connection()
+        selector.close()
         self.socket.close()
+        wake_reader.close()
+        self.wake_writer.close()
 
     def shutdown(self):
-        self.is_running = False
\ No newline at end of file
+        self.is_running = False
+        if self.wake_writer:
+            try:
+                self.wake_writer.send(b"\x00")
+            except OSError:  # Server has already closed the socket pair.
+                pass
@@ -1,24 +1,277 @@
-from utils import CODES, COLOURS, HEADER_LENGTH, FORMAT
-import threading
+from utils import OPCODES, COLOURS, FRAME_HEADER, FORMAT, PROTOCOL_VERSION, VERSION
+from utils import pack_frame, pack_sender, pack_drawing_info, unpack_drawing_info
+from utils import RAW_RGB, STROKES, IMAGE_FORMATS, ImageFormatError, to_raw_rgb, encode_image
+from utils import unpack_strokes, rasterize_strokes, check_drawing_size
+from utils import FrameDecoder, FrameTooLargeError
+from utils import OutboundQueue, SLOW_CONSUMER_POLICIES, DROP_OLDEST_DRAWINGS, COALESCE
+from utils import LEVELS, SampledLog, get_logger, setup_logging, stop_logging
+from utils import Metrics, DURATION_BUCKETS, SIZE_BUCKETS, OPCODE_NAMES
+from utils import UsernamePool, ColourPool, User, UserRegistry, FailureThrottle
+from utils import SessionTokens
+from utils import History, MAX_HISTORY_MESSAGES, MAX_HISTORY_BYTES, BACKFILL_MESSAGES
+from utils import MESSAGE_ID, PAGE_MESSAGES, pack_history, ChatLog, ChatLogWriter, SEGMENT_BYTES
+from utils import Room, DEFAULT_ROOM, is_room_name
+from utils import RELAY_MESSAGE, RELAY_DRAWING, pack_relayed, unpack_relayed
+from utils import DRAWING_INFO
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
 import selectors
 import getpass
 import socket
-import random
 import bcrypt
 import argparse
+import struct
+import queue
+import os
+import json
+import time
+
+LISTEN_BACKLOG = 1024
+RECV_SIZE = 65536
+# Most buffers handed to one sendmsg() call (IOV_MAX is at least 1024).
+WRITE_BATCH = 256
+BACKENDS = ("selector", "asyncio")
+MAX_QUEUE_BYTES = 8 * 1024 * 1024
+MAX_QUEUE_FRAMES = 10000
+MAX_USERNAME_BYTES = 255
+# bcrypt releases the GIL, so password checks can run on threads.
+AUTH_WORKERS = 4
+HISTORY_WORKERS = 1  # Threads opening, reading and closing chat logs
+MAX_PENDING_AUTHS = 64  # Password checks queued or running at once
+# Wrong passwords allowed from one IP address within the window.
+MAX_FAILED_LOGINS = 5
+FAILED_LOGIN_WINDOW = 60
+# Addresses allowed to ask for server stats.
+ADMIN_ADDRESSES = ("127.0.0.1", "::1")
+
+log = get_logger("server")
+FRAME_LOG = SampledLog("server.frames")
 
 
 class Server:
 
-    def __init__(self, ip, port, password):
+    def __init__(self, ip, port, password, max_queue_bytes=MAX_QUEUE_BYTES,
+                 max_queue_frames=MAX_QUEUE_FRAMES,
+                 slow_consumer_policy=DROP_OLDEST_DRAWINGS, session_secret=None,
+                 max_history_messages=MAX_HISTORY_MESSAGES,
+                 max_history_bytes=MAX_HISTORY_BYTES, history_dir=None,
+                 segment_bytes=SEGMENT_BYTES, room_scoped_names=False,
+                 relay=None, reuse_port=False):
         self.ip = ip
         self.port = port
         self.password = password
-        # self.own_client = User(None, ("", 0), "Server", "#000000")
-        # self.own_client.is_logged_in = True
-        self.users = []
+        # Limits on each client's outbound queue, and what to do when a
+        # client falls so far behind that its queue fills up.
+        self.max_queue_bytes = max_queue_bytes
+        self.max_queue_frames = max_queue_frames
+        self.slow_consumer_policy = slow_consumer_policy
+        self.slow_clients = []
+        self.password_hash = None
+        if password:
+            self.password_hash = bcrypt.hashpw(
+                password.encode(FORMAT), bcrypt.gensalt())
+        self.own_client = SimpleNamespace(
+            username="Server", colour="#000000", is_logged_in=True)
+        # Connected clients by fd, and which of them are logged in.
+        self.users = UserRegistry()
+        # Usernames and colours in use, kept up to date on every join,
+        # leave, rename and recolour. Rooms share these unless names are
+        # scoped to each room.
+        self.usernames = UsernamePool()
+        self.colours = ColourPool(COLOURS)
+        self.room_scoped_names = room_scoped_names
+        # When this is one of several worker processes, broadcasts and
+        # changes to the pools are relayed to the other workers.
+        self.relay = relay
+        self.reuse_port = reuse_port
+        if relay:
+            self.usernames, self.colours = relay.create_pools(COLOURS)
         self.is_running = True
+        self.server_socket = None
+        self.selector = None
+        self.wake_reader = None
+        self.wake_writer = None
+        # Functions other threads want run on the event loop thread.
+        self.loop_calls = queue.SimpleQueue()
+        # Password checks run on worker threads so logins never stall
+        # the event loop.
+        self.auth_pool = ThreadPoolExecutor(AUTH_WORKERS, "auth")
+        self.pending_auths = 0
+        self.failed_logins = FailureThrottle(MAX_FAILED_LOGINS, FAILED_LOGIN_WINDOW)
+        # Logged in clients get a signed token they can resume with after
+        # reconnecting, which costs an HMAC rather than a bcrypt check.
+        self.sessions = SessionTokens(session_secret)
+        # Each room keeps its recent messages and drawings for clients who
+        # join later, and optionally every message ever sent, on disk.
+        self.max_history_messages = max_history_messages
+        self.max_history_bytes = max_history_bytes
+        self.history_dir = history_dir
+        self.segment_bytes = segment_bytes
+        # Chat logs are opened, read and closed on a worker thread, so disk
+        # I/O never stalls the event loop. One thread writes them all.
+        self.history_pool = ThreadPoolExecutor(HISTORY_WORKERS, "history")
+        self.chat_log_writer = ChatLogWriter() if history_dir else None
+        self.loading_rooms = {}  # Room -> its chat log being opened
+        # Rooms by name. The lobby always exists; other rooms are made
+        # when someone joins them and dropped when the last user leaves.
+        self.rooms = {}
+        # The server is not serving yet, so the lobby's history can be
+        # read straight away.
+        self.lobby = self.create_room(DEFAULT_ROOM, wait=True)
+        # Map each opcode to the method that handles it.
+        self.handlers = {
+            OPCODES["hello"]: self.handle_hello,
+            OPCODES["disconnect"]: self.handle_disconnect,
+            OPCODES["password"]: self.handle_password,
+            OPCODES["resume"]: self.handle_resume,
+            OPCODES["set_username"]: self.handle_set_username,
+            OPCODES["message"]: self.handle_message,
+            OPCODES["drawing"]: self.handle_drawing,
+            OPCODES["send_taken_colours"]: self.handle_send_taken_colours,
+            OPCODES["set_colour"]: self.handle_set_colour,
+            OPCODES["stats"]: self.handle_stats,
+            OPCODES["history_request"]: self.handle_history_request,
+            OPCODES["join_room"]: self.handle_join_room,
+            OPCODES["leave_room"]: self.handle_leave_room,
+        }
+        self.metrics = self.create_metrics()
+
+    def create_room(self, name, wait=False):
+        usernames, colours = self.usernames, self.colours
+        if self.room_scoped_names:
+            usernames, colours = UsernamePool(), ColourPool(COLOURS)
+        history = History(self.max_history_messages, self.max_history_bytes)
+        room = Room(name, history, usernames, colours)
+        self.rooms[name] = room
+        if self.history_dir:
+            self.load_history(room, wait)
+        return room
+
+    def close_room(self, room, wait=False):
+        del self.rooms[room.name]
+        if room.chat_log is not None:
+            if wait:
+                room.chat_log.close()
+            else:
+                self.close_chat_log(room.chat_log)
+
+    def close_chat_log(self, chat_log):
+        # Closing waits for the log's last writes to be fsynced.
+        try:
+            self.history_pool.submit(chat_log.close)
+        except RuntimeError:  # The server is shutting down, so nothing waits.
+            chat_log.close()
+
+    def close_rooms(self):
+        # Logs still being opened take the messages broadcast meanwhile
+        # before they are closed.
+        for room, opening in list(self.loading_rooms.items()):
+            self.finish_loading_history(room, opening)
+        for room in list(self.rooms.values()):
+            self.close_room(room, wait=True)
+        if self.chat_log_writer:
+            self.chat_log_writer.stop()
+
+    def load_history(self, room, wait=False):
+        """Open room's chat log and fill its history, off the loop unless wait is set."""
+        # Until the log is open, messages are kept to be numbered and
+        # written once it is, and history requests wait for it.
+        room.unlogged = []
+        room.history_waiting = []
+        opening = self.history_pool.submit(self.open_chat_log, room.name)
+        self.loading_rooms[room] = opening
+        if wait:
+            self.finish_loading_history(room, opening)
+        else:
+            opening.add_done_callback(
+                lambda opening: self.call_in_loop(self.finish_loading_history, room, opening))
+
+    def open_chat_log(self, name):
+        # Runs on the history pool, so it cannot start before an earlier
+        # room of the same name has closed its log.
+        chat_log = ChatLog(os.path.join(self.history_dir, name), self.segment_bytes,
+                           writer=self.chat_log_writer)
+        try:
+            return chat_log, chat_log.page(
+                count=self.max_history_messages, max_bytes=self.max_history_bytes)
+        except (OSError, ValueError):
+            chat_log.close()
+            raise
+
+    def finish_loading_history(self, room, opening):
+        # Rooms still loading at shutdown are finished early.
+        if self.loading_rooms.pop(room, None) is None:
+            return
+        unlogged, room.unlogged = room.unlogged, None
+        waiting, room.history_waiting = room.history_waiting, None
+        try:
+            chat_log, (entries, has_more) = opening.result()
+        except (OSError, ValueError):
+            log.exception("[CHATLOG] Could not open the log of room %s", room.name)
+            chat_log, entries = None, []
+        # History needs unbroken IDs, so leave out anything before a gap.
+        next_id = chat_log.next_id if chat_log is not None else 1
+        if entries and entries[-1][0] + 1 != next_id:
+            entries = []
+        for index in range(len(entries) - 1, 0, -1):
+            if entries[index][0] != entries[index - 1][0] + 1:
+                entries = entries[index:]
+                break
+        history = History(self.max_history_messages, self.max_history_bytes,
+                          entries[0][0] if entries else next_id)
+        for message_id, frame in entries:
+            history.append(frame)
+        # Messages broadcast meanwhile carry on from the end of the log.
+        for frame in unlogged:
+            message_id = history.append(frame)
+            if chat_log is not None:
+                chat_log.append(message_id, frame)
+        # The room may have closed while its log was being opened.
+        if self.rooms.get(room.name) is not room:
+            if chat_log is not None:
+                self.close_chat_log(chat_log)
+            return
+        room.history = history
+        room.chat_log = chat_log
+        for client, before_id, count, is_backfill in waiting:
+            if client in self.users and client.room is room:
+                self.send_history(client, before_id, count, is_backfill)
+
+    def create_metrics(self):
+        metrics = Metrics()
+        metrics.counter("connections_total", "Connections accepted.")
+        metrics.counter("logins_total", "Clients logged in.")
+        metrics.counter("auth_failures_total", "Wrong passwords received.")
+        metrics.counter("resumes_total", "Clients logged in with a session token.")
+        metrics.counter("frames_in_total", "Frames received.", label="opcode")
+        metrics.counter("bytes_in_total", "Bytes of frames received.", label="opcode")
+        metrics.counter("frames_out_total", "Frames queued to clients.", label="opcode")
+        metrics.counter("bytes_out_total", "Bytes of frames queued to clients.", label="opcode")
+        metrics.gauge("connections", "Connected clients.", lambda: len(self.users))
+        metrics.gauge("logged_in_clients", "Logged in clients.",
+                      lambda: len(self.users.logged_in))
+        metrics.gauge("queue_bytes_max", "Most bytes waiting for one client.",
+                      lambda: max((b for f, b in self.get_queue_depths().values()), default=0))
+        metrics.gauge("queue_bytes_total", "Bytes waiting for all clients.",
+                      lambda: sum(b for f, b in self.get_queue_depths().values()))
+        metrics.gauge("queue_frames_max", "Most frames waiting for one client.",
+                      lambda: max((f or 0 for f, b in self.get_queue_depths().values()), default=0))
+        metrics.gauge("queue_bytes", "Bytes waiting for each client.",
+                      lambda: {fd: b for fd, (f, b) in self.get_queue_depths().items()},
+                      label="fd")
+        # The asyncio backend cannot count frames, only bytes.
+        metrics.gauge("queue_frames", "Frames waiting for each client.",
+                      lambda: {fd: f for fd, (f, b) in self.get_queue_depths().items()
+                               if f is not None},
+                      label="fd")
+        metrics.gauge("rooms", "Rooms with someone in them.", lambda: len(self.rooms))
+        metrics.gauge("history_messages", "Messages kept in history.",
+                      lambda: sum(len(room.history) for room in self.rooms.values()))
+        metrics.gauge("history_bytes", "Bytes of messages kept in history.",
+                      lambda: sum(room.history.num_bytes for room in self.rooms.values()))
+        metrics.histogram("fanout_seconds", "Time to queue one broadcast.", DURATION_BUCKETS)
+        metrics.histogram("drawing_bytes", "Size of drawings received.", SIZE_BUCKETS)
+        return metrics
 
     def with_defaults():
         return Server("127.0.0.1", 55000, "")
@@ -40,252 +293,806 @@ class Server:
             return None, None
     
     def connect_new_client(self, client_selector):
-        connection, address = self.accept_connection()
-        if not connection:
-            return
-        connection.setblocking(False)
-        # print('accepted', connection, 'from', address)
-        events = selectors.EVENT_READ | selectors.EVENT_WRITE
-        connection_data = SimpleNamespace(
-            address=address, 
-            bytes_read=b"", 
-            bytes_to_write=b""
-        )
-        client_selector.register(connection, events, data=connection_data)
-        
-        if self.password:
-            connection.send(b'SENDPASS\x00\x00\x00\x00')
+        # Accept every pending connection on each wakeup so that bursts
+        # of reconnects are drained from the backlog in one go.
+        while True:
+            try:
+                connection, address = self.accept_connection()
+            except ConnectionAbortedError:  # Client gave up while queued.
+                continue
+            except OSError as error:
+                # Out of file descriptors or buffers: leave the rest of the
+                # backlog for a later wakeup rather than stopping the server.
+                log.error("[ACCEPTERR] Could not accept a connection: %s", error)
+                return
+            if not connection:
+                return
+            connection.setblocking(False)
+            # The connection data doubles as the client's user record.
+            client = self.create_user(
+                connection, address, connection.fileno(), decoder=FrameDecoder(),
+                outbound=OutboundQueue(self.max_queue_bytes, self.max_queue_frames))
+            client_selector.register(
+                connection, selectors.EVENT_READ, data=client)
+            self.welcome_client(client)
+
+    def create_user(self, connection, address, fd, **transport):
+        # Assign client the lowest free Guest number and a random colour.
+        # Everyone starts out in the lobby.
+        client = User(
+            connection, address, fd, self.lobby.usernames.take_guest_name(),
+            self.lobby.colours.take_random(), **transport)
+        client.room = self.lobby
+        return client
+
+    def welcome_client(self, client):
+        self.users.add(client)
+        self.metrics.inc("connections_total")
+        log.info("[CONNECTED] %s connected to server", client.address[0])
+        log.info("[CONNECTIONS] %d", len(self.users))
+        if self.password_hash:
+            self.send(client, OPCODES["send_password"])
         else:
-            connection.send(b'AUTHSUCC\x00\x00\x00\x00')
-        connection.close()
-        client_selector.unregister(connection)
-        self.users.append(SimpleNamespace(address=address))
+            self.log_in(client)
 
     def start_listening(self):
-        self.server_socket = socket.create_server((self.ip, self.port))
-        self.server_socket.setblocking(False)
-        client_selector = selectors.DefaultSelector()
-        while self.is_running:
-            self.connect_new_client(client_selector)
+        self.selector = selectors.DefaultSelector()
+        # shutdown() writes to this socket pair to wake the blocked select().
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        # With reuse_port several workers listen on the same port and the
+        # kernel shares new connections out between them.
+        server_socket = socket.create_server(
+            (self.ip, self.port), backlog=LISTEN_BACKLOG, reuse_port=self.reuse_port)
+        server_socket.setblocking(False)
+        self.selector.register(server_socket, selectors.EVENT_READ)
+        self.server_socket = server_socket
+        if self.relay:
+            self.relay.attach(self.selector)
+        try:
+            while self.is_running:
+                # Block until a socket is ready, so an idle server uses no CPU.
+                for key, mask in self.selector.select():
+                    if key.fileobj is server_socket:
+                        self.connect_new_client(self.selector)
+                    elif key.fileobj is self.wake_reader:
+                        self.wake_reader.recv(RECV_SIZE)
+                        self.run_loop_calls()
+                    elif key.data is self.relay:
+                        self.service_relay(mask)
+                    else:
+                        self.service_connection(key.data, mask)
+                self.disconnect_slow_clients()
+        finally:
+            # Let running password checks finish, and chat logs that are
+            # being closed, so no worker outlives the server.
+            self.auth_pool.shutdown(cancel_futures=True)
+            self.history_pool.shutdown()
+            self.close_all_connections()
+            self.close_rooms()
+            if self.relay:
+                self.relay.close()
+            self.selector.close()
+            self.server_socket.close()
+            self.wake_reader.close()
+            self.wake_writer.close()
+        log.info("[SHUTDOWN] Server has shut down")
+
+    def service_relay(self, mask):
+        try:
+            frames = self.relay.service(mask)
+        except OSError:
+            # Without the broker this worker would drift out of step with
+            # the others, so stop.
+            log.error("[RELAY] Lost the relay broker")
+            self.shutdown()
+            return
+        for code, payload in frames:
+            self.handle_relayed_frame(code, payload)
 
-        self.server_socket.close()
-        print("[SHUTDOWN] Server has shut down")
+    def handle_relayed_frame(self, code, payload):
+        if code not in (RELAY_MESSAGE, RELAY_DRAWING):
+            self.relay.apply(code, payload, self.usernames, self.colours)
+            return
+        room_name, username, colour, body = unpack_relayed(payload)
+        room = self.rooms.get(room_name)
+        if room is None:  # Nobody here is in the room.
+            return
+        sender = SimpleNamespace(username=username, colour=colour, room=room)
+        if code == RELAY_MESSAGE:
+            self.publish_message(str(body, FORMAT), sender, relay=False)
+        else:
+            img_info = DRAWING_INFO.unpack_from(body)
+            self.publish_drawing(body[DRAWING_INFO.size:], img_info, sender, relay=False)
 
     def add_client(self, client):
-        self.users.append(client)
+        self.users.add(client)
         
     def shutdown(self):
         self.is_running = False
-        print(f"[SHUTDOWN] Shutting down server")
-
-    def receive_from_client(self, client):
-        conn = client.connection
-        addr = client.address
-        is_connected = True
-        while is_connected:
-            # If client disconnects, close the thread.
+        log.info("[SHUTDOWN] Shutting down server")
+        self.wake()
+
+    def wake(self):
+        if self.wake_writer:
             try:
-                code = self.recv(conn).decode(FORMAT)
-            except ConnectionResetError:
-                is_connected = False
-                continue
-            # DISCONNECT
-            if code == CODES["disconnect"]:
-                is_connected = False
-            # PASSWORD
-            elif code == CODES["password"]:
-                password = self.recv(conn)
-                if bcrypt.checkpw(password, self.password_hash):  # Successful login
-                    # Tell the client its colour and username.
-                    self.send(conn, CODES["colour_success"])
-                    self.send(conn, client.colour)
-                    self.send(conn, CODES["username_success"])
-                    self.send(conn, client.username)
-                    # Display a login message to all clients except this one.
-                    self.publish_message(
-                        f"{client.username} has entered the chat.", self.own_client, exclude=[client])
-                    # Log client in and send auth_success code so client can chat.
-                    client.is_logged_in = True
-                    self.send(conn, CODES["auth_success"])
-                    print(f"[AUTHSUCCESS] Client {addr} authorized")
-                else:  # Unsuccessful login
-                    # Send auth_failure code (currently unused) and send_password code.
-                    self.send(conn, CODES["auth_failure"])
-                    self.send(conn, CODES["send_password"])
-                    print(f"[AUTHFAILURE] Client {addr} unauthorized")
-            # CHANGE USERNAME
-            elif code == CODES["set_username"]:
-                username = self.recv(conn).decode(FORMAT)
-                taken_usernames = self.get_taken_usernames(client)
-                if username in taken_usernames:
-                    # Send back current username.
-                    self.send(conn, CODES["username_failure"])
-                    self.send(conn, client.username)
-                elif username != client.username:
-                    # Send back new username
-                    self.send(conn, CODES["username_success"])
-                    self.send(conn, username)
-                    # Display status message to all clients except this one.
-                    self.publish_message(
-                        f"{client.username} changed their name to {username}.", self.own_client, exclude=[client])
-                    client.username = username
-            # MESSAGE
-            elif code == CODES["message"]:
-                message = self.recv(conn).decode(FORMAT)
-                # If client is logged in, send the message to all clients.
-                if client.is_logged_in:
-                    self.publish_message(message, client)
-            # DRAWING
-            elif code == CODES["drawing"]:
-                img_size = self.recv(conn).decode(FORMAT)
-                img_data = self.recv(conn)
-                # If client is logged in, send image to all clients.
-                if client.is_logged_in:
-                    self.publish_drawing(img_data, img_size, client)
-            # SEND TAKEN COLOURS
-            elif code == CODES["send_taken_colours"]:
-                # Send back a comma-separated string of all taken colours.
-                taken_colours = self.get_taken_colours(client)
-                self.send(conn, CODES["taken_colours"])
-                self.send(conn, ",".join(taken_colours))
-            # CHANGE COLOUR
-            elif code == CODES["set_colour"]:
-                colour = self.recv(conn).decode(FORMAT)
-                taken_colours = self.get_taken_colours(client)
-                if colour in taken_colours:
-                    # Send back colour taken code and client's current colour.
-                    self.send(conn, CODES["colour_failure"])
-                    self.send(conn, client.colour)
-                else:
-                    # Send back colour success code.
-                    client.colour = colour
-                    self.send(conn, CODES["colour_success"])
-                    self.send(conn, colour)
-        # Close connection and remove client from clients.
-        conn.close()
-        self.users.remove(client)
-        print(f"[DISCONNECT] {addr} disconnected")
-        print(f"[CONNECTIONS] {len(self.users)}")
+                self.wake_writer.send(b"\x00")
+            except OSError:  # Server has already closed the socket pair.
+                pass
 
-    def get_taken_colours(self, client):
-        return [c.colour for c in self.users if c != client]
+    def call_in_loop(self, function, *args):
+        """Run function on the event loop thread. Safe to call from any thread."""
+        self.loop_calls.put((function, args))
+        self.wake()
 
-    def get_taken_usernames(self, client):
-        return [c.username for c in self.users if c != client]
+    def run_loop_calls(self):
+        while True:
+            try:
+                function, args = self.loop_calls.get_nowait()
+            except queue.Empty:
+                return
+            function(*args)
 
-    def publish_message(self, message, sender, exclude=()):
-        for client in self.users:
-            if client.is_logged_in and client not in exclude:
-                self.send(client.connection, CODES["message"])
-                self.send(client.connection, sender.username +
-                          sender.colour + message)
+    def service_connection(self, client, mask):
+        if mask & selectors.EVENT_READ:
+            self.read_from_client(client)
+        # Client may have been disconnected while reading.
+        if mask & selectors.EVENT_WRITE and client in self.users:
+            self.write_to_client(client)
 
-    def publish_drawing(self, img_data, img_size, sender, exclude=()):
-        for client in self.users:
-            if client.is_logged_in and client not in exclude:
-                conn = client.connection
-                self.send(conn, CODES["drawing"])  # !DRAWING
-                self.send(conn, sender.username + sender.colour +
-                          img_size)  # tha_phat_rabbit#00ff00400x400
-                self.send(conn, img_data)
+    def read_from_client(self, client):
+        try:
+            received = client.decoder.recv_into(client.connection)
+        except BlockingIOError:
+            return
+        except (OSError, FrameTooLargeError):
+            # Any socket error, such as a reset or a timed out connection,
+            # only ends this client's connection.
+            received = 0
+        if not received:  # Client has closed the connection.
+            self.disconnect_client(client)
+            return
+        # Handle every complete frame in the buffer, leaving any
+        # partial frame to be completed by the next read.
+        try:
+            for code, payload in client.decoder.frames():
+                self.handle_frame(client, code, payload)
+                if client not in self.users:
+                    break
+        except FrameTooLargeError:
+            log.warning("[BADFRAME] Oversized frame from %s", client.address[0])
+            self.disconnect_client(client)
 
-    @staticmethod
-    def send(recipient, message):
+    def write_to_client(self, client):
+        outbound = client.outbound
+        try:
+            if hasattr(client.connection, "sendmsg"):
+                # Write as many queued buffers as possible in one syscall.
+                sent = client.connection.sendmsg(outbound.peek_buffers(WRITE_BATCH))
+            else:  # Windows
+                sent = client.connection.send(outbound.peek_buffers(1)[0])
+        except BlockingIOError:
+            return
+        except OSError:
+            self.disconnect_client(client)
+            return
+        outbound.consume(sent)
+        # Stop waiting for write readiness once the queue is empty.
+        if not outbound:
+            self.selector.modify(
+                client.connection, selectors.EVENT_READ, data=client)
+
+    def handle_frame(self, client, code, payload):
+        if FRAME_LOG.enabled:
+            FRAME_LOG.log("RECEIVED", code, payload)
+        name = OPCODE_NAMES.get(code, "unknown")
+        self.metrics.inc("frames_in_total", 1, name)
+        self.metrics.inc("bytes_in_total", FRAME_HEADER.size + len(payload), name)
+        handler = self.handlers.get(code)
+        if handler is None:
+            log.warning("[UNKNOWNCODE] %s from %s", code, client.address[0])
+            return
+        try:
+            handler(client, payload)
+        except (ValueError, IndexError, struct.error):
+            # A malformed frame should not bring down the whole server.
+            log.warning("[BADFRAME] %s from %s", code, client.address[0])
+
+    def send(self, client, code, message=b""):
         # If message is not encoded, encode it.
         if not isinstance(message, bytes):
             message = bytes(message, FORMAT)
-        # Create a header containing num of bytes in
-        # message and pad header to a set length.
-        header = bytes(f"{len(message):<{HEADER_LENGTH}}", FORMAT)
-        recipient.send(header)
-        recipient.send(message)
-        if len(message) > 1000:
-            print(
-                F"[SENT] Header: {int(header)}, Message: {len(message)} (to {recipient.getpeername()[0]})")
+        if FRAME_LOG.enabled:
+            FRAME_LOG.log("SENT", code, message)
+        name = OPCODE_NAMES[code]
+        self.metrics.inc("frames_out_total", 1, name)
+        self.metrics.inc("bytes_out_total", FRAME_HEADER.size + len(message), name)
+        self.queue_frame(client, (pack_frame(code, message),))
+
+    def queue_frame(self, client, frame, droppable=False):
+        """
+        Queue a frame, given as a sequence of buffers, to be written once
+        the socket is writable. The buffers must not be modified afterwards,
+        as the same ones may be queued for many clients.
+        """
+        if client.is_slow:  # Already waiting to be disconnected.
+            return
+        if not client.outbound:
+            self.selector.modify(
+                client.connection,
+                selectors.EVENT_READ | selectors.EVENT_WRITE,
+                data=client
+            )
+        client.outbound.push(frame, droppable)
+        if client.outbound.is_full():
+            self.handle_full_queue(client)
+
+    def handle_full_queue(self, client):
+        outbound = client.outbound
+        policy = self.slow_consumer_policy
+        if policy == DROP_OLDEST_DRAWINGS:
+            outbound.drop_droppable()
+        elif policy == COALESCE:
+            # Replace every waiting drawing with one short notice.
+            dropped = outbound.drop_droppable(drop_all=True)
+            if dropped:
+                notice = f"Skipped {dropped} drawing(s) because your connection is slow."
+                outbound.push((pack_frame(OPCODES["message"], pack_sender(
+                    self.own_client.username, self.own_client.colour,
+                    client.protocol_version) + notice.encode(FORMAT)),))
+        # If that did not free enough space, or the policy is to
+        # disconnect, drop the client once the current event is handled.
+        if outbound.is_full():
+            client.is_slow = True
+            self.slow_clients.append(client)
+
+    def disconnect_slow_clients(self):
+        # Disconnecting publishes a message, which may overflow more queues.
+        while self.slow_clients:
+            client = self.slow_clients.pop()
+            log.warning("[SLOWCLIENT] %s could not keep up", client.address)
+            self.disconnect_client(client)
+
+    def queue_depth(self, client):
+        """Return the number of frames and bytes waiting to go to client."""
+        return len(client.outbound), client.outbound.pending_bytes
+
+    def get_queue_depths(self):
+        """Return each client's queue depth, keyed by fd."""
+        return {c.fd: self.queue_depth(c) for c in self.users}
+
+    def disconnect_client(self, client):
+        if client not in self.users:
+            return
+        self.selector.unregister(client.connection)
+        client.connection.close()
+        self.remove_client(client)
+
+    def remove_client(self, client):
+        self.users.remove(client)
+        room = client.room
+        room.usernames.release(client.username)
+        room.colours.release(client.colour)
+        if client.is_logged_in:
+            self.publish_message(
+                f"{client.username} has left the chat.", self.own_client,
+                exclude=[client], room=room)
+            self.leave_room(client)
+        log.info("[DISCONNECT] %s disconnected", client.address)
+        log.info("[CONNECTIONS] %d", len(self.users))
+
+    def close_all_connections(self):
+        # Tell every client the server is going down, then close.
+        shutdown_frame = FRAME_HEADER.pack(OPCODES["server_shutdown"], 0)
+        for client in self.users:
+            try:
+                # Finish a partly written frame so this one is not garbled.
+                client.connection.send(
+                    client.outbound.unfinished_frame() + shutdown_frame)
+            except OSError:
+                pass
+            self.selector.unregister(client.connection)
+            client.connection.close()
+        self.users.clear()
+
+    def log_in(self, client):
+        # Tell the client its colour and username.
+        self.users.log_in(client)
+        client.room.add(client)
+        self.metrics.inc("logins_total")
+        self.send(client, OPCODES["auth_success"])
+        self.send(client, OPCODES["colour_success"], client.colour)
+        self.send(client, OPCODES["username_success"], client.username)
+        self.send_session_token(client)
+        self.send_history(client, count=BACKFILL_MESSAGES, is_backfill=True)
+        # Display a login message to all clients except this one.
+        self.publish_message(
+            f"{client.username} has entered the chat.", self.own_client,
+            exclude=[client], room=client.room)
+        log.info("[AUTHSUCCESS] Client %s authorized", client.address)
+
+    def handle_join_room(self, client, payload):
+        if not client.is_logged_in:
+            return
+        name = str(payload, FORMAT)
+        if not is_room_name(name):
+            self.send(client, OPCODES["room_failure"],
+                      "Room names are up to 32 letters, numbers, - and _.")
+        elif name != client.room.name:
+            # An empty room is falsy, so it is looked up by None.
+            room = self.rooms.get(name)
+            if room is None:
+                room = self.create_room(name)
+            self.move_to_room(client, room)
+
+    def handle_leave_room(self, client, payload):
+        # Leaving a room goes back to the lobby.
+        if client.is_logged_in and client.room is not self.lobby:
+            self.move_to_room(client, self.lobby)
+
+    def move_to_room(self, client, room):
+        old_room = client.room
+        self.publish_message(
+            f"{client.username} has left the room.", self.own_client,
+            exclude=[client], room=old_room)
+        self.leave_room(client)
+        if room.usernames is not old_room.usernames:
+            # Keep the same username and colour unless someone in the new
+            # room already has them.
+            old_room.usernames.release(client.username)
+            old_room.colours.release(client.colour)
+            if client.username in room.usernames:
+                client.username = room.usernames.take_guest_name()
+            else:
+                room.usernames.take(client.username)
+            if room.colours.is_taken(client.colour):
+                client.colour = room.colours.take_random()
+            else:
+                room.colours.take(client.colour)
+        room.add(client)
+        self.send(client, OPCODES["room_joined"], room.name)
+        self.send(client, OPCODES["colour_success"], client.colour)
+        self.send(client, OPCODES["username_success"], client.username)
+        self.send_session_token(client)
+        self.send_history(client, count=BACKFILL_MESSAGES, is_backfill=True)
+        self.publish_message(
+            f"{client.username} has joined the room.", self.own_client,
+            exclude=[client], room=room)
+
+    def leave_room(self, client):
+        room = client.room
+        room.remove(client)
+        if not room and room is not self.lobby:
+            self.close_room(room)
+
+    def send_session_token(self, client):
+        # Without a password there is nothing for a token to save. Tokens
+        # name a username and colour, so a new one is sent whenever either
+        # changes.
+        if not self.password_hash:
+            return
+        token = self.sessions.issue(client.username, client.colour)
+        self.send(client, OPCODES["session_token"], token)
+
+    def handle_hello(self, client, payload):
+        # Agree on the highest version both sides speak.
+        client_version, = VERSION.unpack_from(payload)
+        client.protocol_version = min(client_version, PROTOCOL_VERSION)
+        self.send(client, OPCODES["hello"], VERSION.pack(client.protocol_version))
+        # Clients that log in without a password are logged in before
+        # they say HELLO, so they are sent history now instead.
+        if client.is_logged_in:
+            self.send_history(client, count=BACKFILL_MESSAGES, is_backfill=True)
+
+    def handle_disconnect(self, client, payload):
+        self.disconnect_client(client)
+
+    def handle_password(self, client, password):
+        if client.is_logged_in or client.is_checking_password:
+            return
+        if not self.password_hash:
+            # There is no password to check, so there is no password step.
+            self.log_in(client)
+            return
+        ip = client.address[0]
+        if self.failed_logins.is_blocked(ip):
+            self.reject_password(client, "Too many wrong passwords, try again later.")
+            return
+        if self.pending_auths >= MAX_PENDING_AUTHS:
+            self.reject_password(client, "Server busy, try again.")
+            return
+        # bcrypt is deliberately slow, so check the password on a worker
+        # thread and finish logging in back on the event loop.
+        client.is_checking_password = True
+        self.pending_auths += 1
+        check = self.auth_pool.submit(
+            bcrypt.checkpw, bytes(password), self.password_hash)
+        check.add_done_callback(
+            lambda check: self.call_in_loop(self.finish_password_check, client, check))
+
+    def finish_password_check(self, client, check):
+        client.is_checking_password = False
+        self.pending_auths -= 1
+        if client not in self.users:  # Disconnected while waiting.
+            return
+        if not check.cancelled() and check.exception() is None and check.result():
+            self.failed_logins.reset(client.address[0])
+            self.log_in(client)
         else:
-            print(
-                f"[SENT] Header: {int(header)}, Message: {message} (to {recipient.getpeername()[0]})")
+            self.failed_logins.record_failure(client.address[0])
+            self.reject_password(client, "Wrong password.")
+
+    def reject_password(self, client, reason):
+        self.metrics.inc("auth_failures_total")
+        # Send auth_failure code with the reason, and send_password code.
+        self.send(client, OPCODES["auth_failure"], reason)
+        self.send(client, OPCODES["send_password"])
+        log.info("[AUTHFAILURE] Client %s unauthorized: %s", client.address, reason)
+
+    def handle_resume(self, client, token):
+        if client.is_logged_in or client.is_checking_password:
+            return
+        ip = client.address[0]
+        session = None
+        if not self.failed_logins.is_blocked(ip):
+            session = self.sessions.verify(token)
+        if session is None:
+            self.failed_logins.record_failure(ip)
+            self.reject_password(client, "Session expired, please log in again.")
+            return
+        # Take back the old username and colour, unless someone else has
+        # taken them since.
+        username, colour = session
+        room = client.room
+        if username not in room.usernames:
+            room.usernames.release(client.username)
+            room.usernames.take(username)
+            client.username = username
+        if not room.colours.is_taken(colour, client.colour):
+            room.colours.release(client.colour)
+            room.colours.take(colour)
+            client.colour = colour
+        self.metrics.inc("resumes_total")
+        self.log_in(client)
+
+    def handle_set_username(self, client, payload):
+        username = str(payload, FORMAT)
+        is_taken = username in client.room.usernames and username != client.username
+        # Usernames are sent with a one byte length prefix.
+        if is_taken or len(payload) > MAX_USERNAME_BYTES:
+            # Send back current username.
+            self.send(client, OPCODES["username_failure"], client.username)
+        elif username != client.username:
+            # Send back new username
+            self.send(client, OPCODES["username_success"], username)
+            # Display status message to all clients except this one.
+            self.publish_message(
+                f"{client.username} changed their name to {username}.", self.own_client,
+                exclude=[client], room=client.room)
+            client.room.usernames.release(client.username)
+            client.room.usernames.take(username)
+            client.username = username
+            if client.is_logged_in:
+                self.send_session_token(client)
+
+    def handle_message(self, client, payload):
+        # If client is logged in, send the message to everyone in its room.
+        if client.is_logged_in:
+            self.publish_message(str(payload, FORMAT), client)
+
+    def handle_drawing(self, client, payload):
+        img_format, width, height, img_data = unpack_drawing_info(
+            payload, client.protocol_version)
+        try:
+            self.check_drawing(img_format, width, height, img_data, client.protocol_version)
+        except ImageFormatError as error:
+            log.warning("[BADDRAWING] %s from %s", error, client.address[0])
+            self.send(client, OPCODES["drawing_failure"], str(error))
+            return
+        self.metrics.observe("drawing_bytes", len(img_data))
+        # If client is logged in, send image to all clients.
+        if client.is_logged_in:
+            self.publish_drawing(img_data, (img_format, width, height), client)
 
     @staticmethod
-    def recv(sender):
-        header = b""
-        while len(header) < HEADER_LENGTH:
-            header += sender.recv(HEADER_LENGTH - len(header))
-        bytes_to_recv = int(header)
-        received = b""
-        # Keep receiving until all bytes have been received.
-        while len(received) < bytes_to_recv:
-            received += sender.recv(bytes_to_recv - len(received))
-        # If message is longer than 1000 bytes, print the length
-        # rather than the entire message.
-        if len(received) > 1000:
-            print(
-                f"[RECEIVED] Header: {bytes_to_recv}, Message: {len(received)} (from {sender.getpeername()[0]})")
+    def check_drawing(img_format, width, height, img_data, version):
+        # Drawings are decoded now rather than partway through a broadcast,
+        # once they are already in history and only some clients have them.
+        if img_format not in IMAGE_FORMATS:
+            raise ImageFormatError(f"Unknown image format {img_format}.")
+        check_drawing_size(width, height)
+        if img_format == STROKES:
+            if version < 4:
+                raise ImageFormatError("Strokes need protocol version 4.")
+            unpack_strokes(img_data)
         else:
-            print(
-                f"[RECEIVED] Header: {bytes_to_recv}, Message: {received} (from {sender.getpeername()[0]})")
-        return received
-
-    def connect_clients(self):
-        is_running = True
-        self.server.listen(20)  # Allow a queue of up to 20 connections
-        print("[LISTENING] Listening for new connections")
-        while is_running:
-            try:
-                # Accept new client.
-                connection, address = self.server.accept()
-            except KeyboardInterrupt:
-                # Send disconnect message and close thread.
-                for client in self.users:
-                    self.send(client.connection, CODES["server_shutdown"])
-                print("[CLOSING] Server is shutting down")
-                is_running = False
-                continue
-            # Assign client a unique number when it connects.
-            taken_usernames = [c.username for c in self.users]
-            client_num = 1
-            client_username = "Guest 1"
-            while client_username in taken_usernames:
-                client_num += 1
-                client_username = f"Guest {client_num}"
-            # Assign the client a random colour.
-            taken_colours = [c.colour for c in self.users]
-            available_colours = [
-                colour for colour in COLOURS if colour not in taken_colours]
-            client_colour = random.choice(available_colours)
-            # Create ClientData object.
-            client = User(connection, address,
-                                client_username, client_colour)
-            self.users.append(client)
-            # Start new thread running receive_message to get messages from client.
-            client_thread = threading.Thread(
-                target=self.receive_from_client, args=(client,))
-            client_thread.daemon = True  # Thread will close on exit
-            client_thread.start()
-            # Send a message to the client asking for a password
-            self.send(connection, CODES["send_password"])
-            print(f"[CONNECTED] {address[0]} connected to server")
-            print(f"[CONNECTIONS] {len(self.users)}")
-
-    # def start(self):
-    #     print("[STARTING] Server is starting up")
-    #     self.server = socket.create_server((self.ip, self.port))
-    #     password = getpass.getpass("Server Password: ")
-    #     self.password_hash = bcrypt.hashpw(
-    #         password.encode(FORMAT), bcrypt.gensalt())
-    #     self.connect_clients()
-
-
-# def port_number_argparse_type(arg_value_string):
-#     if not arg_value_string.isdigit():
-#         raise argparse.ArgumentTypeError(
-#             f"invalid port number: {arg_value_string}")
-#     port_number = int(arg_value_string)
-#     if port_number > 65535 or port_number < 1:
-#         raise argparse.ArgumentTypeError(
-#             f"invalid port number: {arg_value_string}")
-#     return port_number
+            to_raw_rgb(img_format, width, height, img_data)
+
+    def handle_stats(self, client, payload):
+        # Stats are only given to connections from this machine.
+        if client.address[0] not in ADMIN_ADDRESSES:
+            log.warning("[STATSDENIED] %s asked for stats", client.address)
+            return
+        if bytes(payload) == b"prometheus":
+            stats = self.metrics.prometheus()
+        else:
+            stats = json.dumps(self.metrics.snapshot())
+        self.send(client, OPCODES["stats"], stats)
+
+    def handle_history_request(self, client, payload):
+        # Payload is the ID of the oldest message the client has.
+        if client.is_logged_in:
+            before_id, = MESSAGE_ID.unpack_from(payload)
+            self.send_history(client, before_id)
+
+    def send_history(self, client, before_id=None, count=PAGE_MESSAGES,
+                     is_backfill=False):
+        # Only version 5 clients know what to do with history.
+        if client.protocol_version < 5:
+            return
+        room = client.room
+        if room.history_waiting is not None:
+            # Sent once the room's chat log is open, as message IDs are
+            # only known then.
+            room.history_waiting.append((client, before_id, count, is_backfill))
+            return
+        history, chat_log = room.history, room.chat_log
+        if chat_log is None or before_id is None or before_id > history.first_id:
+            entries, has_more = history.page(before_id, count)
+            if chat_log is not None and entries:
+                has_more = entries[0][0] > chat_log.first_id
+            self.send_history_page(client, entries, has_more, is_backfill)
+            return
+        # Pages older than the history in memory are read from disk.
+        reading = self.history_pool.submit(chat_log.page, before_id, count)
+        reading.add_done_callback(lambda reading: self.call_in_loop(
+            self.finish_reading_history, client, room, reading))
+
+    def finish_reading_history(self, client, room, reading):
+        # The client may have left, or moved to another room, meanwhile.
+        if client not in self.users or client.room is not room:
+            return
+        try:
+            entries, has_more = reading.result()
+        except (OSError, ValueError):
+            log.exception("[CHATLOG] Could not read history for room %s", room.name)
+            return
+        self.send_history_page(client, entries, has_more)
+
+    def send_history_page(self, client, entries, has_more, is_backfill=False):
+        # An empty page still tells the client there is nothing older.
+        if is_backfill and not entries:
+            return
+        buffers = pack_history(entries, has_more)
+        num_bytes = sum(len(buffer) for buffer in buffers)
+        self.metrics.inc("frames_out_total", 1, "history")
+        self.metrics.inc("bytes_out_total", FRAME_HEADER.size + num_bytes, "history")
+        # The frames are shared with history, not copied.
+        self.queue_frame(
+            client, [FRAME_HEADER.pack(OPCODES["history"], num_bytes)] + buffers)
+
+    def handle_send_taken_colours(self, client, payload):
+        # Send back a comma-separated string of all taken colours.
+        taken_colours = self.get_taken_colours(client)
+        self.send(client, OPCODES["taken_colours"], ",".join(taken_colours))
+
+    def handle_set_colour(self, client, payload):
+        colour = str(payload, FORMAT)
+        colours = client.room.colours
+        # Senders' colours go in a fixed width field of each frame, so
+        # only the colours on offer are accepted.
+        if colour not in COLOURS or colours.is_taken(colour, client.colour):
+            # Send back colour taken code and client's current colour.
+            self.send(client, OPCODES["colour_failure"], client.colour)
+        else:
+            # Send back colour success code.
+            colours.release(client.colour)
+            colours.take(colour)
+            client.colour = colour
+            self.send(client, OPCODES["colour_success"], colour)
+            if client.is_logged_in:
+                self.send_session_token(client)
+
+    def get_taken_colours(self, client):
+        return client.room.colours.taken_colours(client.colour)
+
+    def broadcast(self, code, make_frame, room, exclude=(), droppable=False):
+        # Build the frame once per protocol version and queue the same
+        # buffers for every user in the room who speaks it.
+        start = time.perf_counter()
+        frames = {}
+        frame_sizes = {}
+        # Keep a copy for history in the newest version, which every
+        # client that can ask for history speaks.
+        frame = make_frame(PROTOCOL_VERSION)
+        frames[PROTOCOL_VERSION] = frame
+        frame_sizes[PROTOCOL_VERSION] = sum(len(b) for b in frame)
+        history_frame = b"".join(frame)
+        message_id = room.history.append(history_frame)
+        # Written to disk by the chat log writer's thread, not this one.
+        if room.chat_log is not None:
+            room.chat_log.append(message_id, history_frame)
+        elif room.unlogged is not None:
+            room.unlogged.append(history_frame)
+        num_bytes = 0
+        num_frames = 0
+        excluded = {client.fd for client in exclude}
+        for client in room.members.values():
+            if client.fd not in excluded:
+                frame = frames.get(client.protocol_version)
+                if frame is None:
+                    frame = make_frame(client.protocol_version)
+                    frames[client.protocol_version] = frame
+                    frame_sizes[client.protocol_version] = sum(len(b) for b in frame)
+                self.queue_frame(client, frame, droppable)
+                num_bytes += frame_sizes[client.protocol_version]
+                num_frames += 1
+        name = OPCODE_NAMES[code]
+        self.metrics.inc("frames_out_total", num_frames, name)
+        self.metrics.inc("bytes_out_total", num_bytes, name)
+        self.metrics.observe("fanout_seconds", time.perf_counter() - start)
+
+    def publish_message(self, message, sender, exclude=(), room=None, relay=True):
+        # Messages go to the sender's room unless another is given.
+        if room is None:
+            room = sender.room
+        message = message.encode(FORMAT)
+        if FRAME_LOG.enabled:
+            FRAME_LOG.log("BROADCAST", OPCODES["message"], message)
+
+        def make_frame(version):
+            return (pack_frame(OPCODES["message"], pack_sender(
+                sender.username, sender.colour, version) + message),)
+
+        self.broadcast(OPCODES["message"], make_frame, room, exclude)
+        if relay and self.relay:
+            self.relay.send(RELAY_MESSAGE, pack_relayed(
+                room.name, sender.username, sender.colour), message)
+
+    def publish_drawing(self, img_data, img_info, sender, exclude=(), relay=True):
+        room = sender.room
+        img_format, width, height = img_info
+        if FRAME_LOG.enabled:
+            FRAME_LOG.log("BROADCAST", OPCODES["drawing"], img_data)
+        raster = []  # Strokes drawn as an image, for clients older than v4
+
+        def make_frame(version):
+            data = img_data
+            img_info_for_version = img_info
+            # Clients older than version 4 cannot draw strokes themselves.
+            if version < 4 and img_format == STROKES:
+                if not raster:
+                    raster.append(rasterize_strokes(
+                        unpack_strokes(img_data), width, height))
+                if version >= 3:
+                    data_format, data = encode_image(raster[0])
+                else:
+                    data_format, data = RAW_RGB, raster[0].tobytes()
+                img_info_for_version = (data_format, width, height)
+            # Clients older than version 3 only understand raw RGB.
+            elif version < 3 and img_format != RAW_RGB:
+                data = to_raw_rgb(img_format, width, height, img_data)
+                img_info_for_version = (RAW_RGB, width, height)
+            # tha_phat_rabbit#00ff00 [format] 400x400 [image data]
+            prefix = pack_sender(sender.username, sender.colour, version) + \
+                pack_drawing_info(*img_info_for_version, version)
+            header = FRAME_HEADER.pack(
+                OPCODES["drawing"], len(prefix) + len(data))
+            # The image data itself is shared, never copied.
+            return (header + prefix, data)
+
+        # Drawings may be dropped for clients that cannot keep up.
+        self.broadcast(OPCODES["drawing"], make_frame, room, exclude, droppable=True)
+        if relay and self.relay:
+            self.relay.send(RELAY_DRAWING, pack_relayed(
+                room.name, sender.username, sender.colour) + DRAWING_INFO.pack(*img_info),
+                img_data)
+
+
+def port_number_argparse_type(arg_value_string):
+    if not arg_value_string.isdigit():
+        raise argparse.ArgumentTypeError(
+            f"invalid port number: {arg_value_string}")
+    port_number = int(arg_value_string)
+    if port_number > 65535 or port_number < 1:
+        raise argparse.ArgumentTypeError(
+            f"invalid port number: {arg_value_string}")
+    return port_number
 
 
 class PasswordPrompter:
     pass
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Run the chat server.")
+    parser.add_argument("--ip", default="127.0.0.1")
+    parser.add_argument("--port", type=port_number_argparse_type, default=55000)
+    parser.add_argument("--backend", choices=BACKENDS, default="selector",
+                        help="selector event loop or asyncio streams")
+    parser.add_argument("--password", default=None,
+                        help="room password (prompted for if omitted)")
+    parser.add_argument("--max-queue-bytes", type=int, default=MAX_QUEUE_BYTES,
+                        help="most bytes waiting to be sent to one client")
+    parser.add_argument("--max-queue-frames", type=int, default=MAX_QUEUE_FRAMES,
+                        help="most frames waiting to be sent to one client")
+    parser.add_argument("--slow-consumer-policy", choices=SLOW_CONSUMER_POLICIES,
+                        default=DROP_OLDEST_DRAWINGS,
+                        help="what to do when a client's queue is full")
+    parser.add_argument("--history-messages", type=int, default=MAX_HISTORY_MESSAGES,
+                        help="most messages and drawings kept for late joiners, 0 for none")
+    parser.add_argument("--history-bytes", type=int, default=MAX_HISTORY_BYTES,
+                        help="most bytes of messages and drawings kept")
+    parser.add_argument("--history-dir", default=None,
+                        help="also keep every message in a log in this directory")
+    parser.add_argument("--segment-bytes", type=int, default=SEGMENT_BYTES,
+                        help="size at which the log starts a new file")
+    parser.add_argument("--room-scoped-names", action="store_true",
+                        help="only keep usernames and colours unique within each room")
+    parser.add_argument("--log-level", choices=LEVELS, default="INFO",
+                        help="DEBUG also logs frames")
+    parser.add_argument("--frame-log-sample", type=int, default=1, metavar="N",
+                        help="log only one in N frames at DEBUG level")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes sharing the port (Linux only)")
+    args = parser.parse_args(args)
+    if args.history_messages < 0 or args.history_bytes < 0:
+        parser.error("--history-messages and --history-bytes cannot be negative")
+    if args.workers > 1:
+        # Workers only share broadcasts and the server-wide pools.
+        if not hasattr(socket, "SO_REUSEPORT"):
+            parser.error("--workers needs SO_REUSEPORT")
+        if args.backend != "selector":
+            parser.error("--workers needs the selector backend")
+        if args.history_dir or args.room_scoped_names:
+            parser.error("--workers cannot be used with --history-dir or --room-scoped-names")
+    return args
+
+
+def server_options(args):
+    """Return the Server keyword arguments set by command line args."""
+    return dict(
+        max_queue_bytes=args.max_queue_bytes,
+        max_queue_frames=args.max_queue_frames,
+        slow_consumer_policy=args.slow_consumer_policy,
+        max_history_messages=args.history_messages,
+        max_history_bytes=args.history_bytes,
+        history_dir=args.history_dir,
+        segment_bytes=args.segment_bytes,
+        room_scoped_names=args.room_scoped_names,
+    )
+
+
+def main(args=None):
+    args = parse_args(args)
+    setup_logging(args.log_level, {FRAME_LOG.category: args.frame_log_sample})
+    password = args.password
+    if password is None:
+        password = getpass.getpass("Server Password: ")
+    if args.workers > 1:
+        from cluster import run_workers
+        log.info("[STARTING] %d workers listening on %s:%d", args.workers, args.ip, args.port)
+        try:
+            run_workers(args, password)
+        except KeyboardInterrupt:
+            log.info("[CLOSING] Server is shutting down")
+        finally:
+            stop_logging()
+        return
+    server_class = Server
+    if args.backend == "asyncio":
+        from async_server import AsyncServer
+        server_class = AsyncServer
+    server = server_class(args.ip, args.port, password, **server_options(args))
+    log.info("[STARTING] %s server listening on %s:%d", args.backend, args.ip, args.port)
+    try:
+        server.start_listening()
+    except KeyboardInterrupt:
+        log.info("[CLOSING] Server is shutting down")
+    finally:
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
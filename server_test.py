@@ -1,15 +1,24 @@
 import unittest
+import errno
+import json
 import struct
 import time
 import sys
 import socket
 import threading
+import zlib
+import tempfile
 from server import Server
+from async_server import AsyncServer
 from server import PasswordPrompter
+from utils import LINE, STROKES, ZLIB_RGB, ZLIB_PALETTE, Stroke, pack_strokes, to_raw_rgb
+from utils import FailureThrottle, unpack_history
 
 
 class TestServer(unittest.TestCase):
 
+    server_class = Server
+
     def test_one_plus_one_equals_two(self):
         self.assertEqual(1 + 1, 2)
 
@@ -26,6 +35,21 @@ class TestServer(unittest.TestCase):
         message_code, message_length = struct.unpack("8sI", header_buffer)
         return message_code.decode() == "SENDPASS"
 
+    def recv_frame(self, client):
+        header_buffer = b""
+        while len(header_buffer) < 12:
+            header_buffer += client.recv(12 - len(header_buffer))
+        message_code, message_length = struct.unpack("8sI", header_buffer)
+        payload = b""
+        while len(payload) < message_length:
+            payload += client.recv(message_length - len(payload))
+        return message_code.rstrip(b"\x00").decode(), payload
+
+    @staticmethod
+    def wait_for_server_to_start(server):
+        while not server.server_socket:
+            pass
+
     def client_provides_correct_password(self, client, server):
         client.send(struct.pack("8sI", b"PASSWORD", len(server.password.encode())))
         client.send(server.password.encode())
@@ -35,6 +59,7 @@ class TestServer(unittest.TestCase):
         try:
             server_thread = threading.Thread(target=server.start_listening)
             server_thread.start()
+            self.wait_for_server_to_start(server)
 
             callback(server)
         except Exception as e:
@@ -46,14 +71,14 @@ class TestServer(unittest.TestCase):
                 server_thread.join()
 
     def test_should_connect_client(self):
-        server = Server("127.0.0.1", 55555, "")
+        server = self.server_class("127.0.0.1", 55555, "")
         def callback(server):
             client = self.client_connection_is_made(server)
             client.close()
         self.start_server_in_thread_and_do_callback(server, callback)
 
     def test_should_authenticate_client_when_password_empty(self):
-        server = Server("127.0.0.1", 55555, "")
+        server = self.server_class("127.0.0.1", 55555, "")
         def callback(server):
             client = self.client_connection_is_made(server)
             self.assertTrue(self.does_client_receive_auth_success_message(client))
@@ -61,7 +86,7 @@ class TestServer(unittest.TestCase):
 
     def test_should_connect_two_clients(self):
         password = "passywordy"
-        server = Server("127.0.0.1", 55555, password)
+        server = self.server_class("127.0.0.1", 55555, password)
         def callback(server):
             first_client = self.client_connection_is_made(server)
             self.assertTrue(self.does_client_receive_password_request_message(first_client))
@@ -72,11 +97,374 @@ class TestServer(unittest.TestCase):
         self.start_server_in_thread_and_do_callback(server, callback)
             
     def test_should_ask_client_for_password(self):
-        server = Server("127.0.0.1", 55555, "password")
+        server = self.server_class("127.0.0.1", 55555, "password")
         def callback(server):
             client = self.client_connection_is_made(server)
             self.assertTrue(self.does_client_receive_password_request_message(client))
         self.start_server_in_thread_and_do_callback(server, callback)
 
+    def test_should_keep_client_connected_after_authentication(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            self.assertTrue(self.does_client_receive_auth_success_message(client))
+            code, colour = self.recv_frame(client)
+            self.assertEqual("COLORSUC", code)
+            self.assertEqual(7, len(colour))
+            self.assertEqual(("UNAMESUC", b"Guest 1"), self.recv_frame(client))
+            client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_broadcast_message_to_other_clients(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            first_client = self.client_connection_is_made(server)
+            for _ in range(3):
+                self.recv_frame(first_client)
+            second_client = self.client_connection_is_made(server)
+            for _ in range(3):
+                self.recv_frame(second_client)
+            # First client is told that the second client has joined.
+            code, payload = self.recv_frame(first_client)
+            self.assertEqual("MESSAGE", code)
+            self.assertTrue(payload.endswith(b"Guest 2 has entered the chat."))
+            second_client.send(struct.pack("8sI", b"MESSAGE", 5) + b"hello")
+            code, payload = self.recv_frame(first_client)
+            self.assertEqual("MESSAGE", code)
+            self.assertTrue(payload.startswith(b"Guest 2#"))
+            self.assertTrue(payload.endswith(b"hello"))
+            first_client.close()
+            second_client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_refuse_colours_not_on_offer(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            self.recv_frame(client)
+            code, colour = self.recv_frame(client)
+            self.recv_frame(client)
+            client.send(struct.pack("8sI", b"SETCOLOR", 3) + b"red")
+            self.assertEqual(("COLORERR", colour), self.recv_frame(client))
+            client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_negotiate_protocol_version(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            client.send(struct.pack("8sI", b"HELLO", 1) + bytes([2]))
+            code = None
+            while code != "HELLO":
+                code, payload = self.recv_frame(client)
+            self.assertEqual(bytes([2]), payload)
+            # Version 2 prefixes the sender's username with its length.
+            client.send(struct.pack("8sI", b"MESSAGE", 2) + b"hi")
+            code, payload = self.recv_frame(client)
+            self.assertEqual("MESSAGE", code)
+            self.assertTrue(payload.startswith(bytes([7]) + b"Guest 1#"))
+            self.assertTrue(payload.endswith(b"hi"))
+            client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_draw_strokes_for_older_clients(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        strokes = pack_strokes([Stroke(LINE, b"\xff\x00\x00", 3, [(2, 5), (18, 5)])])
+        def callback(server):
+            clients = []
+            for version in (4, 3):
+                client = self.client_connection_is_made(server)
+                client.send(struct.pack("8sI", b"HELLO", 1) + bytes([version]))
+                code = None
+                while code != "HELLO":
+                    code, payload = self.recv_frame(client)
+                clients.append(client)
+            drawing = struct.pack("!BHH", STROKES, 20, 10) + strokes
+            clients[0].send(struct.pack("8sI", b"DRAWING", len(drawing)) + drawing)
+            code = None
+            while code != "DRAWING":
+                code, payload = self.recv_frame(clients[1])
+            # Version 3 gets the strokes drawn as a palette image.
+            info_start = 1 + payload[0] + 7
+            img_format, width, height = struct.unpack_from("!BHH", payload, info_start)
+            self.assertEqual((ZLIB_PALETTE, 20, 10), (img_format, width, height))
+            raw = to_raw_rgb(img_format, width, height, payload[info_start + 5:])
+            self.assertEqual(b"\xff\x00\x00", raw[(5 * 20 + 10) * 3:][:3])
+            for client in clients:
+                client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def assert_drawing_refused(self, drawing, version, recipient_version=None):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            sender = self.client_connection_is_made(server)
+            sender.send(struct.pack("8sI", b"HELLO", 1) + bytes([version]))
+            recipient = self.client_connection_is_made(server)
+            if recipient_version is not None:
+                recipient.send(struct.pack("8sI", b"HELLO", 1) + bytes([recipient_version]))
+            for _ in range(3):
+                self.recv_frame(recipient)
+            sender.send(struct.pack("8sI", b"DRAWING", len(drawing)) + drawing)
+            code = None
+            while code != "DRAWERR":
+                code, payload = self.recv_frame(sender)
+            sender.send(struct.pack("8sI", b"MESSAGE", 5) + b"after")
+            code = payload = None
+            while not payload or not payload.endswith(b"after"):
+                code, payload = self.recv_frame(recipient)
+                self.assertNotEqual("DRAWING", code)
+            # Nothing is kept of it either.
+            self.assertFalse(any(frame.startswith(b"DRAWING")
+                                 for i, frame in server.lobby.history.page()[0]))
+            sender.close()
+            recipient.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_refuse_images_declaring_huge_size(self):
+        img_data = zlib.compress(bytes(1024 * 1024))
+        self.assert_drawing_refused(
+            struct.pack("!BHH", ZLIB_RGB, 65535, 65535) + img_data, 3)
+
+    def test_should_refuse_images_that_do_not_decode(self):
+        # Clients older than version 3 would need it decoded to raw RGB.
+        for img_format, img_data in ((ZLIB_RGB, b"not zlib"), (ZLIB_PALETTE, b""),
+                                     (ZLIB_PALETTE, bytes([1]) + zlib.compress(b"x"))):
+            with self.subTest(img_format=img_format, img_data=img_data):
+                self.assert_drawing_refused(
+                    struct.pack("!BHH", img_format, 10, 10) + img_data, 3, 2)
+
+    def test_should_refuse_strokes_declaring_huge_canvas(self):
+        strokes = pack_strokes([Stroke(LINE, b"\xff\x00\x00", 3, [(2, 5), (18, 5)])])
+        self.assert_drawing_refused(struct.pack("!BHH", STROKES, 8000, 8000) + strokes, 4)
+
+    def test_should_send_stats_to_local_admin(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            client.send(struct.pack("8sI", b"STATS", 4) + b"json")
+            code = None
+            while code != "STATS":
+                code, payload = self.recv_frame(client)
+            stats = json.loads(payload)
+            self.assertEqual(1, stats["connections_total"])
+            self.assertEqual(1, stats["frames_in_total"]["stats"])
+            # One entry per connected client, keyed by fd.
+            self.assertEqual(1, len(stats["queue_bytes"]))
+            client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_throttle_wrong_passwords_from_one_address(self):
+        server = self.server_class("127.0.0.1", 55555, "password")
+        server.failed_logins = FailureThrottle(1, 60)
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            self.assertTrue(self.does_client_receive_password_request_message(client))
+            client.send(struct.pack("8sI", b"PASSWORD", 5) + b"wrong")
+            self.assertEqual(("AUTHFAIL", b"Wrong password."), self.recv_frame(client))
+            self.assertEqual("SENDPASS", self.recv_frame(client)[0])
+            # Even the right password is refused until the window passes.
+            self.client_provides_correct_password(client, server)
+            code, reason = self.recv_frame(client)
+            self.assertEqual("AUTHFAIL", code)
+            self.assertTrue(reason.startswith(b"Too many wrong passwords"))
+            client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_resume_session_without_password(self):
+        server = self.server_class("127.0.0.1", 55555, "password")
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            self.assertTrue(self.does_client_receive_password_request_message(client))
+            self.client_provides_correct_password(client, server)
+            self.assertEqual("AUTHSUCC", self.recv_frame(client)[0])
+            colour = self.recv_frame(client)[1]
+            self.recv_frame(client)
+            self.assertEqual("SESSION", self.recv_frame(client)[0])
+            # Renaming gets a new token for the new name.
+            client.send(struct.pack("8sI", b"SETUNAME", 5) + b"Alice")
+            self.assertEqual(("UNAMESUC", b"Alice"), self.recv_frame(client))
+            code, token = self.recv_frame(client)
+            self.assertEqual("SESSION", code)
+            client.close()
+            deadline = time.monotonic() + 1
+            while "Alice" in server.usernames and time.monotonic() < deadline:
+                time.sleep(0.01)
+            client = self.client_connection_is_made(server)
+            self.assertTrue(self.does_client_receive_password_request_message(client))
+            client.send(struct.pack("8sI", b"RESUME", len(token)) + token)
+            self.assertEqual("AUTHSUCC", self.recv_frame(client)[0])
+            self.assertEqual(("COLORSUC", colour), self.recv_frame(client))
+            self.assertEqual(("UNAMESUC", b"Alice"), self.recv_frame(client))
+            # A token that has been tampered with is refused.
+            other_client = self.client_connection_is_made(server)
+            self.assertTrue(self.does_client_receive_password_request_message(other_client))
+            forged = token[:-1] + bytes([token[-1] ^ 1])
+            other_client.send(struct.pack("8sI", b"RESUME", len(forged)) + forged)
+            self.assertEqual("AUTHFAIL", self.recv_frame(other_client)[0])
+            self.assertEqual("SENDPASS", self.recv_frame(other_client)[0])
+            other_client.close()
+            client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_send_history_to_late_joiners(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            first_client = self.client_connection_is_made(server)
+            for text in (b"one", b"two", b"three"):
+                first_client.send(struct.pack("8sI", b"MESSAGE", len(text)) + text)
+            # History also holds the server's "has entered the chat" messages.
+            deadline = time.monotonic() + 1
+            while len(server.lobby.history) < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            client = self.client_connection_is_made(server)
+            client.send(struct.pack("8sI", b"HELLO", 1) + bytes([5]))
+            code = None
+            while code != "HISTORY":
+                code, payload = self.recv_frame(client)
+            entries, has_more = unpack_history(payload)
+            self.assertTrue(bytes(entries[1][2]).endswith(b"one"))
+            self.assertTrue(bytes(entries[3][2]).endswith(b"three"))
+            # Ask for what came before the "one" message.
+            client.send(struct.pack("8sI", b"HISTREQ", 8) + struct.pack("!Q", entries[1][0]))
+            code, payload = self.recv_frame(client)
+            self.assertEqual("HISTORY", code)
+            older, has_more = unpack_history(payload)
+            self.assertEqual(entries[:1], older)
+            self.assertFalse(has_more)
+            first_client.close()
+            client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_keep_history_across_restarts(self):
+        with tempfile.TemporaryDirectory() as history_dir:
+            server = self.server_class("127.0.0.1", 55555, "", history_dir=history_dir)
+            def callback(server):
+                client = self.client_connection_is_made(server)
+                client.send(struct.pack("8sI", b"MESSAGE", 5) + b"hello")
+                deadline = time.monotonic() + 1
+                while len(server.lobby.history) < 2 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                client.close()
+            self.start_server_in_thread_and_do_callback(server, callback)
+            server = self.server_class("127.0.0.1", 55555, "", history_dir=history_dir)
+            # The message is there, and new messages carry on after it.
+            entries, has_more = server.lobby.history.page()
+            self.assertTrue(any(frame.endswith(b"hello") for i, frame in entries))
+            self.assertEqual(server.lobby.chat_log.next_id, server.lobby.history.next_id)
+            server.close_rooms()
+
+    def test_should_disconnect_clients_sending_oversized_frames(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            client.send(struct.pack("8sI", b"MESSAGE", 0xFFFFFFFF))
+            # Whatever was already queued is read, then the connection ends.
+            while client.recv(4096):
+                pass
+            deadline = time.monotonic() + 1
+            while server.users and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(0, len(server.users))
+            client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_keep_running_when_accept_runs_out_of_files(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def accept_connection():
+            raise OSError(errno.EMFILE, "Too many open files")
+        server.accept_connection = accept_connection
+        # The wakeup is given up on, and nobody is connected.
+        server.connect_new_client(None)
+        self.assertEqual(0, len(server.users))
+        server.close_rooms()
+
+    def test_should_rejoin_the_lobby_while_it_is_empty(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            for name in (b"games", b"lobby"):
+                client.send(struct.pack("8sI", b"JOIN", len(name)) + name)
+                code = None
+                while code != "JOINED":
+                    code, payload = self.recv_frame(client)
+                self.assertEqual(name, payload)
+            self.assertIs(server.lobby, server.rooms["lobby"])
+            # Someone connecting now is in the same lobby.
+            other_client = self.client_connection_is_made(server)
+            code, payload = None, b""
+            while not (code == "MESSAGE" and payload.endswith(b"has entered the chat.")):
+                code, payload = self.recv_frame(client)
+            client.close()
+            other_client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_backfill_rooms_from_their_log_after_a_restart(self):
+        def join_games(client):
+            client.send(struct.pack("8sI", b"JOIN", 5) + b"games")
+            code = None
+            while code != "JOINED":
+                code, payload = self.recv_frame(client)
+        with tempfile.TemporaryDirectory() as history_dir:
+            server = self.server_class("127.0.0.1", 55555, "", history_dir=history_dir)
+            def callback(server):
+                client = self.client_connection_is_made(server)
+                join_games(client)
+                client.send(struct.pack("8sI", b"MESSAGE", 5) + b"hello")
+                code, payload = None, b""
+                while not (code == "MESSAGE" and payload.endswith(b"hello")):
+                    code, payload = self.recv_frame(client)
+                client.close()
+            self.start_server_in_thread_and_do_callback(server, callback)
+            server = self.server_class("127.0.0.1", 55555, "", history_dir=history_dir)
+            def callback(server):
+                # The room's log is read off the event loop, and the backfill
+                # waits for it.
+                client = self.client_connection_is_made(server)
+                client.send(struct.pack("8sI", b"HELLO", 1) + bytes([5]))
+                join_games(client)
+                code = None
+                while code != "HISTORY":
+                    code, payload = self.recv_frame(client)
+                entries, has_more = unpack_history(payload)
+                self.assertTrue(any(bytes(frame).endswith(b"hello")
+                                    for i, sender, frame in entries))
+                client.close()
+            self.start_server_in_thread_and_do_callback(server, callback)
+
+    def test_should_only_send_messages_to_the_senders_room(self):
+        server = self.server_class("127.0.0.1", 55555, "")
+        def callback(server):
+            client = self.client_connection_is_made(server)
+            other_client = self.client_connection_is_made(server)
+            client.send(struct.pack("8sI", b"JOIN", 5) + b"games")
+            code = None
+            while code != "JOINED":
+                code, payload = self.recv_frame(client)
+            self.assertEqual(b"games", payload)
+            other_client.send(struct.pack("8sI", b"MESSAGE", 5) + b"lobby")
+            deadline = time.monotonic() + 1
+            while not any(frame.endswith(b"lobby") for i, frame in server.lobby.history.page()[0]) \
+                    and time.monotonic() < deadline:
+                time.sleep(0.01)
+            client.send(struct.pack("8sI", b"MESSAGE", 5) + b"games")
+            code = None
+            while code != "MESSAGE":
+                code, payload = self.recv_frame(client)
+            self.assertTrue(payload.endswith(b"games"))
+            # Leaving goes back to the lobby, and the empty room is closed.
+            client.send(struct.pack("8sI", b"LEAVE", 0))
+            while code != "JOINED":
+                code, payload = self.recv_frame(client)
+            self.assertEqual(b"lobby", payload)
+            self.assertEqual(["lobby"], list(server.rooms))
+            client.close()
+            other_client.close()
+        self.start_server_in_thread_and_do_callback(server, callback)
+
+
+class TestAsyncServer(TestServer):
+
+    server_class = AsyncServer
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,34 @@
+"""
+Print a running server's stats.
+
+    python stats.py --port 55000 --prometheus
+"""
+from utils import OPCODES, FORMAT, send_frame, recv_frame
+import argparse
+import socket
+
+
+def fetch_stats(ip, port, prometheus=False):
+    """Ask the server at ip:port for its stats, as JSON or Prometheus text."""
+    with socket.create_connection((ip, port), timeout=5) as connection:
+        send_frame(connection, OPCODES["stats"], b"prometheus" if prometheus else b"json")
+        code = None
+        # Skip the greeting the server sends every new connection.
+        while code != OPCODES["stats"]:
+            code, payload = recv_frame(connection)
+        send_frame(connection, OPCODES["disconnect"])
+    return str(payload, FORMAT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a running server's stats.")
+    parser.add_argument("--ip", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=55000)
+    parser.add_argument("--prometheus", action="store_true",
+                        help="print Prometheus text instead of JSON")
+    args = parser.parse_args()
+    print(fetch_stats(args.ip, args.port, args.prometheus))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+import os
+from utils import ChatLog, ChatLogWriter, pack_frame
+
+
+def message(num):
+    return pack_frame(b"MESSAGE", f"message {num}".encode())
+
+
+class ChatLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_should_read_back_messages_after_reopening(self):
+        chat_log = ChatLog(self.directory.name)
+        for num in range(1, 11):
+            chat_log.append(num, message(num))
+        chat_log.close()
+        chat_log = ChatLog(self.directory.name)
+        self.addCleanup(chat_log.close)
+        self.assertEqual(11, chat_log.next_id)
+        entries, has_more = chat_log.page(count=3)
+        self.assertEqual([(8, message(8)), (9, message(9)), (10, message(10))], entries)
+        self.assertTrue(has_more)
+        entries, has_more = chat_log.page(before_id=3, count=3)
+        self.assertEqual([1, 2], [message_id for message_id, frame in entries])
+        self.assertFalse(has_more)
+
+    def test_should_rotate_segments_by_size(self):
+        chat_log = ChatLog(self.directory.name, segment_bytes=100)
+        for num in range(1, 21):
+            chat_log.append(num, message(num))
+        chat_log.close()
+        names = os.listdir(self.directory.name)
+        self.assertGreater(len([name for name in names if name.endswith(".log")]), 1)
+        chat_log = ChatLog(self.directory.name)
+        self.addCleanup(chat_log.close)
+        # Pages can span segments.
+        entries, has_more = chat_log.page(count=20)
+        self.assertEqual([(num, message(num)) for num in range(1, 21)], entries)
+        # Only the segment being written stays open between reads.
+        self.assertEqual([False] * (len(chat_log.segments) - 1) + [True],
+                         [segment.is_open for segment in chat_log.segments])
+
+    def test_should_share_one_writer_between_logs(self):
+        writer = ChatLogWriter()
+        self.addCleanup(writer.stop)
+        paths = [os.path.join(self.directory.name, name) for name in ("a", "b")]
+        chat_logs = [ChatLog(path, writer=writer) for path in paths]
+        for num in range(1, 4):
+            for chat_log in chat_logs:
+                chat_log.append(num, message(num))
+        # Closing one log writes everything queued to it, and leaves the
+        # writer running for the other.
+        chat_logs[0].close()
+        chat_logs[1].append(4, message(4))
+        chat_logs[1].close()
+        for path, next_id in zip(paths, (4, 5)):
+            chat_log = ChatLog(path)
+            self.addCleanup(chat_log.close)
+            self.assertEqual(next_id, chat_log.next_id)
+
+    def test_should_drop_partly_written_message(self):
+        chat_log = ChatLog(self.directory.name)
+        for num in range(1, 4):
+            chat_log.append(num, message(num))
+        chat_log.close()
+        # Cut the last message short, as if the server died writing it.
+        path = os.path.join(self.directory.name, f"{1:020d}.log")
+        os.truncate(path, os.path.getsize(path) - 1)
+        chat_log = ChatLog(self.directory.name)
+        self.addCleanup(chat_log.close)
+        self.assertEqual(3, chat_log.next_id)
+        self.assertEqual(2 * len(message(1)), os.path.getsize(path))
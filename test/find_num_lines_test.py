@@ -0,0 +1,25 @@
+import unittest
+from utils import find_num_lines
+
+
+class FindNumLinesTest(unittest.TestCase):
+
+    def test_should_wrap_at_word_boundaries(self):
+        self.assertEqual(1, find_num_lines("", 10))
+        self.assertEqual(1, find_num_lines("Abominable", 10))
+        self.assertEqual(5, find_num_lines("Abominable Strawberry Government", 10))
+        self.assertEqual(2, find_num_lines("aaa bbb ccc", 8))
+
+    def test_should_only_move_long_words_to_a_new_line_with_add_extra(self):
+        text = "Guest 1: " + "h" * 90 + " 6"
+        self.assertEqual(2, find_num_lines(text, 76))
+        self.assertEqual(3, find_num_lines(text, 76, True))
+
+    def test_should_stay_linear_on_long_text(self):
+        # The old version took minutes on text this long.
+        text = " ".join(["word"] * 20000)
+        self.assertEqual(1334, find_num_lines(text, 77, True))
+
+
+if __name__ == "__main__":
+    unittest.main()
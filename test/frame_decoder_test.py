@@ -0,0 +1,72 @@
+import unittest
+import struct
+from utils import FrameDecoder, FrameTooLargeError
+
+
+class FakeSocket:
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, buffer):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        # Deliver only as much as fits, like a real socket would.
+        if len(chunk) > len(buffer):
+            self.chunks.insert(0, chunk[len(buffer):])
+            chunk = chunk[:len(buffer)]
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def frame(code, payload):
+    return struct.pack("8sI", code, len(payload)) + payload
+
+
+class FrameDecoderTest(unittest.TestCase):
+
+    @staticmethod
+    def decode_all(decoder, sock):
+        frames = []
+        while decoder.recv_into(sock):
+            frames.extend((code, bytes(payload)) for code, payload in decoder.frames())
+        return frames
+
+    def test_should_decode_several_frames_from_one_read(self):
+        data = frame(b"MESSAGE", b"hello") + frame(b"DISCONN", b"")
+        frames = self.decode_all(FrameDecoder(), FakeSocket([data]))
+        self.assertEqual([(b"MESSAGE", b"hello"), (b"DISCONN", b"")], frames)
+
+    def test_should_decode_frame_split_across_reads(self):
+        data = frame(b"MESSAGE", b"hello world")
+        chunks = [data[:5], data[5:14], data[14:]]
+        frames = self.decode_all(FrameDecoder(), FakeSocket(chunks))
+        self.assertEqual([(b"MESSAGE", b"hello world")], frames)
+
+    def test_should_grow_buffer_for_frame_larger_than_buffer(self):
+        payload = bytes(range(256)) * 4000
+        data = frame(b"DRAWING", payload)
+        chunks = [data[i:i + 3000] for i in range(0, len(data), 3000)]
+        decoder = FrameDecoder(buffer_size=4096)
+        frames = self.decode_all(decoder, FakeSocket(chunks))
+        self.assertEqual([(b"DRAWING", payload)], frames)
+
+    def test_should_keep_payload_valid_after_later_reads(self):
+        decoder = FrameDecoder(buffer_size=32)
+        sock = FakeSocket([frame(b"MESSAGE", b"first"), frame(b"MESSAGE", b"x" * 100)])
+        decoder.recv_into(sock)
+        code, first = decoder.next_frame()
+        while decoder.recv_into(sock):
+            list(decoder.frames())
+        self.assertEqual(b"first", bytes(first))
+
+    def test_should_reject_oversized_frame(self):
+        decoder = FrameDecoder(max_frame_size=10)
+        decoder.recv_into(FakeSocket([frame(b"MESSAGE", b"x" * 11)]))
+        with self.assertRaises(FrameTooLargeError):
+            decoder.next_frame()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from utils import History, pack_history, unpack_history, pack_frame
+
+
+class HistoryTest(unittest.TestCase):
+
+    def test_should_keep_only_the_newest_messages(self):
+        history = History(max_messages=3, max_bytes=1000)
+        ids = [history.append(bytes([num]) * 10) for num in range(5)]
+        self.assertEqual([1, 2, 3, 4, 5], ids)
+        self.assertEqual(3, len(history))
+        self.assertEqual(30, history.num_bytes)
+        entries, has_more = history.page()
+        self.assertEqual([3, 4, 5], [message_id for message_id, frame in entries])
+        self.assertFalse(has_more)
+
+    def test_should_keep_nothing_with_no_room(self):
+        history = History(max_messages=0)
+        self.assertEqual([1, 2], [history.append(b"x"), history.append(b"y")])
+        self.assertEqual(0, len(history))
+        self.assertEqual(([], False), history.page())
+
+    def test_should_keep_under_byte_limit(self):
+        history = History(max_messages=100, max_bytes=25)
+        for num in range(10):
+            history.append(b"x" * 10)
+        self.assertEqual(2, len(history))
+        self.assertEqual(20, history.num_bytes)
+        # A frame over the limit on its own is still kept.
+        history.append(b"x" * 30)
+        self.assertEqual(1, len(history))
+
+    def test_should_page_back_through_history(self):
+        history = History(max_messages=100, max_bytes=1000)
+        for num in range(10):
+            history.append(b"x" * 10)
+        entries, has_more = history.page(count=4)
+        self.assertEqual([7, 8, 9, 10], [message_id for message_id, frame in entries])
+        self.assertTrue(has_more)
+        entries, has_more = history.page(before_id=7, count=4, max_bytes=25)
+        self.assertEqual([5, 6], [message_id for message_id, frame in entries])
+        entries, has_more = history.page(before_id=3, count=4)
+        self.assertEqual([1, 2], [message_id for message_id, frame in entries])
+        self.assertFalse(has_more)
+
+    def test_should_round_trip_history_payload(self):
+        frames = [pack_frame(b"MESSAGE", b"hi"), pack_frame(b"DRAWING", b"")]
+        payload = b"".join(pack_history(list(zip([4, 5], frames)), True))
+        entries, has_more = unpack_history(payload)
+        self.assertEqual([(4, b"MESSAGE", b"hi"), (5, b"DRAWING", b"")], entries)
+        self.assertTrue(has_more)
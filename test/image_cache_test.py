@@ -0,0 +1,37 @@
+import unittest
+from utils import ImageCache
+
+
+class ImageCacheTest(unittest.TestCase):
+
+    def test_should_drop_least_recently_used_images_first(self):
+        cache = ImageCache(max_bytes=30)
+        cache.put("a", "image a", 10)
+        cache.put("b", "image b", 10)
+        cache.put("c", "image c", 10)
+        self.assertEqual("image a", cache.get("a"))
+        cache.put("d", "image d", 10)
+        self.assertNotIn("b", cache)
+        self.assertEqual(["c", "a", "d"], list(cache.images))
+        self.assertEqual(30, cache.num_bytes)
+
+    def test_should_keep_newest_image_even_if_over_limit(self):
+        cache = ImageCache(max_bytes=30)
+        cache.put("a", "image a", 10)
+        cache.put("big", "big image", 50)
+        self.assertEqual(["big"], list(cache.images))
+        self.assertEqual(50, cache.num_bytes)
+
+    def test_should_replace_image_for_same_key(self):
+        cache = ImageCache()
+        cache.put("a", "old", 10)
+        cache.put("a", "new", 20)
+        self.assertEqual("new", cache.get("a"))
+        self.assertEqual(20, cache.num_bytes)
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.num_bytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+import zlib
+from utils import ImageFormatError, RAW_RGB, ZLIB_PALETTE, ZLIB_RGB, to_raw_rgb
+
+
+class ImageCodecTest(unittest.TestCase):
+
+    def test_should_convert_palette_image_to_raw_rgb(self):
+        palette = b"\xff\xff\xff" + b"\x10\x20\x30"
+        img_data = bytes([1]) + palette + zlib.compress(bytes([0, 1, 1, 0]))
+        raw = to_raw_rgb(ZLIB_PALETTE, 2, 2, img_data)
+        self.assertEqual(b"\xff\xff\xff\x10\x20\x30\x10\x20\x30\xff\xff\xff", raw)
+
+    def test_should_convert_zlib_image_to_raw_rgb(self):
+        raw = bytes(range(12))
+        self.assertEqual(raw, to_raw_rgb(ZLIB_RGB, 2, 2, zlib.compress(raw)))
+        self.assertEqual(raw, to_raw_rgb(RAW_RGB, 2, 2, raw))
+
+    def test_should_refuse_data_larger_than_image(self):
+        with self.assertRaises(ImageFormatError):
+            to_raw_rgb(ZLIB_RGB, 2, 2, zlib.compress(bytes(10 ** 6)))
+        with self.assertRaises(ImageFormatError):
+            to_raw_rgb(7, 2, 2, b"")
+
+    def test_should_refuse_palette_cut_short(self):
+        for img_data in (b"", bytes([3]) + b"\x00" * 6):
+            with self.assertRaises(ImageFormatError):
+                to_raw_rgb(ZLIB_PALETTE, 2, 2, img_data)
@@ -0,0 +1,33 @@
+import unittest
+import io
+from utils import SampledLog, get_logger, setup_logging, stop_logging
+
+
+class LogTest(unittest.TestCase):
+
+    def tearDown(self):
+        stop_logging()
+
+    def test_should_not_log_frames_above_debug_level(self):
+        frame_log = SampledLog("test.quiet")
+        setup_logging("INFO", stream=io.StringIO())
+        self.assertFalse(frame_log.enabled)
+
+    def test_should_log_one_in_every_n_frames(self):
+        frame_log = SampledLog("test.sampled")
+        output = io.StringIO()
+        setup_logging("DEBUG", {"test.sampled": 10}, stream=output)
+        for num in range(100):
+            frame_log.log("SENT", b"MESSAGE", b"hi")
+        stop_logging()
+        self.assertEqual(10, output.getvalue().count("[SENT]"))
+
+    def test_should_truncate_long_payloads(self):
+        frame_log = SampledLog("test.truncated")
+        output = io.StringIO()
+        setup_logging("DEBUG", max_payload=4, stream=output)
+        frame_log.log("RECEIVED", b"DRAWING", memoryview(b"abcdefgh"))
+        get_logger("test").info("[DONE]")
+        stop_logging()
+        self.assertIn("Length: 8, Message: b'abcd'...", output.getvalue())
+        self.assertIn("[DONE]", output.getvalue())
@@ -0,0 +1,32 @@
+import unittest
+from utils import Metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_should_write_prometheus_text(self):
+        metrics = Metrics()
+        metrics.counter("frames_in_total", "Frames received.", label="opcode")
+        metrics.gauge("connections", "Connected clients.", lambda: 3)
+        metrics.gauge("queue_bytes", "Bytes waiting.", lambda: {7: 10, 5: 0}, label="fd")
+        metrics.histogram("fanout_seconds", "Time to queue one broadcast.", (0.1, 1.0))
+        metrics.inc("frames_in_total", 2, "message")
+        metrics.observe("fanout_seconds", 0.5)
+        metrics.observe("fanout_seconds", 2)
+        text = metrics.prometheus()
+        self.assertIn('pictochat_frames_in_total{opcode="message"} 2\n', text)
+        self.assertIn("# TYPE pictochat_connections gauge\npictochat_connections 3\n", text)
+        self.assertIn('pictochat_queue_bytes{fd="5"} 0\npictochat_queue_bytes{fd="7"} 10\n', text)
+        self.assertIn('pictochat_fanout_seconds_bucket{le="0.1"} 0\n', text)
+        self.assertIn('pictochat_fanout_seconds_bucket{le="1.0"} 1\n', text)
+        self.assertIn('pictochat_fanout_seconds_bucket{le="+Inf"} 2\n', text)
+        self.assertIn("pictochat_fanout_seconds_count 2\n", text)
+
+    def test_should_snapshot_counters_with_and_without_labels(self):
+        metrics = Metrics()
+        metrics.counter("logins_total", "Clients logged in.")
+        metrics.counter("bytes_in_total", "Bytes received.", label="opcode")
+        metrics.inc("logins_total")
+        metrics.inc("bytes_in_total", 12, "hello")
+        self.assertEqual({"logins_total": 1, "bytes_in_total": {"hello": 12}},
+                         metrics.snapshot())
@@ -0,0 +1,53 @@
+import unittest
+from utils import OutboundQueue
+
+
+class OutboundQueueTest(unittest.TestCase):
+
+    def test_should_return_buffers_after_partial_write(self):
+        queue = OutboundQueue(max_bytes=100, max_frames=10)
+        queue.push((b"abc", b"def"))
+        queue.push((b"ghi",))
+        queue.consume(4)
+        self.assertEqual([b"ef", b"ghi"], [bytes(b) for b in queue.peek_buffers(10)])
+        self.assertEqual(5, queue.pending_bytes)
+        queue.consume(5)
+        self.assertEqual(0, len(queue))
+
+    def test_should_be_full_when_over_byte_or_frame_limit(self):
+        queue = OutboundQueue(max_bytes=5, max_frames=2)
+        queue.push((b"abc",))
+        self.assertFalse(queue.is_full())
+        queue.push((b"def",))
+        self.assertTrue(queue.is_full())
+        queue = OutboundQueue(max_bytes=100, max_frames=2)
+        for _ in range(3):
+            queue.push((b"a",))
+        self.assertTrue(queue.is_full())
+
+    def test_should_drop_oldest_drawings_until_not_full(self):
+        queue = OutboundQueue(max_bytes=10, max_frames=10)
+        queue.push((b"11111",), droppable=True)
+        queue.push((b"msg",))
+        queue.push((b"22222",), droppable=True)
+        self.assertEqual(1, queue.drop_droppable())
+        self.assertEqual([b"msg", b"22222"], queue.peek_buffers(10))
+
+    def test_should_not_drop_partly_written_drawing(self):
+        queue = OutboundQueue(max_bytes=1, max_frames=10)
+        queue.push((b"11111",), droppable=True)
+        queue.push((b"22222",), droppable=True)
+        queue.consume(2)
+        self.assertEqual(1, queue.drop_droppable(drop_all=True))
+        self.assertEqual(b"111", queue.unfinished_frame())
+
+    def test_should_return_only_the_rest_of_a_partly_written_frame(self):
+        queue = OutboundQueue(max_bytes=100, max_frames=10)
+        queue.push((b"HDR", b"DATA"))
+        queue.push((b"NEXTH", b"NEXTD"))
+        queue.consume(4)
+        self.assertEqual(b"ATA", queue.unfinished_frame())
+
+
+if __name__ == "__main__":
+    unittest.main()
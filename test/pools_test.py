@@ -0,0 +1,60 @@
+import unittest
+from utils import UsernamePool, ColourPool
+
+
+class UsernamePoolTest(unittest.TestCase):
+
+    def test_should_give_out_lowest_free_guest_number(self):
+        usernames = UsernamePool()
+        names = [usernames.take_guest_name() for _ in range(4)]
+        self.assertEqual(["Guest 1", "Guest 2", "Guest 3", "Guest 4"], names)
+        usernames.release("Guest 3")
+        usernames.release("Guest 2")
+        self.assertEqual("Guest 2", usernames.take_guest_name())
+        self.assertEqual("Guest 3", usernames.take_guest_name())
+        self.assertEqual("Guest 5", usernames.take_guest_name())
+
+    def test_should_skip_guest_names_taken_by_renaming(self):
+        usernames = UsernamePool()
+        usernames.take("Guest 1")
+        usernames.take("Guest 3")
+        self.assertEqual("Guest 2", usernames.take_guest_name())
+        self.assertEqual("Guest 4", usernames.take_guest_name())
+        usernames.release("Guest 3")
+        self.assertEqual("Guest 3", usernames.take_guest_name())
+        self.assertNotIn("Guest 03", usernames)
+
+    def test_should_only_give_out_own_share_of_guest_numbers(self):
+        usernames = UsernamePool(first_number=2, step=3)
+        names = [usernames.take_guest_name() for _ in range(3)]
+        self.assertEqual(["Guest 2", "Guest 5", "Guest 8"], names)
+        # Another worker's number is never handed out here.
+        usernames.take("Guest 3")
+        usernames.release("Guest 3")
+        usernames.release("Guest 5")
+        self.assertEqual("Guest 5", usernames.take_guest_name())
+        self.assertEqual("Guest 11", usernames.take_guest_name())
+
+
+class ColourPoolTest(unittest.TestCase):
+
+    def test_should_give_out_free_colours_until_none_are_left(self):
+        colours = ColourPool(["#000001", "#000002"])
+        taken = {colours.take_random(), colours.take_random()}
+        self.assertEqual({"#000001", "#000002"}, taken)
+        # With every colour taken, colours are shared.
+        shared = colours.take_random()
+        self.assertIn(shared, taken)
+        colours.release("#000001")
+        colours.release("#000002")
+        self.assertEqual([shared], colours.taken_colours())
+
+    def test_should_not_count_own_colour_as_taken(self):
+        colours = ColourPool(["#000001", "#000002"])
+        colours.take("#000001")
+        self.assertFalse(colours.is_taken("#000001", "#000001"))
+        self.assertTrue(colours.is_taken("#000001", "#000002"))
+        self.assertEqual([], colours.taken_colours("#000001"))
+        colours.release("#000001")
+        self.assertEqual("#000002", ColourPool(["#000002"]).take_random())
+        self.assertFalse(colours.is_taken("#000001"))
@@ -0,0 +1,34 @@
+import unittest
+from utils import User, UserRegistry
+
+
+class UserRegistryTest(unittest.TestCase):
+
+    def test_should_only_list_logged_in_users_as_logged_in(self):
+        users = UserRegistry()
+        first = User(None, None, 5, "Guest 1", "#000000")
+        second = User(None, None, 6, "Guest 2", "#000000")
+        users.add(first)
+        users.add(second)
+        users.log_in(second)
+        self.assertEqual([first, second], list(users))
+        self.assertEqual([second], list(users.logged_in.values()))
+        self.assertTrue(second.is_logged_in)
+
+    def test_should_not_remove_new_user_with_reused_fd(self):
+        users = UserRegistry()
+        old = User(None, None, 5, "Guest 1", "#000000")
+        new = User(None, None, 5, "Guest 2", "#000000")
+        users.add(old)
+        users.log_in(old)
+        users.remove(old)
+        users.add(new)
+        users.remove(old)
+        self.assertIn(new, users)
+        self.assertNotIn(old, users)
+        self.assertEqual(1, len(users))
+        self.assertEqual({}, users.logged_in)
+
+    def test_should_not_allow_new_attributes(self):
+        with self.assertRaises(AttributeError):
+            User(None, None, 5, "Guest 1", "#000000").nickname = "x"
@@ -0,0 +1,85 @@
+import unittest
+import selectors
+import tempfile
+import threading
+import time
+import os
+from utils import RelayBroker, RelayClient, RELAY_MESSAGE, pack_relayed, unpack_relayed
+from utils.relay import TAKE_USERNAME
+
+
+class RelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "relay.sock")
+        self.broker = RelayBroker(self.path)
+        self.thread = threading.Thread(target=self.broker.serve_forever)
+        self.thread.start()
+        self.relays = []
+
+    def tearDown(self):
+        for relay, selector in self.relays:
+            relay.close()
+            selector.close()
+        self.broker.shutdown()
+        self.thread.join()
+        self.broker.close()
+        self.directory.cleanup()
+
+    def connect(self, worker_index, num_workers=2):
+        relay = RelayClient(self.path, worker_index, num_workers)
+        selector = selectors.DefaultSelector()
+        relay.attach(selector)
+        self.relays.append((relay, selector))
+        return relay, selector
+
+    def receive(self, relay, selector, count):
+        frames = []
+        deadline = time.monotonic() + 5
+        while len(frames) < count and time.monotonic() < deadline:
+            for key, mask in selector.select(0.1):
+                frames += [(code, bytes(payload)) for code, payload in relay.service(mask)]
+        return frames
+
+    def test_should_round_trip_relayed_sender(self):
+        payload = pack_relayed("lobby", "Guest 1", "#123456") + b"hello"
+        self.assertEqual(("lobby", "Guest 1", "#123456", b"hello"),
+                         unpack_relayed(payload))
+
+    def test_should_pass_frames_to_other_workers_only(self):
+        first, first_selector = self.connect(0)
+        second, second_selector = self.connect(1)
+        # Wait for the broker to accept both before sending.
+        time.sleep(0.1)
+        first.send(RELAY_MESSAGE, b"hello")
+        self.assertEqual([(RELAY_MESSAGE, b"hello")],
+                         self.receive(second, second_selector, 1))
+        self.assertEqual([], first_selector.select(0.1))
+
+    def test_should_keep_pools_in_step_across_workers(self):
+        first, first_selector = self.connect(0)
+        first_names, first_colours = first.create_pools(["#000001", "#000002"])
+        second, second_selector = self.connect(1)
+        second_names, second_colours = second.create_pools(["#000001", "#000002"])
+        time.sleep(0.1)
+        self.assertEqual("Guest 1", first_names.take_guest_name())
+        first_colours.take("#000001")
+        for code, payload in self.receive(second, second_selector, 2):
+            RelayClient.apply(code, payload, second_names, second_colours)
+        self.assertIn("Guest 1", second_names)
+        self.assertTrue(second_colours.is_taken("#000001"))
+        self.assertEqual("Guest 2", second_names.take_guest_name())
+
+    def test_should_tell_late_workers_what_is_taken(self):
+        first, first_selector = self.connect(0)
+        first_names, first_colours = first.create_pools(["#000001"])
+        first_names.take("alice")
+        time.sleep(0.1)
+        late, late_selector = self.connect(1)
+        self.assertEqual([(TAKE_USERNAME, b"alice")],
+                         self.receive(late, late_selector, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
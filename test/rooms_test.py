@@ -0,0 +1,23 @@
+import unittest
+from utils import Room, History, User, UsernamePool, ColourPool, is_room_name
+
+
+class RoomTest(unittest.TestCase):
+
+    def test_should_check_room_names(self):
+        self.assertTrue(is_room_name("games-2_b"))
+        self.assertFalse(is_room_name(""))
+        self.assertFalse(is_room_name("../etc"))
+        self.assertFalse(is_room_name("x" * 33))
+
+    def test_should_track_members(self):
+        room = Room("games", History(), UsernamePool(), ColourPool(["#000000"]))
+        user = User(None, None, 4, "Guest 1", "#000000")
+        room.add(user)
+        self.assertIs(room, user.room)
+        self.assertEqual({4: user}, room.members)
+        # A different user that reused the fd is not removed.
+        room.remove(User(None, None, 4, "Guest 2", "#000000"))
+        self.assertEqual(1, len(room))
+        room.remove(user)
+        self.assertEqual(0, len(room))
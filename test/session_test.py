@@ -0,0 +1,31 @@
+import unittest
+from utils import SessionTokens
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+class SessionTokensTest(unittest.TestCase):
+
+    def test_should_verify_own_tokens_until_they_expire(self):
+        clock = FakeClock()
+        sessions = SessionTokens(b"secret", lifetime=60, clock=clock)
+        token = sessions.issue("Guest 1", "#ff0000")
+        self.assertEqual(("Guest 1", "#ff0000"), sessions.verify(token))
+        clock.now += 61
+        self.assertIsNone(sessions.verify(token))
+
+    def test_should_refuse_forged_tokens(self):
+        sessions = SessionTokens(b"secret")
+        token = sessions.issue("Alice", "#00ff00")
+        self.assertIsNone(SessionTokens(b"other secret").verify(token))
+        # Changing the username breaks the signature.
+        forged = token.replace(b"Alice", b"Alicf")
+        self.assertIsNone(sessions.verify(forged))
+        self.assertIsNone(sessions.verify(b"short"))
@@ -0,0 +1,49 @@
+import unittest
+import zlib
+from utils import (
+    ImageFormatError, LINE, OVAL, Stroke, actions_to_strokes, pack_strokes,
+    unpack_strokes, rasterize_strokes)
+
+
+def rgb(colour):
+    return {"black": b"\x00\x00\x00", "#ff0000": b"\xff\x00\x00"}[colour]
+
+
+class StrokesTest(unittest.TestCase):
+
+    def test_should_join_connected_lines_into_one_stroke(self):
+        actions = [[
+            {"type": "oval", "id": 1, "coords": [5.5, 5.5, 4.5, 4.5], "fill": "black"},
+            {"type": "line", "id": 2, "coords": [5, 5, 9, 7], "width": 1, "fill": "black"},
+            {"type": "line", "id": 3, "coords": [9, 7, 12, 3], "width": 1, "fill": "black"},
+        ], [
+            {"type": "line", "id": 4, "coords": [12, 3, 20, 3], "width": 3, "fill": "#ff0000"},
+        ]]
+        self.assertEqual([
+            Stroke(OVAL, b"\x00\x00\x00", 0, [(5.5, 5.5), (4.5, 4.5)]),
+            Stroke(LINE, b"\x00\x00\x00", 1, [(5, 5), (9, 7), (12, 3)]),
+            Stroke(LINE, b"\xff\x00\x00", 3, [(12, 3), (20, 3)]),
+        ], actions_to_strokes(actions, rgb))
+
+    def test_should_unpack_packed_strokes(self):
+        strokes = [
+            Stroke(OVAL, b"\x00\x00\x00", 0, [(5.5, 5.5), (4.5, 4.5)]),
+            Stroke(LINE, b"\xff\x00\x00", 3, [(12, 3), (20, 3), (699, 399)]),
+        ]
+        self.assertEqual(strokes, unpack_strokes(pack_strokes(strokes)))
+
+    def test_should_refuse_truncated_strokes(self):
+        packed = zlib.decompress(pack_strokes([Stroke(LINE, b"\x00\x00\x00", 1, [(1, 2), (3, 4)])]))
+        with self.assertRaises(ImageFormatError):
+            unpack_strokes(zlib.compress(packed[:-2]))
+
+    def test_should_rasterize_strokes(self):
+        image = rasterize_strokes([Stroke(LINE, b"\xff\x00\x00", 3, [(2, 5), (18, 5)])], 20, 10)
+        self.assertEqual((255, 0, 0), image.getpixel((10, 5)))
+        self.assertEqual((255, 255, 255), image.getpixel((10, 1)))
+
+    def test_should_rasterize_strokes_scaled(self):
+        strokes = [Stroke(LINE, b"\xff\x00\x00", 3, [(2, 5), (18, 5)])]
+        image = rasterize_strokes(strokes, 10, 5, scale=0.5)
+        self.assertEqual((255, 0, 0), image.getpixel((5, 2)))
+        self.assertEqual((255, 255, 255), image.getpixel((0, 2)))
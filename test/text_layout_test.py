@@ -0,0 +1,53 @@
+import unittest
+from utils import FontMetrics, measure_text
+
+
+class CountingMeasure:
+    """Fixed width glyphs, except "W", which is three times as wide."""
+
+    def __init__(self, glyph_width):
+        self.glyph_width = glyph_width
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return sum(self.glyph_width * (3 if glyph == "W" else 1) for glyph in text)
+
+
+class TextLayoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.measure = CountingMeasure(10)
+        self.small = FontMetrics(self.measure, 15)
+        self.medium = FontMetrics(CountingMeasure(12), 18)
+
+    def test_should_wrap_whole_words(self):
+        self.assertEqual((1, 15), measure_text([("", self.small)], 100))
+        self.assertEqual((1, 15), measure_text([("aaaa bbbb", self.small)], 100))
+        self.assertEqual((2, 30), measure_text([("aaaa bbbb cc", self.small)], 100))
+        # Trailing spaces may run past the end of the line.
+        self.assertEqual((1, 15), measure_text([("aaaa bbbbb    ", self.small)], 100))
+
+    def test_should_measure_wide_glyphs(self):
+        self.assertEqual((1, 15), measure_text([("aaaa aaaa", self.small)], 90))
+        self.assertEqual((2, 30), measure_text([("aaaa WWaa", self.small)], 90))
+
+    def test_should_break_words_longer_than_a_line(self):
+        self.assertEqual((4, 60), measure_text([("a " + "b" * 25, self.small)], 100))
+
+    def test_should_keep_newlines_and_empty_lines(self):
+        self.assertEqual((3, 45), measure_text([("a\n\nb", self.small)], 100))
+
+    def test_should_make_lines_as_tall_as_their_tallest_font(self):
+        runs = [("Guest 1: ", self.medium), ("hello " * 10, self.small)]
+        lines, height = measure_text(runs, 200)
+        self.assertEqual(18 + 15 * (lines - 1), height)
+
+    def test_should_only_measure_each_word_once(self):
+        measure_text([("hello hello hello", self.small)], 100)
+        measure_text([("hello", self.small)], 100)
+        self.assertEqual(2, self.measure.calls)  # "hello" and " "
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from utils import FailureThrottle
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FailureThrottleTest(unittest.TestCase):
+
+    def test_should_block_after_too_many_recent_failures(self):
+        clock = FakeClock()
+        throttle = FailureThrottle(max_failures=2, window=60, clock=clock)
+        throttle.record_failure("10.0.0.1")
+        self.assertFalse(throttle.is_blocked("10.0.0.1"))
+        clock.now = 30
+        throttle.record_failure("10.0.0.1")
+        self.assertTrue(throttle.is_blocked("10.0.0.1"))
+        self.assertFalse(throttle.is_blocked("10.0.0.2"))
+        # The first failure falls out of the window.
+        clock.now = 61
+        self.assertFalse(throttle.is_blocked("10.0.0.1"))
+
+    def test_should_forget_addresses_that_stop_failing(self):
+        clock = FakeClock()
+        throttle = FailureThrottle(max_failures=2, window=60, clock=clock)
+        throttle.record_failure("10.0.0.1")
+        clock.now = 120
+        throttle.record_failure("10.0.0.2")
+        self.assertEqual(["10.0.0.2"], list(throttle.failures))
+        throttle.reset("10.0.0.2")
+        self.assertEqual({}, throttle.failures)
@@ -0,0 +1,50 @@
+import unittest
+from utils import Transcript, TranscriptEntry, MESSAGE_ENTRY
+
+
+def make_entries(*heights):
+    return [TranscriptEntry(MESSAGE_ENTRY, "Guest 1", "#000000", "hi", height)
+            for height in heights]
+
+
+class TranscriptTest(unittest.TestCase):
+
+    def test_should_lay_entries_out_with_spacing(self):
+        transcript = Transcript(spacing=6)
+        for entry in make_entries(20, 30, 40):
+            transcript.append(entry)
+        self.assertEqual(108, transcript.height)
+        self.assertEqual([3, 29, 65], [transcript.top(index) for index in range(3)])
+
+    def test_should_find_only_entries_in_view(self):
+        transcript = Transcript()
+        for entry in make_entries(*[10] * 1000):
+            transcript.append(entry)
+        self.assertEqual(range(500, 503), transcript.visible(5000, 5030))
+        # An entry only partly in view counts.
+        self.assertEqual(range(499, 503), transcript.visible(4995, 5025))
+        self.assertEqual(range(0, 1), transcript.visible(-100, 5))
+        self.assertEqual(range(999, 1000), transcript.visible(9995, 20000))
+        self.assertEqual(0, len(transcript.visible(10000, 20000)))
+
+    def test_should_move_entries_down_when_prepending(self):
+        transcript = Transcript(spacing=2)
+        newest = make_entries(10)[0]
+        transcript.append(newest)
+        older = make_entries(20, 30)
+        self.assertEqual(54, transcript.prepend(older))
+        self.assertEqual([older[0], older[1], newest], list(transcript))
+        self.assertEqual(55, transcript.top(2))
+        self.assertEqual(range(2, 3), transcript.visible(60, 61))
+
+    def test_should_be_empty_after_clearing(self):
+        transcript = Transcript()
+        for entry in make_entries(10, 10):
+            transcript.append(entry)
+        transcript.clear()
+        self.assertEqual(0, transcript.height)
+        self.assertEqual(0, len(transcript.visible(0, 100)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,6 +10,35 @@ except ModuleNotFoundError:
     
 from utils.find_nth import find_nth
 from utils.find_num_lines import find_num_lines
+from utils.text_layout import FontMetrics, measure_text
+from utils.protocol import (
+    FORMAT, FRAME_HEADER, PROTOCOL_VERSION, VERSION, DRAWING_INFO, pack_frame, send_frame,
+    recv_frame, pack_sender, unpack_sender, pack_drawing_info, unpack_drawing_info)
+from utils.image_codec import (
+    RAW_RGB, ZLIB_RGB, ZLIB_PALETTE, STROKES, IMAGE_FORMATS, ImageFormatError,
+    encode_image, decode_image, to_raw_rgb)
+from utils.strokes import (
+    CANVAS_SIZE, LINE, OVAL, Stroke, actions_to_strokes, pack_strokes,
+    unpack_strokes, rasterize_strokes, check_drawing_size)
+from utils.frame_decoder import FrameDecoder, FrameTooLargeError, MAX_FRAME_SIZE
+from utils.outbound_queue import (
+    OutboundQueue, SLOW_CONSUMER_POLICIES, DROP_OLDEST_DRAWINGS, COALESCE, DISCONNECT)
+from utils.pools import UsernamePool, ColourPool, guest_number
+from utils.registry import User, UserRegistry
+from utils.throttle import FailureThrottle
+from utils.session import SessionTokens, SESSION_LIFETIME
+from utils.history import (
+    History, MAX_HISTORY_MESSAGES, MAX_HISTORY_BYTES, BACKFILL_MESSAGES, PAGE_MESSAGES,
+    MESSAGE_ID, pack_history, unpack_history)
+from utils.chat_log import ChatLog, ChatLogWriter, SEGMENT_BYTES
+from utils.rooms import Room, DEFAULT_ROOM, is_room_name
+from utils.transcript import Transcript, TranscriptEntry, MESSAGE_ENTRY, DRAWING_ENTRY
+from utils.image_cache import ImageCache, MAX_IMAGE_BYTES
+from utils.relay import (
+    RELAY_MESSAGE, RELAY_DRAWING, RelayBroker, RelayClient, pack_relayed, unpack_relayed)
+from utils.metrics import Metrics, Histogram, DURATION_BUCKETS, SIZE_BUCKETS
+from utils.log import (
+    LEVELS, MAX_PAYLOAD, SampledLog, get_logger, setup_logging, stop_logging)
 # from utils.install_font import install_font
 import json
 
@@ -19,5 +48,9 @@ with open("utils/codes.json", "r") as codes_file:
 with open("utils/colours.json", "r") as colours_file:
     COLOURS = json.load(colours_file)
 
+# Binary frame opcodes. Each is at most 8 bytes so it fits in FRAME_HEADER.
+with open("utils/opcodes.json", "r") as opcodes_file:
+    OPCODES = {name: code.encode() for name, code in json.load(opcodes_file).items()}
+OPCODE_NAMES = {code: name for name, code in OPCODES.items()}
+
 HEADER_LENGTH = 8
-FORMAT = "utf-8"
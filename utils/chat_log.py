@@ -0,0 +1,358 @@
+"""
+An append-only log of every broadcast message and drawing on disk, so that
+history survives restarts and old pages can be read without keeping them
+all in memory.
+
+The log is a directory of segments. Each segment is a data file holding
+whole frames back to back, named after the ID of its first message, and
+an index file of where each message ends, which is memory-mapped so any
+message is found in constant time. Frames are written by a background
+thread, which may be shared by many logs, and fsynced in batches, so disk
+I/O never holds up a broadcast.
+Only the segment being written stays open. Older ones are opened for as
+long as it takes to read from them.
+"""
+from utils.history import PAGE_MESSAGES, MAX_BATCH_BYTES
+from utils.log import get_logger
+import threading
+import bisect
+import struct
+import queue
+import mmap
+import time
+import os
+
+SEGMENT_BYTES = 64 * 1024 * 1024  # A new segment is started past this size
+INDEX_ENTRIES = 1 << 20  # Most messages in one segment
+INDEX_ENTRY = struct.Struct("!Q")  # Offset just past the end of a message
+FSYNC_INTERVAL = 1.0  # Most seconds a written message waits to be fsynced
+MAX_BATCH = 1024  # Most messages written at once
+
+log = get_logger("chat_log")
+
+
+class Segment:
+    """One data file and its index, starting at message first_id."""
+
+    def __init__(self, directory, first_id):
+        self.first_id = first_id
+        path = os.path.join(directory, f"{first_id:020d}")
+        self.data_path = path + ".log"
+        self.index_path = path + ".idx"
+        self.is_open = False
+        self.open()
+        self.count = self.find_count()
+        self.size = self.end(self.count - 1)
+        # Drop anything written after the last indexed message, which is
+        # left over from a crash partway through a write.
+        self.writer.truncate(self.size)
+
+    def open(self):
+        if self.is_open:
+            return
+        self.writer = open(self.data_path, "ab")
+        self.reader = open(self.data_path, "rb", buffering=0)
+        self.index_file = open(
+            self.index_path, "r+b" if os.path.exists(self.index_path) else "w+b")
+        self.index_file.truncate(INDEX_ENTRIES * INDEX_ENTRY.size)
+        self.index = mmap.mmap(self.index_file.fileno(), INDEX_ENTRIES * INDEX_ENTRY.size)
+        self.is_open = True
+
+    def find_count(self):
+        # Messages are indexed in order, so the first empty entry is found
+        # with a binary search.
+        low, high = 0, INDEX_ENTRIES
+        while low < high:
+            middle = (low + high) // 2
+            if INDEX_ENTRY.unpack_from(self.index, middle * INDEX_ENTRY.size)[0]:
+                low = middle + 1
+            else:
+                high = middle
+        # The index may have reached the disk before the data it points to.
+        data_size = os.path.getsize(self.data_path)
+        while low and self.end(low - 1) > data_size:
+            low -= 1
+            INDEX_ENTRY.pack_into(self.index, low * INDEX_ENTRY.size, 0)
+        return low
+
+    @property
+    def next_id(self):
+        return self.first_id + self.count
+
+    def end(self, position):
+        if position < 0:
+            return 0
+        return INDEX_ENTRY.unpack_from(self.index, position * INDEX_ENTRY.size)[0]
+
+    def message_size(self, message_id):
+        position = message_id - self.first_id
+        return self.end(position) - self.end(position - 1)
+
+    def read(self, start_id, end_id):
+        """Return the frames of messages start_id up to end_id."""
+        start = self.end(start_id - self.first_id - 1)
+        self.reader.seek(start)
+        data = self.reader.read(self.end(end_id - self.first_id - 1) - start)
+        frames = []
+        for position in range(start_id - self.first_id, end_id - self.first_id):
+            frames.append(data[self.end(position - 1) - start:self.end(position) - start])
+        return frames
+
+    def write(self, frames):
+        """Write frames, returning the index entries to add once they are flushed."""
+        ends = []
+        for frame in frames:
+            self.writer.write(frame)
+            self.size += len(frame)
+            ends.append(self.size)
+        self.writer.flush()
+        return ends
+
+    def add_to_index(self, ends):
+        for offset, end in enumerate(ends, self.count):
+            INDEX_ENTRY.pack_into(self.index, offset * INDEX_ENTRY.size, end)
+        self.count += len(ends)
+
+    def sync(self):
+        os.fsync(self.writer.fileno())
+        self.index.flush()
+
+    def close(self):
+        if not self.is_open:
+            return
+        self.writer.close()
+        self.reader.close()
+        self.index.close()
+        self.index_file.close()
+        self.is_open = False
+
+
+class ChatLogWriter:
+    """
+    A thread that writes the frames queued to any number of chat logs, and
+    fsyncs each log at most every fsync_interval seconds.
+    """
+
+    def __init__(self, fsync_interval=FSYNC_INTERVAL):
+        self.fsync_interval = fsync_interval
+        self.queue = queue.SimpleQueue()  # (ChatLog, item) pairs, or None to stop
+        self.thread = threading.Thread(target=self.write_forever, name="chat-log", daemon=True)
+        self.thread.start()
+
+    def append(self, chat_log, message_id, frame):
+        self.queue.put((chat_log, (message_id, frame)))
+
+    def close_log(self, chat_log):
+        """Write and fsync everything queued to chat_log, then return."""
+        done = threading.Event()
+        self.queue.put((chat_log, done))
+        done.wait()
+
+    def stop(self):
+        """Write and fsync everything queued, then end the thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def write_forever(self):
+        dirty = set()  # Logs written to but not yet fsynced
+        last_sync = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.fsync_interval if dirty else None)
+            except queue.Empty:
+                self.sync(dirty)
+                last_sync = time.monotonic()
+                continue
+            batch = [item]
+            while item is not None and len(batch) < MAX_BATCH:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            is_stopping = batch[-1] is None
+            if is_stopping:
+                batch.pop()
+            # Each log's messages are written together, in order, and a log
+            # being closed is fsynced once everything before it is written.
+            messages = {}
+            closing = []
+            for chat_log, item in batch:
+                if isinstance(item, threading.Event):
+                    closing.append((chat_log, item))
+                else:
+                    messages.setdefault(chat_log, []).append(item)
+            for chat_log, log_batch in messages.items():
+                try:
+                    chat_log.write(log_batch)
+                    dirty.add(chat_log)
+                except OSError:
+                    log.exception("[CHATLOG] Could not write %d messages", len(log_batch))
+            for chat_log, done in closing:
+                self.sync([chat_log])
+                dirty.discard(chat_log)
+                done.set()
+            if is_stopping or time.monotonic() - last_sync >= self.fsync_interval:
+                self.sync(dirty)
+                last_sync = time.monotonic()
+            if is_stopping:
+                return
+
+    @staticmethod
+    def sync(chat_logs):
+        for chat_log in list(chat_logs):
+            try:
+                chat_log.sync()
+            except OSError:
+                log.exception("[CHATLOG] Could not fsync %s", chat_log.directory)
+        chat_logs.clear()
+
+
+class ChatLog:
+    """
+    Every message ever broadcast, on disk. append() only queues a frame;
+    page() reads back frames that have been written.
+
+    Frames are written by writer, a ChatLogWriter, or by a writer of the
+    log's own if none is given.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES,
+                 fsync_interval=FSYNC_INTERVAL, writer=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        # Segments are only added by the writer thread, and messages are
+        # only read or indexed while holding the lock.
+        self.lock = threading.Lock()
+        first_ids = sorted(int(name[:-4]) for name in os.listdir(directory)
+                           if name.endswith(".log") and name[:-4].isdigit())
+        self.segments = []
+        for first_id in first_ids:
+            if self.segments:
+                self.segments[-1].close()
+            self.segments.append(Segment(directory, first_id))
+        if not self.segments:
+            self.segments.append(Segment(directory, 1))
+        self.is_closed = False
+        self.first_ids = [segment.first_id for segment in self.segments]
+        self.owns_writer = writer is None
+        self.writer = ChatLogWriter(fsync_interval) if writer is None else writer
+
+    @property
+    def first_id(self):
+        return self.segments[0].first_id
+
+    @property
+    def next_id(self):
+        """The ID after the last message written."""
+        return self.segments[-1].next_id
+
+    def append(self, message_id, frame):
+        """Queue frame to be written as message message_id."""
+        self.writer.append(self, message_id, frame)
+
+    def close(self):
+        """Write and fsync everything queued, then close the files."""
+        self.writer.close_log(self)
+        if self.owns_writer:
+            self.writer.stop()
+        # A page may be being read on another thread.
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+            self.is_closed = True
+
+    def segment_for(self, message_id):
+        segment = self.segments[bisect.bisect_right(self.first_ids, message_id) - 1]
+        segment.open()
+        return segment
+
+    def page(self, before_id=None, count=PAGE_MESSAGES, max_bytes=MAX_BATCH_BYTES):
+        """
+        Return up to count (message ID, frame) pairs from just before
+        before_id, or the newest ones if before_id is None, oldest first,
+        and whether there are older ones still. Works like History.page().
+
+        This reads from disk, so it is best called off the event loop.
+        """
+        with self.lock:
+            if self.is_closed:
+                return [], False
+            try:
+                return self.read_page(before_id, count, max_bytes)
+            finally:
+                # Close whatever older segments the page was read from.
+                for segment in self.segments[:-1]:
+                    segment.close()
+
+    def read_page(self, before_id, count, max_bytes):
+        end = self.next_id if before_id is None else min(before_id, self.next_id)
+        # Sizes come from the index, so only the page itself is read.
+        start = end
+        num_entries = 0
+        num_bytes = 0
+        while start > self.first_id and num_entries < count:
+            segment = self.segment_for(start - 1)
+            if start > segment.next_id:
+                # Messages that were never written leave a gap.
+                start = segment.next_id
+                continue
+            size = segment.message_size(start - 1)
+            if num_bytes + size > max_bytes and num_entries:
+                break
+            num_entries += 1
+            num_bytes += size
+            start -= 1
+        entries = []
+        message_id = start
+        while message_id < end:
+            segment = self.segment_for(message_id)
+            segment_end = min(end, segment.next_id)
+            if message_id < segment_end:
+                frames = segment.read(message_id, segment_end)
+                entries.extend(zip(range(message_id, segment_end), frames))
+            # Move on to the start of the next segment.
+            index = bisect.bisect_right(self.first_ids, message_id)
+            message_id = self.first_ids[index] if index < len(self.first_ids) else end
+        return entries, start > self.first_id
+
+    def write(self, batch):
+        segment = self.segments[-1]
+        frames = []
+        num_bytes = 0
+        for message_id, frame in batch:
+            expected_id = segment.next_id + len(frames)
+            if message_id < expected_id:
+                log.warning("[CHATLOG] Message %d is already written", message_id)
+                continue
+            # A new segment is started when this one is full, or when
+            # messages were lost so that IDs would not follow on.
+            is_full = (segment.size + num_bytes >= self.segment_bytes
+                       or segment.count + len(frames) == INDEX_ENTRIES)
+            if is_full or message_id > expected_id:
+                self.flush(segment, frames)
+                frames = []
+                num_bytes = 0
+                segment = self.rotate(message_id)
+            frames.append(frame)
+            num_bytes += len(frame)
+        self.flush(segment, frames)
+
+    def flush(self, segment, frames):
+        ends = segment.write(frames)
+        # Only make the messages readable once their data is written.
+        with self.lock:
+            segment.add_to_index(ends)
+
+    def rotate(self, first_id):
+        self.segments[-1].sync()
+        segment = Segment(self.directory, first_id)
+        with self.lock:
+            self.segments[-1].close()
+            self.segments.append(segment)
+            self.first_ids.append(first_id)
+        return segment
+
+    def sync(self):
+        self.segments[-1].sync()
@@ -1,4 +1,5 @@
 from tkinter.simpledialog import Dialog
+from utils.strokes import CANVAS_SIZE, actions_to_strokes
 from utils import SMALL_FONT
 from PIL import ImageGrab
 from tkinter import *
@@ -260,7 +261,8 @@ class DrawDialog(Dialog):
         self.wait_window(self)
 
     def body(self, master):
-        self.canvas = Canvas(master, width=700, height=400, bg="white")
+        width, height = CANVAS_SIZE
+        self.canvas = Canvas(master, width=width, height=height, bg="white")
         self.canvas.pack()
         self.canvas.bind("<ButtonPress-1>", self.draw_dot)
         self.canvas.bind("<ButtonPress-1>", self.store_mouse_xy, add="+")
@@ -385,6 +387,8 @@ class DrawDialog(Dialog):
 
     def clear_canvas(self):
         self.canvas.delete("all")
+        self.current_actions.clear()
+        self.all_actions.clear()
         # Disable undo and redo buttons.
         self.undo_btn.config(state=DISABLED)
         self.redo_btn.config(state=DISABLED)
@@ -400,6 +404,12 @@ class DrawDialog(Dialog):
         img = ImageGrab.grab().crop((x1, y1, x2, y2))
         return img
 
+    def get_strokes(self):
+        # winfo_rgb gives 16 bit channels for any colour name Tk knows.
+        def rgb(colour):
+            return bytes(channel >> 8 for channel in self.winfo_rgb(colour))
+        return actions_to_strokes(self.current_actions, rgb)
+
     def buttonbox(self):
         button_frame = Frame(self)
         self.colour_btn = Button(button_frame, bg=self.brush_colour,
@@ -448,8 +458,8 @@ class DrawDialog(Dialog):
 
     def apply(self):
         if self.validate():
-            # Export the created image and the last used settings
-            self.result = (self.grab_image(), {
+            # Export the strokes drawn and the last used settings
+            self.result = (self.get_strokes(), {
                            "brush_size": self.brush_size, "brush_colour": self.brush_colour})
         return True
 
@@ -1,6 +1,3 @@
-from utils.find_nth import find_nth
-
-
 def find_num_lines(string, wrap_length, add_extra=False):
     """
     Return the number of lines a string will require when word wrapped
@@ -12,32 +9,31 @@ def find_num_lines(string, wrap_length, add_extra=False):
     :return: number of lines the string will occupy once wrapped
     :rtype: int
 
-    This function requires find_nth().
+    Takes time in proportion to the length of string.
     """
-    sp_num = 1  # Number of next space (used in find_nth())
     num_lines = 1  # Number of lines
     char_pos = 0  # Index of char in current line
+    last = len(string) - 1
 
-    for x in range(len(string)):
-        char = string[x]
+    for x, char in enumerate(string):
         if char == " ":
-            sp_num += 1
-            next_sp = find_nth(" ", string, sp_num)
+            # Only the next word is searched, so each character is
+            # looked at a fixed number of times.
+            next_sp = string.find(" ", x + 1)
             if next_sp == -1:
-                next_word = string[x + 1:]
-            else:
-                next_word = string[x + 1:next_sp]
+                next_sp = len(string)
+            word_length = next_sp - (x + 1)
             chars_left = (wrap_length - 1) - char_pos
             # If a word fits on one line, but there is not enough
             # space on the current line, start a new line.
             # If a word is too long for a line but add_extra == true,
             # start a new line.
-            if len(next_word) > wrap_length and add_extra or wrap_length >= len(next_word) > chars_left:
+            if word_length > wrap_length and add_extra or wrap_length >= word_length > chars_left:
                 num_lines += 1
                 char_pos = -1
         # If the current line is full and char is not the last
         # character, start a new line.
-        elif char_pos == (wrap_length - 1) and x != len(string) - 1:
+        elif char_pos == (wrap_length - 1) and x != last:
             num_lines += 1
             char_pos = -1
         char_pos += 1
@@ -48,4 +44,4 @@ def find_num_lines(string, wrap_length, add_extra=False):
 if __name__ == '__main__':
     # print(find_num_lines("Abominable Strawberry Government", 10))
     print(find_num_lines(
-        "Guest 1: hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh5 6", 77, True))
+        "Guest 1: hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh5 6", 77, True))
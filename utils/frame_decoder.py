@@ -0,0 +1,84 @@
+from utils.protocol import FRAME_HEADER
+
+BUFFER_SIZE = 4096  # Idle connections only ever hold a buffer this size.
+MIN_READ_SIZE = 1024
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class FrameTooLargeError(Exception):
+    def __init__(self, length, msg="Frame of {} bytes exceeds the maximum frame size."):
+        super().__init__(msg.format(length))
+
+
+class FrameDecoder:
+    """
+    Incrementally decode frames from a socket.
+
+    Data is read with recv_into() straight into a bytearray and payloads
+    are returned as memoryviews of it, so nothing is copied after it comes
+    off the socket. Frames may arrive split across any number of reads.
+
+    The buffer is replaced rather than resized whenever it has to grow or
+    be compacted, so payload views stay valid after later reads.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer_size = buffer_size
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Index of the first unconsumed byte
+        self.end = 0  # Index after the last received byte
+
+    def recv_into(self, sock):
+        """Read whatever is available from sock. Return the number of bytes read."""
+        self.make_room()
+        num_bytes = sock.recv_into(self.view[self.end:])
+        self.end += num_bytes
+        return num_bytes
+
+    def next_frame(self):
+        """Return the next complete frame as (code, payload), or None."""
+        if self.end - self.start < FRAME_HEADER.size:
+            return None
+        code, length = FRAME_HEADER.unpack_from(self.buffer, self.start)
+        if length > self.max_frame_size:
+            raise FrameTooLargeError(length)
+        payload_start = self.start + FRAME_HEADER.size
+        frame_end = payload_start + length
+        if frame_end > self.end:
+            return None
+        self.start = frame_end
+        return code.rstrip(b"\x00"), self.view[payload_start:frame_end]
+
+    def frames(self):
+        """Yield every complete frame that has been received."""
+        frame = self.next_frame()
+        while frame:
+            yield frame
+            frame = self.next_frame()
+
+    def next_frame_size(self):
+        """Return the size of the frame being received, if its header is here."""
+        if self.end - self.start < FRAME_HEADER.size:
+            return FRAME_HEADER.size
+        code, length = FRAME_HEADER.unpack_from(self.buffer, self.start)
+        if length > self.max_frame_size:
+            raise FrameTooLargeError(length)
+        return FRAME_HEADER.size + length
+
+    def make_room(self):
+        pending = self.end - self.start
+        frame_size = self.next_frame_size()
+        has_room_for_frame = len(self.buffer) - self.start >= frame_size
+        if has_room_for_frame and len(self.buffer) - self.end >= MIN_READ_SIZE:
+            return
+        # Shrink back down after a large frame, otherwise grow to fit the
+        # whole of the frame being received.
+        new_size = max(self.buffer_size, frame_size, pending + MIN_READ_SIZE)
+        new_buffer = bytearray(new_size)
+        new_buffer[:pending] = self.view[self.start:self.end]
+        self.buffer = new_buffer
+        self.view = memoryview(new_buffer)
+        self.start = 0
+        self.end = pending
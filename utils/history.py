@@ -0,0 +1,108 @@
+"""
+Recent messages and drawings, kept so that clients who join late can see
+what they missed.
+"""
+from utils.protocol import FRAME_HEADER
+import struct
+
+MAX_HISTORY_MESSAGES = 1000
+MAX_HISTORY_BYTES = 32 * 1024 * 1024
+BACKFILL_MESSAGES = 50  # Sent to each client when it logs in
+PAGE_MESSAGES = 50  # Sent for each request for older history
+# Most bytes of entries in one HISTORY frame, leaving plenty of room
+# under the decoder's frame size limit.
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+# HISTORY payload: [has older entries], then for each entry its message ID
+# followed by the whole MESSAGE or DRAWING frame.
+HISTORY_INFO = struct.Struct("!B")
+MESSAGE_ID = struct.Struct("!Q")
+
+
+class History:
+    """
+    A ring buffer of the most recent broadcast frames, bounded by count and
+    by total bytes, so memory stays flat however long the server runs.
+
+    Every frame is given the next message ID. IDs go up by one with each
+    frame, so the slot holding an ID is found without searching. With
+    max_messages of 0, frames are given IDs but none are kept.
+    """
+
+    def __init__(self, max_messages=MAX_HISTORY_MESSAGES, max_bytes=MAX_HISTORY_BYTES,
+                 next_id=1):
+        self.max_bytes = max_bytes
+        self.slots = [None] * max_messages
+        # IDs carry on from next_id, such as after a restart.
+        self.first_id = next_id  # Oldest ID still held
+        self.next_id = next_id
+        self.num_bytes = 0
+
+    def __len__(self):
+        return self.next_id - self.first_id
+
+    def append(self, frame):
+        """Keep frame, dropping the oldest frames if need be. Return its ID."""
+        if not self.slots:
+            self.next_id += 1
+            self.first_id = self.next_id
+            return self.next_id - 1
+        if len(self) == len(self.slots):
+            self.drop_oldest()
+        message_id = self.next_id
+        self.slots[message_id % len(self.slots)] = frame
+        self.next_id += 1
+        self.num_bytes += len(frame)
+        # The newest frame is always kept, even if it is over the limit alone.
+        while self.num_bytes > self.max_bytes and len(self) > 1:
+            self.drop_oldest()
+        return message_id
+
+    def drop_oldest(self):
+        index = self.first_id % len(self.slots)
+        self.num_bytes -= len(self.slots[index])
+        self.slots[index] = None
+        self.first_id += 1
+
+    def page(self, before_id=None, count=PAGE_MESSAGES, max_bytes=MAX_BATCH_BYTES):
+        """
+        Return up to count (message ID, frame) pairs from just before
+        before_id, or the newest ones if before_id is None, oldest first,
+        and whether there are older ones still.
+        """
+        end = self.next_id if before_id is None else min(before_id, self.next_id)
+        start = end
+        num_bytes = 0
+        while start > self.first_id and end - start < count:
+            frame = self.slots[(start - 1) % len(self.slots)]
+            # Always return at least one entry so paging can move on.
+            if num_bytes + len(frame) > max_bytes and start < end:
+                break
+            num_bytes += len(frame)
+            start -= 1
+        entries = [(message_id, self.slots[message_id % len(self.slots)])
+                   for message_id in range(start, end)]
+        return entries, start > self.first_id
+
+
+def pack_history(entries, has_more):
+    """Return a HISTORY payload as a list of buffers, sharing the frames."""
+    buffers = [HISTORY_INFO.pack(has_more)]
+    for message_id, frame in entries:
+        buffers.append(MESSAGE_ID.pack(message_id))
+        buffers.append(frame)
+    return buffers
+
+
+def unpack_history(payload):
+    """Return a list of (message ID, code, payload) and whether there is more."""
+    has_more, = HISTORY_INFO.unpack_from(payload)
+    entries = []
+    offset = HISTORY_INFO.size
+    while offset < len(payload):
+        message_id, = MESSAGE_ID.unpack_from(payload, offset)
+        offset += MESSAGE_ID.size
+        code, length = FRAME_HEADER.unpack_from(payload, offset)
+        offset += FRAME_HEADER.size
+        entries.append((message_id, code.rstrip(b"\x00"), payload[offset:offset + length]))
+        offset += length
+    return entries, bool(has_more)
@@ -0,0 +1,52 @@
+"""
+Decoded images kept for reuse, up to a total size, with the least recently
+used ones dropped first.
+"""
+from collections import OrderedDict
+
+MAX_IMAGE_BYTES = 64 * 1024 * 1024
+
+
+class ImageCache:
+    """
+    Images keyed by anything hashable, with the number of bytes each takes.
+
+    The most recently used image is always kept, even if it is over the
+    limit alone.
+    """
+
+    def __init__(self, max_bytes=MAX_IMAGE_BYTES):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()  # key -> (image, size)
+        self.num_bytes = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, key):
+        return key in self.images
+
+    def get(self, key):
+        """Return the image for key, or None, and mark it as just used."""
+        if key not in self.images:
+            return None
+        self.images.move_to_end(key)
+        return self.images[key][0]
+
+    def put(self, key, image, size):
+        """Keep image, dropping the least recently used ones if need be."""
+        self.discard(key)
+        self.images[key] = image, size
+        self.num_bytes += size
+        while self.num_bytes > self.max_bytes and len(self.images) > 1:
+            _, (_, dropped_size) = self.images.popitem(last=False)
+            self.num_bytes -= dropped_size
+
+    def discard(self, key):
+        if key in self.images:
+            _, size = self.images.pop(key)
+            self.num_bytes -= size
+
+    def clear(self):
+        self.images.clear()
+        self.num_bytes = 0
@@ -0,0 +1,103 @@
+"""
+Image formats for drawings sent with protocol version 3 and later.
+
+Drawings are mostly white with a handful of brush colours, so they
+compress extremely well. Encoding and decoding to a PIL image needs
+Pillow, but converting any format back to raw RGB for older clients only
+needs the standard library, so the server does not depend on Pillow.
+"""
+import zlib
+
+# Image format ids, sent in the drawing's format descriptor.
+RAW_RGB = 0  # Uncompressed RGB, as sent by protocol versions 1 and 2
+ZLIB_RGB = 1  # zlib-compressed RGB
+ZLIB_PALETTE = 2  # Palette of up to 256 colours, then zlib-compressed indices
+STROKES = 3  # Strokes to draw, see utils.strokes. Protocol version 4 and later.
+IMAGE_FORMATS = (RAW_RGB, ZLIB_RGB, ZLIB_PALETTE, STROKES)
+COMPRESSION_LEVEL = 6
+
+
+class ImageFormatError(ValueError):
+    def __init__(self, msg="Drawing data does not match its format descriptor."):
+        super().__init__(msg)
+
+
+def encode_image(image):
+    """
+    Return the smallest format for a PIL RGB image and its encoded data.
+
+    Images with 256 colours or fewer are sent as a palette plus indices,
+    anything else as compressed RGB.
+    """
+    from PIL import Image
+    raw = image.tobytes()
+    colours = image.getcolors(256)
+    if colours is not None:
+        indexed = image.quantize(colors=len(colours), dither=Image.Dither.NONE)
+        # Only use the palette if quantizing kept every colour exactly.
+        if indexed.convert("RGB").tobytes() == raw:
+            palette = bytes(indexed.getpalette()[:len(colours) * 3])
+            indices = zlib.compress(indexed.tobytes(), COMPRESSION_LEVEL)
+            return ZLIB_PALETTE, bytes([len(colours) - 1]) + palette + indices
+    return ZLIB_RGB, zlib.compress(raw, COMPRESSION_LEVEL)
+
+
+def decode_image(img_format, width, height, img_data):
+    """Return a PIL RGB image from data in any format."""
+    from PIL import Image
+    if img_format == ZLIB_PALETTE:
+        palette, indices = split_palette(img_data)
+        image = Image.frombytes(
+            "P", (width, height), decompress(indices, width * height))
+        image.putpalette(palette)
+        return image.convert("RGB")
+    return Image.frombytes(
+        "RGB", (width, height), to_raw_rgb(img_format, width, height, img_data))
+
+
+def to_raw_rgb(img_format, width, height, img_data):
+    """Convert data in any format to raw RGB without needing Pillow."""
+    num_pixels = width * height
+    if img_format == RAW_RGB:
+        raw = bytes(img_data)
+    elif img_format == ZLIB_RGB:
+        raw = decompress(img_data, num_pixels * 3)
+    elif img_format == ZLIB_PALETTE:
+        palette, indices = split_palette(img_data)
+        indices = decompress(indices, num_pixels)
+        # Look up each channel with a translation table, then interleave.
+        raw = bytearray(num_pixels * 3)
+        for channel in range(3):
+            table = bytes(palette[channel::3]).ljust(256, b"\x00")
+            raw[channel::3] = indices.translate(table)
+        raw = bytes(raw)
+    else:
+        raise ImageFormatError(f"Unknown image format {img_format}.")
+    if len(raw) != num_pixels * 3:
+        raise ImageFormatError()
+    return raw
+
+
+def split_palette(img_data):
+    if not img_data:
+        raise ImageFormatError()
+    num_colours = img_data[0] + 1
+    palette_end = 1 + num_colours * 3
+    if len(img_data) < palette_end:
+        raise ImageFormatError()
+    return bytes(img_data[1:palette_end]), img_data[palette_end:]
+
+
+def decompress(data, max_length, exact=True):
+    """
+    Decompress zlib data, refusing to produce more than max_length bytes.
+    Unless exact is False, the data must decompress to exactly max_length.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        result = decompressor.decompress(data, max_length)
+    except zlib.error:
+        raise ImageFormatError()
+    if decompressor.unconsumed_tail or (exact and len(result) != max_length):
+        raise ImageFormatError()
+    return result
@@ -0,0 +1,107 @@
+"""
+Logging for the server and client.
+
+Records are handed to a queue and written out by a background thread, so
+a slow terminal never holds up the event loop. Per-frame logs go through
+a SampledLog, which costs one attribute check when its level is disabled
+and only keeps one in every N records otherwise.
+"""
+from logging.handlers import QueueHandler, QueueListener
+import logging
+import queue
+import sys
+
+ROOT_LOGGER = "pictochat"
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+MAX_PAYLOAD = 64  # Bytes of a payload shown in a frame log
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+# Every SampledLog, so setup_logging() can reconfigure them.
+sampled_logs = []
+listener = None
+
+
+def get_logger(category):
+    return logging.getLogger(f"{ROOT_LOGGER}.{category}")
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+
+class SampledLog:
+    """
+    Log for events that happen too often to log every time, like frames.
+
+    Check enabled before calling log(), so that nothing is built when the
+    log is off:
+
+        if FRAME_LOG.enabled:
+            FRAME_LOG.log("SENT", code, payload)
+    """
+
+    def __init__(self, category, level=logging.DEBUG):
+        self.category = category
+        self.logger = get_logger(category)
+        self.level = level
+        self.every = 1  # Keep one in every this many records
+        self.count = 0
+        self.max_payload = MAX_PAYLOAD
+        self.enabled = False
+        sampled_logs.append(self)
+
+    def configure(self, every=1, max_payload=MAX_PAYLOAD):
+        self.every = max(1, every)
+        self.max_payload = max_payload
+        self.enabled = self.logger.isEnabledFor(self.level)
+
+    def log(self, direction, code, payload):
+        self.count += 1
+        if self.count % self.every:
+            return
+        # Copy the shown part of the payload now, since the listener thread
+        # formats the record later.
+        shown = bytes(payload[:self.max_payload])
+        self.logger.log(
+            self.level, "[%s] Code: %s, Length: %d, Message: %r%s", direction,
+            code, len(payload), shown, "..." if len(payload) > len(shown) else "")
+
+
+def setup_logging(level="INFO", sample_rates=None, max_payload=MAX_PAYLOAD,
+                  stream=None):
+    """
+    Send every log through a background thread to stream (stdout by
+    default). sample_rates maps SampledLog categories to N, so that only
+    one in N of their records is kept.
+    """
+    global listener
+    stop_logging()
+    sample_rates = sample_rates or {}
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = [DeferredQueueHandler(log_queue)]
+    root.setLevel(level)
+    root.propagate = False
+    listener = QueueListener(log_queue, output)
+    listener.start()
+    for sampled_log in sampled_logs:
+        sampled_log.configure(sample_rates.get(sampled_log.category, 1), max_payload)
+
+
+def stop_logging():
+    """Write out any queued records and stop the background thread."""
+    global listener
+    if listener:
+        listener.stop()
+        listener = None
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = []
+    root.setLevel(logging.NOTSET)
+    root.propagate = True
+    for sampled_log in sampled_logs:
+        sampled_log.enabled = False
@@ -0,0 +1,115 @@
+"""
+Counters, gauges and histograms kept by the server, readable as JSON or as
+Prometheus text.
+
+Everything is updated from the event loop thread, so nothing is locked.
+"""
+from bisect import bisect_left
+
+PREFIX = "pictochat_"
+# Histogram bucket upper bounds.
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** n for n in range(8))  # 1 KB to 16 MB
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last count is above every bucket
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class Metrics:
+    """
+    Named metrics, each optionally split by one label.
+
+    Counters only go up. Gauges are read from callables when a snapshot is
+    taken, so values like queue depths are never out of date. A labelled
+    gauge's callable returns a dict of label value to number.
+    """
+
+    def __init__(self):
+        self.counters = {}  # name -> {label value: count}
+        self.histograms = {}  # name -> Histogram
+        self.gauges = {}  # name -> callable returning a number, or a dict
+        self.labels = {}  # name -> label name
+        self.help = {}
+
+    def counter(self, name, help_text, label=None):
+        self.counters[name] = {}
+        self.labels[name] = label
+        self.help[name] = help_text
+
+    def histogram(self, name, help_text, buckets):
+        self.histograms[name] = Histogram(buckets)
+        self.help[name] = help_text
+
+    def gauge(self, name, help_text, read, label=None):
+        self.gauges[name] = read
+        self.labels[name] = label
+        self.help[name] = help_text
+
+    def inc(self, name, amount=1, label_value=""):
+        counter = self.counters[name]
+        counter[label_value] = counter.get(label_value, 0) + amount
+
+    def observe(self, name, value):
+        self.histograms[name].observe(value)
+
+    def snapshot(self):
+        """Return every metric as plain data, ready for json.dumps()."""
+        snapshot = {}
+        for name, counter in self.counters.items():
+            snapshot[name] = dict(counter) if self.labels[name] else counter.get("", 0)
+        for name, read in self.gauges.items():
+            value = read()
+            snapshot[name] = {str(k): v for k, v in value.items()} if self.labels[name] else value
+        for name, histogram in self.histograms.items():
+            snapshot[name] = histogram.snapshot()
+        return snapshot
+
+    def prometheus(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, counter in self.counters.items():
+            lines += header(name, self.help[name], "counter")
+            label = self.labels[name]
+            for label_value, count in sorted(counter.items()):
+                labels = f'{{{label}="{label_value}"}}' if label else ""
+                lines.append(f"{PREFIX}{name}{labels} {count}")
+            if not counter and not label:
+                lines.append(f"{PREFIX}{name} 0")
+        for name, read in self.gauges.items():
+            lines += header(name, self.help[name], "gauge")
+            label = self.labels[name]
+            if not label:
+                lines.append(f"{PREFIX}{name} {read()}")
+                continue
+            for label_value, value in sorted(read().items()):
+                lines.append(f'{PREFIX}{name}{{{label}="{label_value}"}} {value}')
+        for name, histogram in self.histograms.items():
+            lines += header(name, self.help[name], "histogram")
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f'{PREFIX}{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"{PREFIX}{name}_sum {snapshot['sum']}")
+            lines.append(f"{PREFIX}{name}_count {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def header(name, help_text, metric_type):
+    return [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} {metric_type}"]
@@ -0,0 +1,94 @@
+from collections import deque
+
+# What to do when a client's outbound queue is full.
+DROP_OLDEST_DRAWINGS = "drop_oldest_drawings"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST_DRAWINGS, COALESCE, DISCONNECT)
+
+
+class OutboundQueue:
+    """
+    Frames waiting to be written to one client, bounded by bytes and frames.
+
+    Each frame is a sequence of buffers, which may be shared with other
+    clients' queues. Frames are pushed whole and written out in order;
+    droppable frames (drawings) that have not started to be written can
+    be dropped to make room.
+    """
+
+    def __init__(self, max_bytes, max_frames):
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.frames = deque()  # (buffers, num_bytes, is_droppable)
+        self.num_bytes = 0
+        self.sent = 0  # Bytes of the first frame already written
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def pending_bytes(self):
+        return self.num_bytes - self.sent
+
+    def push(self, buffers, droppable=False):
+        num_bytes = sum(len(buffer) for buffer in buffers)
+        self.frames.append((buffers, num_bytes, droppable))
+        self.num_bytes += num_bytes
+
+    def is_full(self):
+        return self.num_bytes > self.max_bytes or len(self.frames) > self.max_frames
+
+    def drop_droppable(self, drop_all=False):
+        """
+        Drop droppable frames, oldest first, until the queue is no longer
+        full, or drop every one of them if drop_all is set. Return the
+        number of frames dropped.
+        """
+        kept = deque()
+        num_frames = len(self.frames)
+        for index, frame in enumerate(self.frames):
+            buffers, num_bytes, droppable = frame
+            # The first frame may already be partly written.
+            is_started = index == 0 and self.sent
+            is_full = self.num_bytes > self.max_bytes or num_frames > self.max_frames
+            if droppable and not is_started and (drop_all or is_full):
+                self.num_bytes -= num_bytes
+                num_frames -= 1
+            else:
+                kept.append(frame)
+        dropped = len(self.frames) - len(kept)
+        self.frames = kept
+        return dropped
+
+    def peek_buffers(self, limit):
+        """Return up to limit unwritten buffers, in order."""
+        buffers = []
+        skip = self.sent
+        for frame_buffers, num_bytes, droppable in self.frames:
+            for buffer in frame_buffers:
+                if skip >= len(buffer):
+                    skip -= len(buffer)
+                    continue
+                if skip:
+                    buffer = memoryview(buffer)[skip:]
+                    skip = 0
+                buffers.append(buffer)
+                if len(buffers) == limit:
+                    return buffers
+        return buffers
+
+    def unfinished_frame(self):
+        """Return the unwritten part of a partly written frame, if any."""
+        if not self.sent:
+            return b""
+        buffers, num_bytes, droppable = self.frames[0]
+        return b"".join(buffers)[self.sent:]
+
+    def consume(self, num_bytes):
+        """Mark num_bytes as written, removing frames that are finished."""
+        self.sent += num_bytes
+        while self.frames and self.sent >= self.frames[0][1]:
+            buffers, frame_bytes, droppable = self.frames.popleft()
+            self.sent -= frame_bytes
+            self.num_bytes -= frame_bytes
@@ -0,0 +1,118 @@
+"""
+Indexes of the usernames and colours in use, so that the server can hand
+out new ones and check requested ones without scanning every user.
+"""
+import heapq
+import random
+
+GUEST_PREFIX = "Guest "
+
+
+class UsernamePool:
+    """
+    Taken usernames, plus the Guest numbers free to give to new clients.
+
+    Guest numbers below next_number that have been given up wait in a
+    heap, so the lowest free number is always the one handed out. Pools
+    that share usernames across processes each hand out every step'th
+    number, starting from first_number, so they never pick the same one.
+    """
+
+    def __init__(self, first_number=1, step=1):
+        self.taken = set()
+        self.free_numbers = []  # Heap of Guest numbers below next_number
+        self.first_number = first_number
+        self.step = step
+        self.next_number = first_number
+
+    def __contains__(self, username):
+        return username in self.taken
+
+    def take_guest_name(self):
+        """Reserve and return the lowest free "Guest N" username."""
+        while True:
+            if self.free_numbers:
+                number = heapq.heappop(self.free_numbers)
+            else:
+                number = self.next_number
+                self.next_number += self.step
+            username = f"{GUEST_PREFIX}{number}"
+            # Someone may have renamed themselves to this Guest name.
+            if username not in self.taken:
+                self.taken.add(username)
+                return username
+
+    def take(self, username):
+        self.taken.add(username)
+
+    def release(self, username):
+        self.taken.discard(username)
+        number = guest_number(username)
+        # Only numbers this pool hands out go back on its heap.
+        if (number is not None and self.first_number <= number < self.next_number
+                and (number - self.first_number) % self.step == 0):
+            heapq.heappush(self.free_numbers, number)
+
+
+def guest_number(username):
+    """Return N if username is "Guest N", otherwise None."""
+    if not username.startswith(GUEST_PREFIX):
+        return None
+    number = username[len(GUEST_PREFIX):]
+    if not number.isdigit() or number.startswith("0"):
+        return None
+    return int(number)
+
+
+class ColourPool:
+    """
+    How many clients use each colour, and the palette colours nobody uses.
+
+    Free colours are kept in a list with an index of their positions, so a
+    random one can be picked and any one removed in constant time.
+    """
+
+    def __init__(self, colours):
+        self.colours = list(colours)
+        self.palette = set(colours)
+        self.free = list(colours)
+        self.positions = {colour: index for index, colour in enumerate(self.free)}
+        self.counts = {}  # Colour -> number of clients using it
+
+    def take_random(self):
+        """Reserve and return a random free colour, or any colour if none are free."""
+        colour = random.choice(self.free or self.colours)
+        self.take(colour)
+        return colour
+
+    def take(self, colour):
+        self.counts[colour] = self.counts.get(colour, 0) + 1
+        if colour in self.positions:
+            # Move the last free colour into this one's place.
+            index = self.positions.pop(colour)
+            last = self.free.pop()
+            if last != colour:
+                self.free[index] = last
+                self.positions[last] = index
+
+    def release(self, colour):
+        count = self.counts.get(colour, 0) - 1
+        if count > 0:
+            self.counts[colour] = count
+            return
+        self.counts.pop(colour, None)
+        if colour in self.palette and colour not in self.positions:
+            self.positions[colour] = len(self.free)
+            self.free.append(colour)
+
+    def is_taken(self, colour, own_colour=None):
+        """Return whether colour is used, not counting one use of own_colour."""
+        count = self.counts.get(colour, 0)
+        if colour == own_colour:
+            count -= 1
+        return count > 0
+
+    def taken_colours(self, own_colour=None):
+        """Return every colour in use, leaving out one use of own_colour."""
+        return [colour for colour in self.counts
+                if self.is_taken(colour, own_colour)]
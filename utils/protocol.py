@@ -0,0 +1,114 @@
+from utils.image_codec import RAW_RGB
+import struct
+
+FORMAT = "utf-8"
+# Highest protocol version this code speaks. Clients announce theirs with a
+# HELLO frame after connecting; clients that never do are treated as v1.
+# Version 5 adds history, in HISTORY and HISTREQ frames.
+PROTOCOL_VERSION = 5
+# Binary frame header: 8 byte opcode followed by the payload length.
+FRAME_HEADER = struct.Struct("8sI")
+# Version 2 drawing metadata: image width and height.
+DRAWING_SIZE = struct.Struct("!HH")
+# Version 3 drawing metadata: image format, width and height. Version 4
+# adds the STROKES image format but keeps the same layout.
+DRAWING_INFO = struct.Struct("!BHH")
+VERSION = struct.Struct("!B")
+COLOUR_LENGTH = 7  # Colours are always of the form #000000
+
+
+def pack_frame(code, payload=b""):
+    """Return a whole frame as one buffer so it can be sent in one call."""
+    return FRAME_HEADER.pack(code, len(payload)) + payload
+
+
+def send_frame(sock, code, payload=b""):
+    """
+    Send a frame on a blocking socket with as few syscalls as possible.
+
+    Where the platform has sendmsg() the header and payload are gathered
+    by the kernel, so large payloads are not copied to prepend the header.
+    """
+    header = FRAME_HEADER.pack(code, len(payload))
+    if not hasattr(sock, "sendmsg"):  # Windows
+        sock.sendall(header + payload)
+        return
+    sent = sock.sendmsg([header, payload])
+    # Finish off a partial send.
+    if sent < len(header):
+        sock.sendall(header[sent:])
+        sent = len(header)
+    if sent < len(header) + len(payload):
+        sock.sendall(memoryview(payload)[sent - len(header):])
+
+
+def recv_exactly(sock, num_bytes):
+    received = bytearray()
+    while len(received) < num_bytes:
+        chunk = sock.recv(num_bytes - len(received))
+        if not chunk:
+            raise ConnectionResetError("connection closed mid-frame")
+        received += chunk
+    return bytes(received)
+
+
+def recv_frame(sock):
+    """Block until a whole frame arrives and return its code and payload."""
+    code, length = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    return code.rstrip(b"\x00"), recv_exactly(sock, length)
+
+
+def pack_sender(username, colour, version):
+    """Encode the sender fields that prefix MESSAGE and DRAWING payloads."""
+    if version >= 2:
+        # [username length][username][colour]
+        username = username.encode(FORMAT)
+        return VERSION.pack(len(username)) + username + colour.encode(FORMAT)
+    # [username][colour]
+    return (username + colour).encode(FORMAT)
+
+
+def unpack_sender(payload, version):
+    """
+    Return the sender's username, colour and the rest of the payload.
+
+    payload may be bytes or a memoryview; the rest is the same type.
+    """
+    if version >= 2:
+        username_end = 1 + payload[0]
+        colour_end = username_end + COLOUR_LENGTH
+        username = str(payload[1:username_end], FORMAT)
+        colour = str(payload[username_end:colour_end], FORMAT)
+        return username, colour, payload[colour_end:]
+    # Version 1 usernames are terminated by the # that starts the colour.
+    colour_start = bytes(payload).find(b"#")
+    colour_end = colour_start + COLOUR_LENGTH
+    username = str(payload[:colour_start], FORMAT)
+    colour = str(payload[colour_start:colour_end], FORMAT)
+    return username, colour, payload[colour_end:]
+
+
+def pack_drawing_info(img_format, width, height, version):
+    """
+    Encode a drawing's format descriptor. Versions before 3 have no
+    format field and can only be sent raw RGB.
+    """
+    if version >= 3:
+        return DRAWING_INFO.pack(img_format, width, height)
+    if version >= 2:
+        return DRAWING_SIZE.pack(width, height)
+    # [width]x[height]:
+    return f"{width}x{height}:".encode(FORMAT)
+
+
+def unpack_drawing_info(payload, version):
+    """Return the format, width and height of a drawing and its image data."""
+    if version >= 3:
+        img_format, width, height = DRAWING_INFO.unpack_from(payload)
+        return img_format, width, height, payload[DRAWING_INFO.size:]
+    if version >= 2:
+        width, height = DRAWING_SIZE.unpack_from(payload)
+        return RAW_RGB, width, height, payload[DRAWING_SIZE.size:]
+    size_end = bytes(payload[:32]).index(b":")
+    width, height = str(payload[:size_end], FORMAT).split("x")
+    return RAW_RGB, int(width), int(height), payload[size_end + 1:]
@@ -0,0 +1,80 @@
+"""
+Connected clients, indexed by the file descriptor of their socket.
+"""
+
+
+class User:
+    """
+    One client connection and everything the server knows about it.
+
+    Slots keep each record small and fixed in size, since the server holds
+    one for every connection.
+    """
+
+    __slots__ = (
+        "connection", "address", "fd", "username", "colour", "is_logged_in",
+        "is_slow", "is_checking_password", "protocol_version", "decoder",
+        "outbound", "reader", "room",
+    )
+
+    def __init__(self, connection, address, fd, username, colour,
+                 decoder=None, outbound=None, reader=None):
+        self.connection = connection
+        self.address = address
+        self.fd = fd
+        self.username = username
+        self.colour = colour
+        self.is_logged_in = False
+        self.is_slow = False
+        self.is_checking_password = False
+        # Until the client says HELLO it is assumed to speak version 1.
+        self.protocol_version = 1
+        # Selector backend: incoming frames and frames waiting to be sent.
+        self.decoder = decoder
+        self.outbound = outbound
+        # asyncio backend: the connection's StreamReader.
+        self.reader = reader
+        self.room = None  # The Room the user is in
+
+    def __repr__(self):
+        return f"<User {self.fd} {self.username!r} {self.address}>"
+
+
+class UserRegistry:
+    """
+    Every connected user keyed by fd, plus the logged in users in the order
+    they logged in. Adding, removing and membership checks are O(1), and
+    broadcasts only visit users who are logged in.
+    """
+
+    def __init__(self):
+        self.by_fd = {}
+        self.logged_in = {}  # fd -> User, for users who have logged in
+
+    def __len__(self):
+        return len(self.by_fd)
+
+    def __iter__(self):
+        return iter(list(self.by_fd.values()))
+
+    def __contains__(self, user):
+        return self.by_fd.get(user.fd) is user
+
+    def get(self, fd):
+        return self.by_fd.get(fd)
+
+    def add(self, user):
+        self.by_fd[user.fd] = user
+
+    def log_in(self, user):
+        user.is_logged_in = True
+        self.logged_in[user.fd] = user
+
+    def remove(self, user):
+        if self.by_fd.get(user.fd) is user:
+            del self.by_fd[user.fd]
+            self.logged_in.pop(user.fd, None)
+
+    def clear(self):
+        self.by_fd.clear()
+        self.logged_in.clear()
@@ -0,0 +1,306 @@
+"""
+Links the worker processes of a multi-process server.
+
+Each worker keeps a connection to a broker on a Unix domain socket, and
+the broker passes every frame a worker sends on to all the other workers.
+Workers send the messages and drawings they broadcast, so that every
+worker can show them to its own clients, and every username and colour
+they take or release, so that every worker's pools hold the usernames and
+colours in use on all of them.
+"""
+from utils.protocol import FORMAT, FRAME_HEADER, pack_sender, unpack_sender
+from utils.frame_decoder import FrameDecoder
+from utils.outbound_queue import OutboundQueue
+from utils.pools import UsernamePool, ColourPool
+from utils.log import get_logger
+from collections import Counter
+import selectors
+import socket
+
+# Relay opcodes, only ever sent between workers and the broker.
+RELAY_MESSAGE = b"RMESSAGE"
+RELAY_DRAWING = b"RDRAWING"
+TAKE_USERNAME = b"RTAKEUN"
+RELEASE_USERNAME = b"RFREEUN"
+TAKE_COLOUR = b"RTAKECOL"
+RELEASE_COLOUR = b"RFREECOL"
+# A link this far behind belongs to a worker that has stopped reading.
+MAX_LINK_BYTES = 256 * 1024 * 1024
+MAX_LINK_FRAMES = 1 << 20
+WRITE_BATCH = 256
+
+log = get_logger("relay")
+
+
+def pack_relayed(room_name, username, colour):
+    """Encode the room and sender that prefix relayed messages and drawings."""
+    room_name = room_name.encode(FORMAT)
+    return bytes([len(room_name)]) + room_name + pack_sender(username, colour, 2)
+
+
+def unpack_relayed(payload):
+    """Return the room name, sender's username and colour, and the rest of payload."""
+    room_end = 1 + payload[0]
+    room_name = str(payload[1:room_end], FORMAT)
+    username, colour, rest = unpack_sender(payload[room_end:], 2)
+    return room_name, username, colour, rest
+
+
+class Link:
+    """One end of a relay connection, and the frames waiting to go out on it."""
+
+    def __init__(self, sock):
+        sock.setblocking(False)
+        self.sock = sock
+        self.decoder = FrameDecoder()
+        self.outbound = OutboundQueue(MAX_LINK_BYTES, MAX_LINK_FRAMES)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def push(self, code, *buffers):
+        length = sum(len(buffer) for buffer in buffers)
+        self.outbound.push((FRAME_HEADER.pack(code, length),) + buffers)
+
+    def flush(self):
+        """Write as much as the socket takes. Return whether any is left."""
+        while self.outbound:
+            try:
+                sent = self.sock.sendmsg(self.outbound.peek_buffers(WRITE_BATCH))
+            except BlockingIOError:
+                break
+            self.outbound.consume(sent)
+        if self.outbound.is_full():
+            raise ConnectionError("relay link fell too far behind")
+        return bool(self.outbound)
+
+    def read(self):
+        """Return the frames received, or raise ConnectionError once closed."""
+        try:
+            received = self.decoder.recv_into(self.sock)
+        except BlockingIOError:
+            return []
+        if not received:
+            raise ConnectionError("relay link closed")
+        return list(self.decoder.frames())
+
+    def close(self):
+        self.sock.close()
+
+
+class RelayBroker:
+    """
+    Passes frames from each worker to every other worker.
+
+    The broker also counts the usernames and colours each worker holds, so
+    that a worker that connects later is told what is already taken, and
+    what a worker held is released if it goes away.
+    """
+
+    def __init__(self, path):
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        # shutdown() writes to this socket pair to wake the blocked select().
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        self.held = {}  # Link -> (Counter of usernames, Counter of colours)
+        self.is_running = True
+
+    def serve_forever(self):
+        while self.is_running:
+            for key, mask in self.selector.select():
+                if key.fileobj is self.listener:
+                    self.accept()
+                    continue
+                if key.fileobj is self.wake_reader:
+                    continue
+                link = key.data
+                try:
+                    if mask & selectors.EVENT_READ:
+                        self.relay(link, link.read())
+                    if link in self.held:
+                        self.flush(link)
+                except OSError:
+                    self.drop(link)
+
+    def accept(self):
+        sock, address = self.listener.accept()
+        link = Link(sock)
+        self.selector.register(link, selectors.EVENT_READ, data=link)
+        # Tell the new worker what the others already hold.
+        for usernames, colours in self.held.values():
+            for username in usernames:
+                link.push(TAKE_USERNAME, username)
+            for colour, count in colours.items():
+                for _ in range(count):
+                    link.push(TAKE_COLOUR, colour)
+        self.held[link] = (Counter(), Counter())
+        self.flush(link)
+
+    def relay(self, link, frames):
+        usernames, colours = self.held[link]
+        for code, payload in frames:
+            payload = bytes(payload)
+            if code == TAKE_USERNAME:
+                usernames[payload] += 1
+            elif code == RELEASE_USERNAME:
+                usernames[payload] -= 1
+                if usernames[payload] <= 0:
+                    del usernames[payload]
+            elif code == TAKE_COLOUR:
+                colours[payload] += 1
+            elif code == RELEASE_COLOUR:
+                colours[payload] -= 1
+                if colours[payload] <= 0:
+                    del colours[payload]
+            for other in list(self.held):
+                if other is not link:
+                    other.push(code, payload)
+        for other in list(self.held):
+            if other is not link:
+                try:
+                    self.flush(other)
+                except OSError:
+                    self.drop(other)
+
+    def flush(self, link):
+        events = selectors.EVENT_READ
+        if link.flush():
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(link, events, data=link)
+
+    def drop(self, link):
+        if link not in self.held:
+            return
+        log.warning("[RELAY] Lost a worker")
+        usernames, colours = self.held.pop(link)
+        self.selector.unregister(link)
+        link.close()
+        # Free whatever the worker held for everyone else.
+        frames = [(RELEASE_USERNAME, username) for username in usernames.elements()]
+        frames += [(RELEASE_COLOUR, colour) for colour in colours.elements()]
+        for other in list(self.held):
+            for code, payload in frames:
+                other.push(code, payload)
+            try:
+                self.flush(other)
+            except OSError:
+                self.drop(other)
+
+    def shutdown(self):
+        self.is_running = False
+        self.wake_writer.send(b"\x00")
+
+    def close(self):
+        for link in list(self.held):
+            link.close()
+        self.selector.close()
+        self.listener.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+
+
+class RelayClient:
+    """A worker's link to the broker."""
+
+    def __init__(self, path, worker_index=0, num_workers=1):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        self.link = Link(sock)
+        self.worker_index = worker_index
+        self.num_workers = num_workers
+        self.selector = None
+        self.is_writing = False
+
+    def create_pools(self, colours):
+        # Each worker hands out its own share of the Guest numbers.
+        return (RelayedUsernamePool(self, self.worker_index + 1, self.num_workers),
+                RelayedColourPool(self, colours))
+
+    def attach(self, selector):
+        self.selector = selector
+        selector.register(self.link, selectors.EVENT_READ, data=self)
+        self.flush()
+
+    def send(self, code, *buffers):
+        self.link.push(code, *buffers)
+        if self.selector:
+            self.flush()
+
+    def flush(self):
+        # Only wait for write readiness while there is something to write.
+        is_writing = self.link.flush()
+        if is_writing != self.is_writing:
+            events = selectors.EVENT_READ
+            if is_writing:
+                events |= selectors.EVENT_WRITE
+            self.selector.modify(self.link, events, data=self)
+            self.is_writing = is_writing
+
+    def service(self, mask):
+        """Return the frames received. Raises ConnectionError if the broker is gone."""
+        frames = []
+        if mask & selectors.EVENT_READ:
+            frames = self.link.read()
+        if mask & selectors.EVENT_WRITE:
+            self.flush()
+        return frames
+
+    @staticmethod
+    def apply(code, payload, usernames, colours):
+        """Apply another worker's change to this worker's pools, without relaying it."""
+        value = str(payload, FORMAT)
+        if code == TAKE_USERNAME:
+            UsernamePool.take(usernames, value)
+        elif code == RELEASE_USERNAME:
+            UsernamePool.release(usernames, value)
+        elif code == TAKE_COLOUR:
+            ColourPool.take(colours, value)
+        elif code == RELEASE_COLOUR:
+            ColourPool.release(colours, value)
+
+    def close(self):
+        if self.selector:
+            self.selector.unregister(self.link)
+        self.link.close()
+
+
+class RelayedUsernamePool(UsernamePool):
+    """A UsernamePool that tells the other workers what it takes and releases."""
+
+    def __init__(self, relay, first_number=1, step=1):
+        super().__init__(first_number, step)
+        self.relay = relay
+
+    def take_guest_name(self):
+        username = super().take_guest_name()
+        self.relay.send(TAKE_USERNAME, username.encode(FORMAT))
+        return username
+
+    def take(self, username):
+        super().take(username)
+        self.relay.send(TAKE_USERNAME, username.encode(FORMAT))
+
+    def release(self, username):
+        super().release(username)
+        self.relay.send(RELEASE_USERNAME, username.encode(FORMAT))
+
+
+class RelayedColourPool(ColourPool):
+    """A ColourPool that tells the other workers what it takes and releases."""
+
+    def __init__(self, relay, colours):
+        super().__init__(colours)
+        self.relay = relay
+
+    def take(self, colour):
+        super().take(colour)
+        self.relay.send(TAKE_COLOUR, colour.encode(FORMAT))
+
+    def release(self, colour):
+        super().release(colour)
+        self.relay.send(RELEASE_COLOUR, colour.encode(FORMAT))
@@ -0,0 +1,48 @@
+"""
+Chat rooms. Each logged in user is in one room at a time, and messages
+and drawings only go to the users in the sender's room.
+"""
+import re
+
+DEFAULT_ROOM = "lobby"
+ROOM_NAME = re.compile(r"[A-Za-z0-9_-]{1,32}")
+
+
+def is_room_name(name):
+    # Room names double as directory names for the room's chat log.
+    return ROOM_NAME.fullmatch(name) is not None
+
+
+class Room:
+    """
+    The logged in users in one room, keyed by fd, and the room's history.
+
+    usernames and colours may be the server's pools, shared by every room,
+    or this room's own, so that names and colours only clash within it.
+    """
+
+    def __init__(self, name, history, usernames, colours, chat_log=None):
+        self.name = name
+        self.members = {}  # fd -> User
+        self.history = history
+        self.chat_log = chat_log
+        # While the chat log is being opened, the messages broadcast
+        # meanwhile and the history requests waiting for it.
+        self.unlogged = None
+        self.history_waiting = None
+        self.usernames = usernames
+        self.colours = colours
+
+    def __len__(self):
+        return len(self.members)
+
+    def __repr__(self):
+        return f"<Room {self.name!r} {len(self)} members>"
+
+    def add(self, user):
+        self.members[user.fd] = user
+        user.room = self
+
+    def remove(self, user):
+        if self.members.get(user.fd) is user:
+            del self.members[user.fd]
@@ -0,0 +1,50 @@
+"""
+Signed session tokens, so a client that reconnects can log straight back
+in as the same user without its password being checked again.
+
+A token holds the username and colour it was issued for and when it
+expires, signed with HMAC-SHA256. The server keeps no per-session state;
+anyone with the secret can verify a token.
+"""
+from utils.protocol import FORMAT, COLOUR_LENGTH
+import hashlib
+import struct
+import hmac
+import time
+import os
+
+SESSION_LIFETIME = 10 * 60  # Seconds a token can be used for
+SECRET_LENGTH = 32
+# [expiry time][colour], then the username, then the signature.
+TOKEN_HEADER = struct.Struct(f"!Q{COLOUR_LENGTH}s")
+SIGNATURE_LENGTH = hashlib.sha256().digest_size
+
+
+class SessionTokens:
+
+    def __init__(self, secret=None, lifetime=SESSION_LIFETIME, clock=time.time):
+        self.secret = secret or os.urandom(SECRET_LENGTH)
+        self.lifetime = lifetime
+        self.clock = clock
+
+    def sign(self, data):
+        return hmac.new(self.secret, data, hashlib.sha256).digest()
+
+    def issue(self, username, colour):
+        """Return a token for username and colour."""
+        expiry = int(self.clock() + self.lifetime)
+        data = TOKEN_HEADER.pack(expiry, colour.encode(FORMAT)) + username.encode(FORMAT)
+        return data + self.sign(data)
+
+    def verify(self, token):
+        """Return the username and colour of a valid token, or None."""
+        token = bytes(token)
+        if len(token) < TOKEN_HEADER.size + SIGNATURE_LENGTH:
+            return None
+        data, signature = token[:-SIGNATURE_LENGTH], token[-SIGNATURE_LENGTH:]
+        if not hmac.compare_digest(signature, self.sign(data)):
+            return None
+        expiry, colour = TOKEN_HEADER.unpack_from(data)
+        if expiry < self.clock():
+            return None
+        return str(data[TOKEN_HEADER.size:], FORMAT), str(colour, FORMAT)
@@ -0,0 +1,123 @@
+"""
+Drawings sent as the strokes that made them, for protocol version 4 and later.
+
+DrawDialog records every line and dot drawn on its canvas. Sending those
+instead of a screenshot of the canvas takes a few KB for a typical sketch,
+and each recipient rasterizes them at whatever size it displays drawings.
+Packing and unpacking strokes only needs the standard library; rasterizing
+needs Pillow.
+"""
+from utils.image_codec import ImageFormatError, decompress, COMPRESSION_LEVEL
+from collections import namedtuple
+import struct
+import zlib
+
+CANVAS_SIZE = (700, 400)  # Size of the DrawDialog canvas strokes are drawn on
+MAX_STROKES_SIZE = 1024 * 1024  # Largest stroke list accepted, uncompressed
+# Stroke kinds.
+LINE = 0  # Polyline through all of the stroke's points
+OVAL = 1  # Filled oval inside the box given by two points
+# [kind][red][green][blue][width][number of points], then the points.
+STROKE_HEADER = struct.Struct("!B3sHH")
+# Points are stored in half pixels, since dots are centred on the cursor.
+# Each is relative to the one before so that zlib sees the same few small
+# numbers over and over.
+POINT = struct.Struct("!hh")
+
+Stroke = namedtuple("Stroke", ["kind", "colour", "width", "points"])
+
+
+def check_drawing_size(width, height):
+    """
+    Raise ImageFormatError unless a drawing fits on the DrawDialog canvas.
+
+    Drawings are decoded or rasterized at their declared size, so a few
+    bytes claiming a huge one would otherwise cost gigabytes.
+    """
+    if not (0 < width <= CANVAS_SIZE[0] and 0 < height <= CANVAS_SIZE[1]):
+        raise ImageFormatError(f"Drawing of {width}x{height} is too large.")
+
+
+def actions_to_strokes(actions, rgb):
+    """
+    Convert DrawDialog's actions to strokes. Lines that carry on from the
+    previous line in the same colour and width are joined into one stroke.
+
+    rgb is called with each fill colour and returns it as three bytes.
+    """
+    strokes = []
+    for action in actions:
+        for shape in action:
+            x1, y1, x2, y2 = shape["coords"]
+            colour = rgb(shape["fill"])
+            if shape["type"] == "oval":
+                strokes.append(Stroke(OVAL, colour, 0, [(x1, y1), (x2, y2)]))
+                continue
+            last = strokes[-1] if strokes else None
+            if last and last.kind == LINE and last.colour == colour and \
+                    last.width == shape["width"] and last.points[-1] == (x1, y1):
+                last.points.append((x2, y2))
+            else:
+                strokes.append(Stroke(LINE, colour, shape["width"], [(x1, y1), (x2, y2)]))
+    return strokes
+
+
+def pack_strokes(strokes):
+    """Return strokes as compressed image data."""
+    packed = bytearray()
+    for kind, colour, width, points in strokes:
+        packed += STROKE_HEADER.pack(kind, colour, width, len(points))
+        last_x = last_y = 0
+        for x, y in points:
+            x, y = round(x * 2), round(y * 2)
+            packed += POINT.pack(x - last_x, y - last_y)
+            last_x, last_y = x, y
+    return zlib.compress(packed, COMPRESSION_LEVEL)
+
+
+def unpack_strokes(img_data):
+    """Return the strokes in compressed image data."""
+    packed = decompress(img_data, MAX_STROKES_SIZE, exact=False)
+    strokes = []
+    offset = 0
+    try:
+        while offset < len(packed):
+            kind, colour, width, num_points = STROKE_HEADER.unpack_from(packed, offset)
+            offset += STROKE_HEADER.size
+            points = []
+            x = y = 0
+            for dx, dy in POINT.iter_unpack(packed[offset:offset + num_points * POINT.size]):
+                x, y = x + dx, y + dy
+                points.append((x / 2, y / 2))
+            offset += num_points * POINT.size
+            if kind not in (LINE, OVAL) or len(points) != num_points or num_points < 1:
+                raise ImageFormatError()
+            strokes.append(Stroke(kind, colour, width, points))
+    except struct.error:
+        raise ImageFormatError()
+    return strokes
+
+
+def rasterize_strokes(strokes, width, height, scale=1):
+    """
+    Return a PIL RGB image of strokes drawn on a white canvas, with their
+    points and widths multiplied by scale.
+    """
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for kind, colour, stroke_width, points in strokes:
+        fill = tuple(colour)
+        points = [(x * scale, y * scale) for x, y in points]
+        if kind == OVAL:
+            (x1, y1), (x2, y2) = points[0], points[-1]
+            draw.ellipse((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)), fill=fill)
+            continue
+        line_width = max(1, round(stroke_width * scale))
+        draw.line(points, fill=fill, width=line_width, joint="curve")
+        # Round the ends of thick lines, like the canvas does.
+        if line_width > 2:
+            radius = line_width / 2
+            for x, y in (points[0], points[-1]):
+                draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=fill)
+    return image
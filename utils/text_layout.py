@@ -0,0 +1,85 @@
+"""
+Works out how tall a message's Text widget must be, in pixels, by wrapping
+its text the way Tk does with wrap=WORD, using the real widths of its
+fonts, but without creating a widget.
+"""
+import re
+
+# Words are measured once and remembered, up to this many per font.
+MAX_CACHED_WORDS = 50000
+TOKEN = re.compile(r"\n|[ \t]+|[^ \t\n]+")
+
+
+class FontMetrics:
+    """
+    Widths of text in one font, remembered per glyph and per word.
+
+    measure is a function returning the width of a string in pixels, such
+    as tkinter.font.Font.measure, and line_height the font's linespace.
+    """
+
+    def __init__(self, measure, line_height):
+        self.measure = measure
+        self.line_height = line_height
+        self.glyphs = {}
+        self.words = {}
+
+    def glyph_width(self, glyph):
+        width = self.glyphs.get(glyph)
+        if width is None:
+            width = self.glyphs[glyph] = self.measure(glyph)
+        return width
+
+    def word_width(self, word):
+        # Words are measured whole, so kerning between glyphs counts.
+        width = self.words.get(word)
+        if width is None:
+            if len(self.words) >= MAX_CACHED_WORDS:
+                self.words.clear()
+            width = self.words[word] = self.measure(word)
+        return width
+
+
+def measure_text(runs, width):
+    """
+    Return the number of lines and the height in pixels of runs of text
+    wrapped to width pixels.
+
+    runs is a list of (text, FontMetrics) pairs, shown one after another.
+    Each line is as tall as the tallest font on it.
+    """
+    line_heights = []
+    line_height = 0  # Tallest font on the current line
+    x = 0
+    for text, metrics in runs:
+        for token in TOKEN.findall(text):
+            if token == "\n":
+                line_heights.append(max(line_height, metrics.line_height))
+                line_height = x = 0
+                continue
+            if token[0] in " \t":
+                # Spaces may run past the end of a line, as in Tk.
+                x += metrics.word_width(token)
+                line_height = max(line_height, metrics.line_height)
+                continue
+            token_width = metrics.word_width(token)
+            # A word that does not fit starts a new line, and a word too
+            # long for any line is then broken between glyphs.
+            if x and x + token_width > width:
+                line_heights.append(line_height)
+                line_height = x = 0
+            line_height = max(line_height, metrics.line_height)
+            if token_width <= width:
+                x += token_width
+                continue
+            for glyph in token:
+                glyph_width = metrics.glyph_width(glyph)
+                if x and x + glyph_width > width:
+                    line_heights.append(line_height)
+                    x = 0
+                x += glyph_width
+    # The last line is shown even if it is empty, as after a newline.
+    if not line_height and runs:
+        line_height = runs[-1][1].line_height
+    line_heights.append(line_height)
+    return len(line_heights), sum(line_heights)
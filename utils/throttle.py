@@ -0,0 +1,46 @@
+from collections import deque
+import time
+
+
+class FailureThrottle:
+    """
+    Block a key, such as an IP address, after too many recent failures.
+
+    A key with max_failures failures in the last window seconds is blocked
+    until the oldest of them is more than window seconds old.
+    """
+
+    def __init__(self, max_failures, window, clock=time.monotonic):
+        self.max_failures = max_failures
+        self.window = window
+        self.clock = clock
+        self.failures = {}  # Key -> deque of failure times, oldest first
+        self.next_sweep = clock() + window
+
+    def is_blocked(self, key):
+        failures = self.failures.get(key)
+        if not failures:
+            return False
+        self.forget_old(key, failures, self.clock())
+        return len(failures) >= self.max_failures
+
+    def record_failure(self, key):
+        now = self.clock()
+        failures = self.failures.setdefault(key, deque())
+        failures.append(now)
+        self.forget_old(key, failures, now)
+        # Now and then drop keys that have not failed for a whole window,
+        # so addresses that never come back do not pile up.
+        if now >= self.next_sweep:
+            for old_key, old_failures in list(self.failures.items()):
+                self.forget_old(old_key, old_failures, now)
+            self.next_sweep = now + self.window
+
+    def reset(self, key):
+        self.failures.pop(key, None)
+
+    def forget_old(self, key, failures, now):
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self.failures[key]
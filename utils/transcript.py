@@ -0,0 +1,78 @@
+"""
+The client's chat transcript, kept as plain data so that only the entries
+on screen need widgets.
+"""
+from bisect import bisect_left, bisect_right
+
+MESSAGE_ENTRY = "message"
+DRAWING_ENTRY = "drawing"
+
+
+class TranscriptEntry:
+    """One message or drawing, and the height its widget takes up."""
+
+    __slots__ = ("kind", "sender", "colour", "body", "height")
+
+    def __init__(self, kind, sender, colour, body, height):
+        self.kind = kind
+        self.sender = sender
+        self.colour = colour
+        self.body = body  # The text of a message, or a drawing's image
+        self.height = height
+
+    def __repr__(self):
+        return f"<TranscriptEntry {self.kind} from {self.sender!r}>"
+
+
+class Transcript:
+    """
+    Every entry shown so far, oldest first, laid out top to bottom with
+    spacing pixels between them.
+
+    offsets[i] is the y of the top of entry i, and offsets[-1] the height
+    of the whole transcript, so the entries in any stretch of it are found
+    by bisecting offsets.
+    """
+
+    def __init__(self, spacing=0):
+        self.spacing = spacing
+        self.entries = []
+        self.offsets = [0]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    @property
+    def height(self):
+        return self.offsets[-1]
+
+    def append(self, entry):
+        self.entries.append(entry)
+        self.offsets.append(self.offsets[-1] + entry.height + self.spacing)
+
+    def prepend(self, entries):
+        """Put entries above everything else. Return how far down that moved it."""
+        self.entries[:0] = entries
+        added = sum(entry.height + self.spacing for entry in entries)
+        # Older history comes in pages, so rebuilding is rare enough.
+        self.offsets = [0]
+        for entry in self.entries:
+            self.offsets.append(self.offsets[-1] + entry.height + self.spacing)
+        return added
+
+    def clear(self):
+        self.entries.clear()
+        self.offsets = [0]
+
+    def top(self, index):
+        """Return the y of the top of entry index's widget."""
+        return self.offsets[index] + self.spacing // 2
+
+    def visible(self, top, bottom):
+        """Return the range of indexes of the entries between y top and bottom."""
+        start = max(bisect_right(self.offsets, top) - 1, 0)
+        end = min(bisect_left(self.offsets, bottom), len(self.entries))
+        return range(start, max(start, end))